@@ -0,0 +1,163 @@
+import asyncio
+import json
+from trello.exceptions import ResourceUnavailable, Unauthorized
+from ratelimit import RequestScheduler
+from resolver import pathCache, walkSteps
+from session import POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, TRELLO_API_ROOT
+from snapshot import BoardRecord, COMMENT_FILTER, listBoards, fetchBoardTree, _deeper
+from metrics import countRequest, section
+
+try:
+	import aiohttp
+except ImportError:
+	# Only the asyncio layer needs it; everything else runs on requests
+	aiohttp = None
+
+class _Reply():
+	# What is left of an aiohttp response once its body has been read and the connection handed back
+	def __init__(self, status, headers, body):
+		self.status = status
+		self.headers = headers
+		self.body = body
+
+	@property
+	def status_code(self):
+		# As on a requests response, which the py-trello exceptions read
+		return self.status
+
+	@property
+	def text(self):
+		return self.body.decode('utf-8', 'replace')
+
+# An asyncio counterpart of the py-trello client, for the calls this plugin makes: fetch_json() has the same
+# arguments and errors, but is a coroutine. Requests share one aiohttp connection pool and go through a
+# ratelimit.RequestScheduler, normally the shared sync client's, so both count against the same limits.
+# Trello accepts the key and token as query parameters, so no OAuth signing is needed.
+class AsyncTrelloClient():
+	def __init__(self, api_key, api_secret=None, token=None, api_root=None, pool_size=POOL_SIZE,
+				 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, scheduler=None):
+		if aiohttp is None:
+			raise ImportError('the asyncio Trello client needs aiohttp (pip install aiohttp)')
+		self.api_key = api_key
+		# Without a token py-trello sends the API secret in its place, and so do we
+		self.token = token if token else api_secret
+		self.api_root = (api_root or TRELLO_API_ROOT).rstrip('/') + '/1'
+		self.pool_size = pool_size
+		self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+		self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+		self.session = None
+
+	async def __aenter__(self):
+		await self.open()
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.close()
+
+	async def open(self):
+		# aiohttp sessions belong to the event loop they were made in, so one is only made once we are in it
+		if self.session is None:
+			self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size),
+												 timeout=self.timeout)
+
+	async def close(self):
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+	async def fetch_json(self, uri_path, http_method='GET', headers=None, query_params=None, post_args=None):
+		await self.open()
+		url = self.api_root + '/' + uri_path.lstrip('/')
+		params = dict((k, str(v).lower() if isinstance(v, bool) else v) for k, v in (query_params or {}).items()
+					  if v is not None)
+		params['key'] = self.api_key
+		params['token'] = self.token
+		headers = dict(headers or {})
+		headers['Accept'] = 'application/json'
+		data = None
+		if post_args is not None:
+			data = json.dumps(post_args)
+			headers['Content-Type'] = 'application/json; charset=utf-8'
+
+		async def send():
+			async with self.session.request(http_method, url, params=params, data=data, headers=headers) as response:
+				return _Reply(response.status, response.headers, await response.read())
+
+		reply = await self.scheduler.sendAsync(url, {'params': params}, send)
+		countRequest(len(reply.body))
+		if reply.status == 401:
+			raise Unauthorized('%s at %s' % (reply.text, url), reply)
+		if reply.status != 200:
+			raise ResourceUnavailable('%s at %s' % (reply.text, url), reply)
+		return json.loads(reply.body.decode('utf-8'))
+
+async def _walkAsync(client, names, known=None):
+	# resolver.walkSteps, driven with awaited requests
+	steps = walkSteps(names, known)
+	try:
+		request = next(steps)
+		while True:
+			try:
+				response = await client.fetch_json(request[0], query_params=request[1])
+			except ResourceUnavailable as e:
+				request = steps.throw(e)
+			else:
+				request = steps.send(response)
+	except StopIteration as done:
+		return done.value
+
+async def resolveIdsAsync(client, *names, known=None):
+	"""
+	resolver.resolveIds for an AsyncTrelloClient, sharing its path cache.
+	:return: The IDs along the path, or None if any part of it does not exist.
+	"""
+	with section('resolve'):
+		ids, used_cache = await _walkAsync(client, names, known)
+		if ids is None and used_cache:
+			# A cached ID may have gone stale (deleted or renamed), so retry once against the live tree
+			pathCache.invalidate(tuple(names[:1]))
+			ids, used_cache = await _walkAsync(client, names, known)
+	return ids
+
+async def getBoardByNameAsync(client, name):
+	"""
+	:return: The board's JSON, or None. py-trello objects need a blocking client, so none are made here.
+	"""
+	ids = await resolveIdsAsync(client, name)
+	if ids is None:
+		return None
+	return await client.fetch_json('/boards/' + ids[0])
+
+async def resolveCardAsync(client, board_name, listname, cardname, board_id=None, list_id=None, card_id=None):
+	"""
+	:return: {'id', 'name', 'idList', 'idBoard'} for the card, or None if it does not exist
+	"""
+	ids = await resolveIdsAsync(client, board_name, listname, cardname, known=[board_id, list_id, card_id])
+	if ids is None:
+		return None
+	return {'id': ids[2], 'name': cardname, 'idList': ids[1], 'idBoard': ids[0]}
+
+async def getJsonStateAsync(client, depth=None, workers=8):
+	"""
+	getJsonState for an AsyncTrelloClient: one request for the boards, then one nested request per board,
+	at most 'workers' at a time, built into the same snapshot records and JSON.
+	"""
+	limit = asyncio.Semaphore(workers)
+	boards = [BoardRecord(client, b) for b in await listBoards(client)]
+
+	async def load(board):
+		async with limit:
+			board.assemble(await fetchBoardTree(client, board.id, depth), depth)
+		if not _deeper(depth, 3):
+			return
+		# Cards with more comments than the board feed carried are topped up now, as the records cannot await
+		for card in [c for l in board.lists for c in l.cards if not c.commentsLoaded()]:
+			async with limit:
+				card.fillComments(await client.fetch_json('/cards/' + card.id + '/actions',
+					query_params={'filter': COMMENT_FILTER}))
+
+	with section('snapshot.fetch'):
+		if _deeper(depth, 1):
+			await asyncio.gather(*(load(board) for board in boards))
+	with section('snapshot.serialize'):
+		return [board.toJson(depth) for board in boards]
@@ -1,115 +1,349 @@
 import os.path
-from trello import TrelloClient
+from trello import TrelloClient, Checklist
 import json
+import threading
+from contextlib import contextmanager
+from resolver import *
+from session import PooledSession
+from ratelimit import carryPriority
+from metrics import metrics, configureMetrics, countCache, section
+from snapshot import Snapshot
+from diff import diffState, hasChanges, applyDiff
+from statestore import getStateStore
+from checkpoint import SnapshotCheckpoint, checkpointPath
+from stateindex import StateIndex, AmbiguousNameError, labelsByName
+from webhooks import webhookEvents, eventMode, startReceiver, registerWebhook
+from feed import readFeed, isCardCreated, isCardMoved, isLabelAdded, isItemChecked
+from batch import asList, batchTargets, runBatch
+from checklists import fetchCardChecklists, setItems, addItem, removeItem, forget as forgetChecklists
+from aiotrello import AsyncTrelloClient, resolveIdsAsync, getBoardByNameAsync, resolveCardAsync, getJsonStateAsync
+
+# Where credentials are read from. Environment variables such as TRELLO_API_KEY (for 'api_key') take precedence.
+KEYS_FILE = 'keys.txt'
+ENV_PREFIX = 'TRELLO_'
+CREDENTIALS = ('api_key', 'api_secret', 'token', 'token_secret')
+
+_keys = {}
+_keys_mtime = None
+_keys_lock = threading.Lock()
+
+def parseKeys(text):
+	# Lines look like name='value'; the quotes are optional and the last line may lack a newline
+	keys = {}
+	for line in text.splitlines():
+		if '=' not in line:
+			continue
+		name, value = line.split('=', 1)
+		value = value.strip()
+		if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+			value = value[1:-1]
+		keys[name.strip()] = value
+	return keys
+
+def loadKeys():
+	"""
+	Returns the parsed keys file, reading it again only when its modification time changes.
+	"""
+	global _keys, _keys_mtime
+	try:
+		mtime = os.path.getmtime(KEYS_FILE)
+	except OSError:
+		mtime = None
+	with _keys_lock:
+		if mtime != _keys_mtime:
+			if mtime is None:
+				_keys = {}
+			else:
+				with open(KEYS_FILE, 'r') as f:
+					_keys = parseKeys(f.read())
+			_keys_mtime = mtime
+		return _keys
 
 def getKey(val):
-	with open('keys.txt', 'r') as f:
-		try:
-			lines = f.readlines()
-			for line in lines:
-				parts = line.split('=')
-				if parts[0] == val:
-					return parts[1][1:-2]
-		except Exception as e:
-			return None
-	return None
-
-# print(getKey('api_key'))
-# print(getKey('api_secret'))
-
-def createClient():
+	env = os.environ.get(ENV_PREFIX + val.upper())
+	if env is not None:
+		return env
+	return loadKeys().get(val)
+
+def createClient(http_service=None):
+	if http_service is None:
+		http_service = PooledSession()
 	token = getKey('token')
 	if token != '' and token != 'your-oauth-token-key':
 		return TrelloClient(
 			api_key=getKey('api_key'),
 			api_secret=getKey('api_secret'),
 			token=token,
-			token_secret=getKey('token_secret')
+			token_secret=getKey('token_secret'),
+			http_service=http_service
 		)
 	return TrelloClient(
 		api_key=getKey('api_key'),
-		api_secret=getKey('api_secret')
+		api_secret=getKey('api_secret'),
+		http_service=http_service
 	)
 
+# The process-wide client shared by every trigger and action, so connections are kept alive between calls.
+_client = None
+_client_credentials = None
+_client_lock = threading.Lock()
+_client_settings = {}
+
+def getClient():
+	global _client, _client_credentials
+	credentials = tuple(getKey(key) for key in CREDENTIALS)
+	with _client_lock:
+		if _client is not None and credentials != _client_credentials:
+			# The keys were rotated underneath us
+			_client.http_service.close()
+			_client = None
+		if _client is None:
+			_client = createClient(PooledSession(**_client_settings))
+			_client_credentials = credentials
+		return _client
+
+def configureClient(pool_size=None, connect_timeout=None, read_timeout=None, host_rate=None, api_root=None,
+					cache_ttl=None):
+	# Settings left as None keep their current value. The shared client is rebuilt on next use.
+	# cache_ttl is how many seconds GET responses are reused for; by default only concurrent identical GETs share one.
+	for key, value in (('pool_size', pool_size), ('connect_timeout', connect_timeout), ('read_timeout', read_timeout),
+					   ('host_rate', host_rate), ('api_root', api_root), ('cache_ttl', cache_ttl)):
+		if value is not None:
+			_client_settings[key] = value
+	resetClient()
+
+def getRequestStats():
+	# Counters from the shared client's request scheduler: requests, throttled, rate_limited and retried
+	return getClient().http_service.scheduler.getStats()
+
+def resetClient():
+	global _client
+	with _client_lock:
+		if _client is not None:
+			_client.http_service.close()
+		_client = None
+
+def createAsyncClient():
+	"""
+	Returns an asyncio client (see aiotrello.py) with the shared client's keys, settings and rate limits.
+	Use it as 'async with createAsyncClient() as client:', inside the event loop it will run on.
+	"""
+	token = getKey('token')
+	settings = dict((k, v) for k, v in _client_settings.items() if k not in ('host_rate', 'cache_ttl'))
+	return AsyncTrelloClient(getKey('api_key'), getKey('api_secret'),
+							 token if token != 'your-oauth-token-key' else None,
+							 scheduler=getClient().http_service.scheduler, **settings)
+
 def getBoardByName(name):
-	client = createClient()
-
-	for board in client.list_boards():
-		if board.name == name:
-			return board
-	return None
-
-def getJsonState(depth=None):
-	client = createClient()
-
-	total_json = []
-
-	for board in client.list_boards():
-		json_obj = {
-			'name': board.name,
-			'id': board.id,
-			'lists': [],
-			'closed': board.closed
-		}
-		if depth is None or depth >= 1:
-			for list in board.list_lists():
-				list_obj = {
-					'name': list.name,
-					'closed': list.closed,
-					'id': list.id,
-					'cards': []
-				}
-				if depth is None or depth >= 2:
-					for card in list.list_cards():
-						card_obj = {
-							'name': card.name,
-							'description': card.description,
-							'attachments': card.attachments,
-							'badges': card.badges,
-							'closed': card.closed,
-							'creation_date': card.card_created_date.strftime('%c'),
-							'last_activity': card.date_last_activity.strftime('%c'),
-							'idmembers': card.idMembers,
-							'labels': [],
-							'checklists': [],
-							'comments': []
-						}
-						if depth is None or depth >= 3:
-							for label in (card.labels if card.labels else []):
-								label_obj = {
-									'name': label.name,
-									'color': label.color,
-									'id': label.id
-								}
-								card_obj['labels'].append(label_obj)
-							for checklist in (card.checklists if card.checklists else []):
-								check_obj = {
-									'name': checklist.name,
-									'id': checklist.id,
-									'items': []
-								}
-								if depth is None or depth >= 4:
-									for item in (checklist.items if checklist.items else []):
-										item_obj = {
-											'name': item['name'],
-											'checked': item['checked']
-										}
-										check_obj['items'].append(item_obj)
-								card_obj['checklists'].append(check_obj)
-							for comment in (card.comments if card.comments else []):
-								card_obj['comments'].append(comment)
-						list_obj['cards'].append(card_obj)
-				json_obj['lists'].append(list_obj)
-		total_json.append(json_obj)
-
-	return total_json
+	client = getClient()
+
+	ids = resolveIds(client, name)
+	if ids is None:
+		return None
+	return client.get_board(ids[0])
+
+def getBoardLabel(board, name):
+	# The first of the board's labels with this name, or None
+	return labelsByName(board.get_labels()).get(name)
+
+def getCardChecklists(card):
+	# Cards built from resolved IDs carry no checklist counts, so ask for the checklists directly
+	return [Checklist(card.client, cl, trello_card=card.id) for cl in fetchCardChecklists(card.client, card.id)]
+
+def checklistIds(card, targets):
+	# What checklist actions report: the card's IDs, as far as they are known, and the checklists'
+	ids = cardIds(card) if card is not None else {'board_id': None, 'list_id': None, 'card_id': targets[0][0]}
+	ids['checklist_id'] = targets[0][1] if len(targets) == 1 else [id for card_id, id in targets]
+	return ids
+
+def withChecklistCard(client, names, ids, use, resolve=True):
+	"""
+	Runs a checklist action's use(card_id) on the card at names (board, list, card) or ids (board_id, list_id,
+	card_id), see resolver.withCard. With resolve off the card is not looked up, and use() gets None.
+	:return: (card or None, what use() returned), or (None, None) if the card cannot be found
+	"""
+	if not resolve:
+		return None, use(None)
+	found = withCard(client, *names, lambda card: (card, use(card.id)), *ids)
+	return found if found is not None else (None, None)
+
+# How many boards are snapshotted at once. Keep it at or below the client's pool size.
+SNAPSHOT_WORKERS = 8
+
+def fetchJsonState(depth=None, workers=None):
+	# One request for the boards, then one nested request per board (on a pool) for everything below it
+	snapshot = Snapshot(getClient())
+	with section('snapshot.fetch'):
+		snapshot.load(depth, workers or SNAPSHOT_WORKERS)
+	with section('snapshot.serialize'):
+		return snapshot.toJson(depth)
+
+# Per-thread memos for sharedSnapshots(); None outside of one
+_shared = threading.local()
+
+@contextmanager
+def sharedSnapshots():
+	"""
+	Within this block getJsonState fetches each depth once, and updateStateFile diffs each snapshot once,
+	so every trigger checked together sees the same data and the same changes. Blocks nest: an inner one shares
+	the outer one's memos, and leaving it puts back whatever was there before.
+	"""
+	snapshots = getattr(_shared, 'snapshots', None)
+	updates = getattr(_shared, 'updates', None)
+	_shared.snapshots = {} if snapshots is None else snapshots
+	_shared.updates = {} if updates is None else updates
+	try:
+		yield
+	finally:
+		_shared.snapshots = snapshots
+		_shared.updates = updates
+
+def getJsonState(depth=None, workers=None):
+	snapshots = getattr(_shared, 'snapshots', None)
+	if snapshots is None:
+		return fetchJsonState(depth, workers)
+	countCache('snapshot', depth in snapshots)
+	if depth not in snapshots:
+		snapshots[depth] = fetchJsonState(depth, workers)
+	return snapshots[depth]
+
+def streamJsonState(depth=None, workers=None, exclude=()):
+	"""
+	getJsonState one board at a time, for writing straight out: at most 'workers' boards are held at once.
+	:param exclude: Card fields to leave out, and not fetch, such as 'attachments' or 'comments'
+	"""
+	return Snapshot(getClient()).stream(depth, workers or SNAPSHOT_WORKERS, exclude)
+
+# One lock per state file, so the threads a host runs triggers on do not record, checkpoint or patch the same
+# file at once
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+def stateFileLock(filepath):
+	# Re-entrant, so code already holding it can still call the functions that take it
+	key = os.path.abspath(filepath)
+	with _path_locks_lock:
+		lock = _path_locks.get(key)
+		if lock is None:
+			lock = _path_locks[key] = threading.RLock()
+		return lock
+
+@contextmanager
+def checkpointedSnapshot(filepath, depth=None, exclude=(), workers=None):
+	"""
+	Yields (boards, snapshot): streamJsonState() for writing to filepath, checkpointing every board as it is done.
+	A board that fails is retried on its own; if it keeps failing, the boards after it are still fetched before
+	snapshot.IncompleteSnapshotError is raised, and the next call for filepath resumes from the checkpoint.
+	The checkpoint is removed once the block completes.
+	"""
+	with stateFileLock(filepath):
+		snapshot = Snapshot(getClient())
+		checkpoint = SnapshotCheckpoint(checkpointPath(filepath), depth, exclude)
+		try:
+			yield snapshot.stream(depth, workers or SNAPSHOT_WORKERS, exclude, checkpoint), snapshot
+		finally:
+			checkpoint.close()
+		checkpoint.clear()
 
 def recordStateToFile(filepath):
-	total_json = getJsonState()
+	# Streamed, so recording a large workspace does not hold all of it in memory, and resumable. It is stamped with
+	# when the snapshot was started, as boards resumed from a checkpoint may be that old.
+	with section('snapshot.record'), checkpointedSnapshot(filepath) as (boards, snapshot):
+		getStateStore(filepath).save(boards, snapshot.timings, snapshot.started)
+
+def exportState(filepath, depth=None, exclude=(), workers=None):
+	"""
+	Streams the workspace to filepath in the format its name picks (see statestore.getStateStore): '.json' for one
+	JSON array, anything else for the line store. A '.gz' or '.zst' suffix compresses it.
+	:return: How many boards were written
+	"""
+	count = [0]
+
+	def counted(boards):
+		for board in boards:
+			count[0] += 1
+			yield board
+
+	with section('snapshot.export'), checkpointedSnapshot(filepath, depth, exclude, workers) as (boards, snapshot):
+		getStateStore(filepath).write(counted(boards))
+	return count[0]
+
+def writeJsonToFile(filepath, total_json):
+	with stateFileLock(filepath):
+		getStateStore(filepath).save(total_json)
+
+def updateStateFile(filepath, now_json, depth=0, add_boards=True):
+	"""
+	Diffs a fresh snapshot against the one stored at filepath and writes back only what changed.
+	:param add_boards: False leaves boards that are not stored yet out of the diff, and so out of the file, for the
+	                   board triggers to find
+	:return: The changes, as returned by diffState
+	"""
+	updates = getattr(_shared, 'updates', None)
+	key = (os.path.abspath(filepath), depth, add_boards, id(now_json))
+	if updates is not None and key in updates:
+		return updates[key]
+	store = getStateStore(filepath)
+	# Held from the read to the patch, or a concurrent update could patch the file in between
+	with stateFileLock(filepath):
+		with section('state.diff'):
+			old_json = store.read(depth=depth)
+			if not add_boards:
+				stored = set(board['id'] for board in old_json)
+				now_json = [board for board in now_json if board['id'] in stored]
+			changes = diffState(old_json, now_json, depth)
+		if hasChanges(changes):
+			with section('state.write'):
+				store.patch(changes)
+	if updates is not None:
+		updates[key] = changes
+	return changes
+
+def loadJsonFromFile(filepath, depth=None, board_ids=None):
+	return getStateStore(filepath).read(depth=depth, board_ids=board_ids)
+
+def loadStateIndex(filepath, depth=None, board_ids=None):
+	# Name and ID lookups over the recorded state, see stateindex.StateIndex
+	return getStateStore(filepath).index(depth=depth, board_ids=board_ids)
+
+# Read-only actions may answer from the recorded state instead of the API while it is younger than
+# 'offline_max_age' seconds (unset turns this off). With 'offline_fallback' on, names missing from it are
+# looked up live, in case they are newer than the recording.
+def offlineMaxAge():
+	value = getKey('offline_max_age')
+	return float(value) if value else None
+
+def offlineFallback():
+	return (getKey('offline_fallback') or 'true').lower() not in ('false', 'no', 'off', '0')
 
-	with open(filepath, 'w+') as f:
-		f.write(json.dumps(total_json))
+def recordedIndex(filepath, depth=None):
+	"""
+	Returns an index over the recorded state if offline answers are enabled and it is fresh enough, otherwise None.
+	:param depth: How deep to read the state, as for getJsonState. Shallower reads skip the deeper lines unparsed.
+	"""
+	max_age = offlineMaxAge()
+	if max_age is None:
+		return None
+	store = getStateStore(filepath)
+	age = store.age()
+	if age is None or age > max_age:
+		return None
+	try:
+		return store.index(depth=depth)
+	except (IOError, ValueError):
+		return None
 
-def loadJsonFromFile(filepath):
-	with open(filepath, 'r') as f:
-		return json.loads(f.readline())
\ No newline at end of file
+def lookupRecorded(filepath, *names, depth=None):
+	"""
+	Resolves a (board_name[, listname[, cardname]]) path against the recorded state, see recordedIndex.
+	:param depth: How deep the index has to go; by default just deep enough for the path
+	:return: (index, ids) with ids as from resolveIds. index is None when the API has to be asked instead,
+	         which includes misses while 'offline_fallback' is on.
+	"""
+	index = recordedIndex(filepath, len(names) - 1 if depth is None else depth)
+	if index is None:
+		return None, None
+	ids = index.resolve(*names)
+	if ids is None and offlineFallback():
+		return None, None
+	return index, ids
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from ratelimit import carryPriority
+from trello import Board, List, Card
+from trello.exceptions import ResourceUnavailable
+from resolver import resolveBoard, pathCache
+
+# How many mutations a batch action sends at once
+BATCH_WORKERS = 8
+
+def asList(value):
+	if value is None:
+		return []
+	if isinstance(value, list):
+		return value
+	return [value]
+
+def boardCardIds(client, board):
+	"""
+	Fetches every open card on a board in one request.
+	:return: ({(listname, cardname): (list_id, card_id)}, keeping the first card when names repeat,
+	          {card_id: list_id} for every card)
+	"""
+	tree = client.fetch_json('/boards/' + board.id, query_params={
+		'fields': 'name', 'lists': 'all', 'list_fields': 'name', 'cards': 'open', 'card_fields': 'name,idList'})
+	list_names = dict((l['id'], l['name']) for l in tree['lists'])
+	cards = {}
+	ids = {}
+	for card in tree['cards']:
+		ids[card['id']] = card['idList']
+		key = (list_names.get(card['idList']), card['name'])
+		if key not in cards:
+			cards[key] = (card['idList'], card['id'])
+			# We paid for these, so let the single-card actions use them too
+			if board.name:
+				pathCache.put((board.name,) + key, card['id'])
+	return cards, ids
+
+def batchTargets(client, board_name, listnames, cardnames, card_ids=None, board_id=None):
+	"""
+	Resolves a batch of cards on one board.
+	:param listnames: One list name, used for every card, or one per card name
+	:param cardnames: One or more card names
+	:param card_ids: One or more card IDs. With a board, only those of its open cards are found; without one, they
+	                 are used as they are, and their cards have a board with a None ID.
+	:param board_id: The board's ID, if known, in place of its name
+	:return: [(key, card or None)] where key is 'listname/cardname' or the card ID
+	"""
+	listnames = asList(listnames)
+	cardnames = asList(cardnames)
+	if len(listnames) == 1:
+		listnames = listnames * len(cardnames)
+
+	card_ids = asList(card_ids)
+	board = resolveBoard(client, board_name, board_id)
+	cards, ids = {}, {}
+	if board is not None and len(cardnames) + len(card_ids) > 0:
+		cards, ids = boardCardIds(client, board)
+	targets = []
+	for listname, cardname in zip(listnames, cardnames):
+		found = cards.get((listname, cardname))
+		card = None
+		if found is not None:
+			card = Card(List(board, found[0], name=listname), found[1], name=cardname)
+		targets.append((listname + '/' + cardname, card))
+	for card_id in card_ids:
+		card = None
+		if board_name is None and board_id is None:
+			card = Card(List(Board(client, board_id=None), None), card_id)
+		elif card_id in ids:
+			card = Card(List(board, ids[card_id]), card_id)
+		targets.append((card_id, card))
+	return targets
+
+def runBatch(targets, mutation, workers=BATCH_WORKERS):
+	"""
+	Applies mutation(card) to every resolved target with bounded parallelism.
+	A mutation that returns a status string, such as 'notfound' when what it changes is not on the card, has that
+	reported in place of 'ok'. A 404 is reported as 'notfound' too, as for a card ID that does not exist.
+	:return: {key: 'ok' | 'notfound' | 'error: <message>'}
+	"""
+	def run(target):
+		key, card = target
+		if card is None:
+			return key, 'notfound'
+		try:
+			status = mutation(card)
+			return key, status if isinstance(status, str) else 'ok'
+		except ResourceUnavailable as e:
+			return key, 'notfound' if getattr(e, '_status', None) == 404 else 'error: ' + str(e)
+		except Exception as e:
+			return key, 'error: ' + str(e)
+
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		return dict(pool.map(carryPriority(run), targets))
@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Workspace sizes: boards, lists per board, cards per list
+SCALES = {'small': (5, 4, 10), 'medium': (20, 10, 50), 'large': (500, 50, 200)}
+DEPTHS = [0, 1, 2, 3, 4]
+REPEAT = 5
+# A run regresses when it needs more requests than the baseline, or is this much slower or bigger
+TOLERANCE = 0.2
+BASELINE_FILE = 'bench_baseline.json'
+
+# What every trigger and action is called with, by argument name. The names match the fake workspace.
+ARGUMENTS = {
+	'board_name': 'Board 0', 'board_names': 'Bench board', 'permissions': None,
+	'listname': 'List 0', 'listnames': 'List 0', 'cardname': 'Card 0', 'cardnames': ['Card 0', 'Card 1'],
+	'card_ids': None, 'checklist': 'Checklist 0', 'item': 'Item 0', 'items': ['Item 0', 'Item 1', 'Item 2'],
+	'onoff': True, 'checked': False,
+	'comment_string': 'Benchmark comment', 'label_string': 'Label 0', 'color': 'green', 'name': 'Bench label',
+	'filepath': 'export.jsonl.gz', 'exclude': None
+}
+
+def startServer(scale, latency, checklists, items, comments):
+	# The fake server runs in its own process so that it does not count towards our memory
+	boards, lists, cards = scale
+	here = os.path.dirname(os.path.abspath(__file__))
+	process = subprocess.Popen([sys.executable, os.path.join(here, 'faketrello.py'), '--boards', str(boards),
+								'--lists', str(lists), '--cards', str(cards), '--checklists', str(checklists),
+								'--items', str(items), '--comments', str(comments), '--latency', str(latency)],
+							   stdout=subprocess.PIPE, universal_newlines=True)
+	return process, process.stdout.readline().strip()
+
+def percentile(values, p):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+def resetCaches():
+	# Every run starts cold, so runs are comparable with each other and with the baseline
+	import base
+	import checklists
+	import resolver
+	import statestore
+	base.getClient().http_service.flights.clear()
+	resolver.pathCache.clear()
+	checklists.checklistCache.clear()
+	checklists.itemCache.clear()
+	with statestore._read_cache_lock:
+		statestore._read_cache.clear()
+
+def runScenario(fn, repeat):
+	from metrics import measure
+	timings = []
+	requests = []
+	transferred = []
+	for i in range(repeat):
+		resetCaches()
+		with contextlib.redirect_stdout(io.StringIO()), measure('bench', 'bench') as measurement:
+			start = time.perf_counter()
+			fn()
+			timings.append(time.perf_counter() - start)
+		requests.append(measurement.counts['http_requests'])
+		transferred.append(measurement.counts['http_bytes'])
+
+	# Tracing slows everything down, so memory gets a run of its own
+	resetCaches()
+	tracemalloc.start()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			fn()
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return {
+		'requests': max(requests),
+		'bytes': max(transferred),
+		'p50_ms': percentile(timings, 50) * 1000,
+		'p90_ms': percentile(timings, 90) * 1000,
+		'p99_ms': percentile(timings, 99) * 1000,
+		'peak_kb': peak / 1024.0
+	}
+
+def scenarios(plugin):
+	"""
+	Yields (name, function) for getJsonState at every depth, then every trigger and action of the plugin.
+	"""
+	for depth in DEPTHS:
+		yield 'getJsonState(depth=%d)' % depth, (lambda depth: lambda: plugin.getJsonState(depth=depth))(depth)
+	for name in sorted(dir(plugin)):
+		f = getattr(plugin, name)
+		if not (getattr(f, 'trigger', False) or getattr(f, 'action', False)):
+			continue
+		params = inspect.signature(f).parameters
+		missing = [p for p in params if p not in ARGUMENTS and params[p].default is inspect.Parameter.empty]
+		if missing:
+			print('skipping %s: no benchmark value for %s' % (name, ', '.join(missing)), file=sys.stderr)
+			continue
+		args = dict((p, ARGUMENTS[p]) for p in params if p in ARGUMENTS)
+		yield name, (lambda f, args: lambda: f(**args))(f, args)
+
+def compare(results, baseline, tolerance):
+	regressions = []
+	for name, result in results.items():
+		before = baseline.get(name)
+		if before is None:
+			continue
+		if result['requests'] > before['requests']:
+			regressions.append('%s: %d requests, was %d' % (name, result['requests'], before['requests']))
+		# Anything within a millisecond is noise
+		if result['p50_ms'] > before['p50_ms'] * (1 + tolerance) and result['p50_ms'] - before['p50_ms'] > 1:
+			regressions.append('%s: p50 %.1f ms, was %.1f ms' % (name, result['p50_ms'], before['p50_ms']))
+		if result['peak_kb'] > before['peak_kb'] * (1 + tolerance) and result['peak_kb'] - before['peak_kb'] > 64:
+			regressions.append('%s: peak %.0f KiB, was %.0f KiB' % (name, result['peak_kb'], before['peak_kb']))
+	return regressions
+
+def report(results):
+	lines = ['%-40s %9s %11s %9s %9s %9s %10s' % ('scenario', 'requests', 'bytes', 'p50 ms', 'p90 ms', 'p99 ms',
+														'peak KiB')]
+	for name, r in results.items():
+		lines.append('%-40s %9d %11d %9.1f %9.1f %9.1f %10.0f' % (name, r['requests'], r['bytes'], r['p50_ms'],
+																	 r['p90_ms'], r['p99_ms'], r['peak_kb']))
+	return '\n'.join(lines)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the plugin against a local fake Trello server.')
+	parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+	parser.add_argument('--boards', type=int, help='Overrides the scale')
+	parser.add_argument('--lists', type=int, help='Overrides the scale')
+	parser.add_argument('--cards', type=int, help='Overrides the scale')
+	parser.add_argument('--checklists', type=int, default=1, help='Checklists per card')
+	parser.add_argument('--items', type=int, default=3, help='Items per checklist')
+	parser.add_argument('--comments', type=int, default=1, help='Comments per card')
+	parser.add_argument('--latency', type=float, default=20.0, help='Server delay per call, in milliseconds')
+	parser.add_argument('--repeat', type=int, default=REPEAT, help='Timed runs per scenario')
+	parser.add_argument('--rate', type=float, default=1e6,
+						help='Requests per second allowed per host, key and token (default: effectively unlimited)')
+	parser.add_argument('--only', help='Run only the scenarios whose name contains this')
+	parser.add_argument('--baseline', default=BASELINE_FILE, help='Results to compare against')
+	parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+	parser.add_argument('--output', help='Also write the report to this file')
+	args = parser.parse_args()
+
+	scale = list(SCALES[args.scale])
+	for i, override in enumerate((args.boards, args.lists, args.cards)):
+		if override is not None:
+			scale[i] = override
+	settings = {'scale': scale, 'checklists': args.checklists, 'items': args.items, 'comments': args.comments,
+				'latency': args.latency, 'repeat': args.repeat}
+	baseline_path = os.path.abspath(args.baseline)
+	output_path = os.path.abspath(args.output) if args.output else None
+
+	# The plugin reads keys.txt and writes its state files in the working directory, so give it a scratch one
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	os.environ.update({'TRELLO_API_KEY': 'bench', 'TRELLO_API_SECRET': 'bench', 'TRELLO_TOKEN': ''})
+	workdir = tempfile.mkdtemp(prefix='trello-bench-')
+	os.chdir(workdir)
+	server, url = startServer(scale, args.latency, args.checklists, args.items, args.comments)
+	try:
+		import plugin
+		plugin.configureClient(api_root=url, host_rate=args.rate)
+		scheduler = plugin.getClient().http_service.scheduler
+		scheduler.key_rate = scheduler.token_rate = args.rate
+		plugin.writeJsonToFile(plugin.STATE_FILE, plugin.getJsonState(depth=0))
+
+		results = {}
+		failed = []
+		for name, fn in scenarios(plugin):
+			if args.only and args.only not in name:
+				continue
+			try:
+				results[name] = runScenario(fn, args.repeat)
+			except Exception as e:
+				failed.append('%s: %s: %s' % (name, type(e).__name__, e))
+				print('FAILED ' + failed[-1], file=sys.stderr)
+				continue
+			print(report({name: results[name]}).splitlines()[1], file=sys.stderr)
+	finally:
+		server.terminate()
+		server.wait()
+
+	text = 'settings: %s\n%s' % (json.dumps(settings), report(results))
+	for line in failed:
+		text += '\nFAILED ' + line
+	print(text)
+	if output_path:
+		with open(output_path, 'w') as f:
+			f.write(text + '\n')
+
+	status = 1 if failed else 0
+	if os.path.exists(baseline_path):
+		with open(baseline_path, 'r') as f:
+			baseline = json.loads(f.read())
+		if baseline.get('settings') != settings:
+			print('baseline was taken with other settings, not comparing', file=sys.stderr)
+		else:
+			regressions = compare(results, baseline['results'], args.tolerance)
+			for line in regressions:
+				print('REGRESSION ' + line)
+			status = 1 if regressions or failed else 0
+	if args.save_baseline:
+		with open(baseline_path, 'w') as f:
+			f.write(json.dumps({'settings': settings, 'results': results}, indent=1))
+	sys.exit(status)
@@ -0,0 +1,153 @@
+from trello.exceptions import ResourceUnavailable
+from resolver import PathCache
+from batch import runBatch
+from metrics import section
+
+# Checklist and item IDs by name, so repeated checklist operations on a card skip the lookup.
+# checklistCache: (card_id, checklist name) -> [checklist ids], as names may repeat on a card.
+# itemCache: (checklist_id,) -> card_id and (checklist_id, item name) -> item id, keeping the first of a name.
+# Like the path cache, entries expire, and an ID that turns out stale is dropped and looked up again.
+checklistCache = PathCache(name='checklist')
+itemCache = PathCache(name='item')
+
+def _rememberItems(checklist):
+	itemCache.invalidate((checklist['id'],))
+	itemCache.put((checklist['id'],), checklist['idCard'])
+	seen = set()
+	for item in sorted(checklist.get('checkItems', []), key=lambda i: i.get('pos')):
+		if item['name'] not in seen:
+			seen.add(item['name'])
+			itemCache.put((checklist['id'], item['name']), item['id'])
+
+def fetchCardChecklists(client, card_id):
+	"""
+	Fetches every checklist on a card, with its items, in one request, and remembers their IDs.
+	:return: The checklists' JSON, in order
+	"""
+	with section('card.checklists'):
+		json_obj = sorted(client.fetch_json('/cards/' + card_id + '/checklists'), key=lambda cl: cl['pos'])
+	named = {}
+	for checklist in json_obj:
+		named.setdefault(checklist['name'], []).append(checklist['id'])
+		_rememberItems(checklist)
+	checklistCache.invalidate((card_id,))
+	for name, ids in named.items():
+		checklistCache.put((card_id, name), ids)
+	return json_obj
+
+def fetchChecklist(client, checklist_id):
+	with section('card.checklists'):
+		json_obj = client.fetch_json('/checklists/' + checklist_id)
+	_rememberItems(json_obj)
+	return json_obj
+
+def checklistTargets(client, card_id, checklist, checklist_id=None, refresh=False):
+	"""
+	:param checklist_id: Used in place of the card's checklists named 'checklist'; card_id may then be None
+	:param refresh: Ignore what is cached
+	:return: [(card_id, checklist_id)] for every matching checklist
+	"""
+	if checklist_id is not None:
+		owner = None if refresh else itemCache.get((checklist_id,))
+		if owner is None:
+			owner = fetchChecklist(client, checklist_id)['idCard']
+		return [(owner, checklist_id)]
+	if card_id is None:
+		return []
+	ids = None if refresh else checklistCache.get((card_id, checklist))
+	if ids is None:
+		fetchCardChecklists(client, card_id)
+		ids = checklistCache.get((card_id, checklist)) or []
+	return [(card_id, id) for id in ids]
+
+def itemId(client, checklist_id, item, refresh=False):
+	# The ID of the first item with this name on the checklist, or None
+	id = None if refresh else itemCache.get((checklist_id, item))
+	if id is None:
+		fetchChecklist(client, checklist_id)
+		id = itemCache.get((checklist_id, item))
+	return id
+
+def forget(card_id=None, checklist_id=None):
+	if card_id is not None:
+		checklistCache.invalidate((card_id,))
+	if checklist_id is not None:
+		itemCache.invalidate((checklist_id,))
+
+def itemTargets(client, targets, item, refresh=False):
+	"""
+	:param targets: From checklistTargets
+	:return: [(card_id, checklist_id, item_id)] for the item on every checklist that has it, or None if none does
+	"""
+	found = []
+	for card_id, checklist_id in targets:
+		id = itemId(client, checklist_id, item, refresh)
+		if id is not None:
+			found.append((card_id, checklist_id, id))
+	return found or None
+
+def setItems(client, card_id, checklist, states, checklist_id=None):
+	"""
+	Checks or unchecks several items of a card's checklist in one pass: the checklist and its items are looked up
+	once (or not at all when cached), then the updates go out together on the batch pool.
+	:param states: {item name: True to check it, False to uncheck it}
+	:return: ([(card_id, checklist_id)], {item name: 'ok' | 'notfound' | 'error: <message>'})
+	"""
+	targets = checklistTargets(client, card_id, checklist, checklist_id)
+	if len(targets) == 0:
+		return targets, dict((item, 'notfound') for item in states)
+
+	def update(job):
+		item, found = job
+		try:
+			_put(client, found, states[item])
+		except ResourceUnavailable:
+			# A cached ID went stale, so look everything up again and retry once
+			for owner, id in targets:
+				forget(owner, id)
+			fresh = checklistTargets(client, card_id, checklist, checklist_id, refresh=True)
+			found = itemTargets(client, fresh, item)
+			if found is None:
+				raise
+			_put(client, found, states[item])
+
+	jobs = [(item, itemTargets(client, targets, item)) for item in states]
+	return targets, runBatch([(item, (item, found) if found is not None else None) for item, found in jobs], update)
+
+def _put(client, found, checked):
+	for card_id, checklist_id, item_id in found:
+		client.fetch_json('/cards/' + card_id + '/checklist/' + checklist_id + '/checkItem/' + item_id,
+						  http_method='PUT', query_params={'state': 'complete' if checked else 'incomplete'})
+
+def addItem(client, card_id, checklist, item, checked=False, checklist_id=None):
+	"""
+	Adds an item to the card's checklists named 'checklist', or to the one with checklist_id, which then takes a
+	single request.
+	:return: [(card_id, checklist_id)] for the checklists it was added to
+	"""
+	if checklist_id is not None:
+		targets = [(card_id, checklist_id)]
+	else:
+		targets = checklistTargets(client, card_id, checklist)
+	for owner, id in targets:
+		json_obj = client.fetch_json('/checklists/' + id + '/checkItems', http_method='POST',
+									 post_args={'name': item, 'checked': checked})
+		if itemCache.get((id, item)) is None:
+			itemCache.put((id, item), json_obj['id'])
+	return targets
+
+def removeItem(client, card_id, checklist, item, checklist_id=None):
+	"""
+	Deletes the first item with this name from each of the card's checklists named 'checklist', or from the one
+	with checklist_id.
+	:return: ([(card_id, checklist_id)], whether any item was found)
+	"""
+	targets = checklistTargets(client, card_id, checklist, checklist_id)
+	found = itemTargets(client, targets, item) or []
+	for owner, id, item_id in found:
+		try:
+			client.fetch_json('/checklists/' + id + '/checkItems/' + item_id, http_method='DELETE')
+		finally:
+			# Another item may carry the same name, so look it up afresh next time
+			itemCache.invalidate((id, item))
+	return targets, len(found) > 0
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from statestore import uncompressedPath
+
+# How old (in seconds) an unfinished snapshot's checkpoint may be and still be resumed. Older ones are started
+# over, as boards fetched that far apart no longer make one snapshot.
+CHECKPOINT_MAX_AGE = 3600
+
+def checkpointPath(filepath):
+	# Sits next to the state file, e.g. state.jsonl -> state.checkpoint.jsonl
+	return os.path.splitext(uncompressedPath(filepath))[0] + '.checkpoint.jsonl'
+
+# The boards of a snapshot in progress: a header line saying what is being taken, then one line per finished
+# board, '<board id>\t<timing JSON>\t<board JSON>'. Boards are appended as they finish, so a run that fails part
+# way leaves them for the next run to resume from. Only their offsets stay in memory; a board is read back when
+# it is needed. A checkpoint for another depth or exclude, or older than max_age, is discarded.
+class SnapshotCheckpoint():
+	def __init__(self, filepath, depth=None, exclude=(), max_age=CHECKPOINT_MAX_AGE):
+		self.filepath = filepath
+		self.header = {'depth': depth, 'exclude': sorted(exclude)}
+		self.max_age = max_age
+		# {board id: offset of its line}, and {board id: its timing} as Snapshot.timings has them
+		self.offsets = {}
+		self.timings = {}
+		# When the snapshot it holds was started, which for a resumed one is when an earlier run began it
+		self.started = None
+		self._file = None
+
+	def _open(self):
+		if self._file is not None:
+			return
+		end = self._resume()
+		if end is None:
+			self.offsets = {}
+			self.timings = {}
+			self._file = open(self.filepath, 'wb')
+			self.started = time.time()
+			header = dict(self.header, started=self.started)
+			self._file.write((json.dumps(header) + '\n').encode('utf-8'))
+			self._file.flush()
+			return
+		self._file = open(self.filepath, 'r+b')
+		# Drops a line left half written by a run that died mid-write
+		self._file.truncate(end)
+		self._file.seek(end)
+
+	def _resume(self):
+		# Reads back the offsets of a checkpoint worth resuming; returns where its last whole line ends, or None
+		try:
+			with open(self.filepath, 'rb') as f:
+				header = json.loads(f.readline().decode('utf-8'))
+				if dict((k, header.get(k)) for k in self.header) != self.header or \
+						time.time() - header.get('started', 0) > self.max_age:
+					return None
+				self.started = header['started']
+				end = f.tell()
+				for line in iter(f.readline, b''):
+					if not line.endswith(b'\n'):
+						break
+					id, timing, rest = line.split(b'\t', 2)
+					id = id.decode('utf-8')
+					self.offsets[id] = end
+					self.timings[id] = json.loads(timing.decode('utf-8'))
+					end = f.tell()
+				return end
+		except (IOError, ValueError):
+			return None
+
+	def done(self):
+		# The IDs of the boards already checkpointed
+		self._open()
+		return set(self.offsets)
+
+	def has(self, board_id):
+		return board_id in self.offsets
+
+	def get(self, board_id):
+		with open(self.filepath, 'rb') as f:
+			f.seek(self.offsets[board_id])
+			return json.loads(f.readline().decode('utf-8').split('\t', 2)[2])
+
+	def add(self, board, timing):
+		self._open()
+		offset = self._file.tell()
+		line = '%s\t%s\t%s\n' % (board['id'], json.dumps(timing), json.dumps(board))
+		self._file.write(line.encode('utf-8'))
+		# Flushed at once, so the board survives the process dying
+		self._file.flush()
+		self.offsets[board['id']] = offset
+		self.timings[board['id']] = timing
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def clear(self):
+		# Once the snapshot is saved, the checkpoint has served its purpose
+		self.close()
+		self.offsets = {}
+		self.timings = {}
+		if os.path.exists(self.filepath):
+			os.remove(self.filepath)
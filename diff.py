@@ -0,0 +1,223 @@
+# Computes what changed between two getJsonState snapshots, keyed by Trello ID rather than by name,
+# and patches a stored snapshot with just those changes.
+# Entities live at one depth each: boards at 0, lists at 1 and cards at 2.
+# Records carry the content hashes from snapshot.contentHash, which cover everything under them, so
+# subtrees whose hashes match on both sides are skipped without looking inside.
+LEVELS = ['boards', 'lists', 'cards']
+CHILDREN = {'boards': 'lists', 'lists': 'cards'}
+
+def _levels(depth):
+	if depth is None:
+		return LEVELS
+	return LEVELS[:depth + 1]
+
+def indexState(state, depth=None, skip=frozenset()):
+	"""
+	Indexes a snapshot by ID.
+	:param skip: IDs to leave out, along with everything under them
+	:return: {'boards': {id: (record, None)}, 'lists': {id: (record, board_id)}, 'cards': {id: (record, list_id)}}
+	         for each level up to depth.
+	"""
+	levels = _levels(depth)
+	index = dict((level, {}) for level in levels)
+	for board in state:
+		if board['id'] in skip:
+			continue
+		index['boards'][board['id']] = (board, None)
+		if 'lists' not in index:
+			continue
+		for list in board.get('lists', []):
+			if list['id'] in skip:
+				continue
+			index['lists'][list['id']] = (list, board['id'])
+			if 'cards' not in index:
+				continue
+			for card in list.get('cards', []):
+				if 'id' in card and card['id'] not in skip:
+					index['cards'][card['id']] = (card, list['id'])
+	return index
+
+def _comparable(old_rec, new_rec):
+	# Hashes say something only when both were built to the same depth
+	old_hash, new_hash = old_rec.get('hash'), new_rec.get('hash')
+	return old_hash is not None and new_hash is not None and old_hash.split(':')[0] == new_hash.split(':')[0]
+
+def _unchanged(old, new, depth):
+	# The IDs of records whose hash matches the one under the same parent on the other side. Nothing in their
+	# subtrees changed, moved in or moved out, so the diff can leave them out whole.
+	unchanged = set()
+	levels = _levels(depth)
+
+	def match(before, after, level):
+		if level not in levels:
+			return
+		before = dict((x['id'], x) for x in before if 'id' in x)
+		for record in after:
+			old_rec = before.get(record.get('id'))
+			if old_rec is None:
+				continue
+			if _comparable(old_rec, record) and old_rec['hash'] == record['hash']:
+				unchanged.add(record['id'])
+			elif level in CHILDREN:
+				match(old_rec.get(CHILDREN[level], []), record.get(CHILDREN[level], []), CHILDREN[level])
+
+	match(old, new, 'boards')
+	return unchanged
+
+def diffState(old, new, depth=0):
+	"""
+	Compares two snapshots level by level.
+	:param old: The stored snapshot
+	:param new: A freshly fetched snapshot, at least 'depth' deep
+	:param depth: The deepest level to compare. 0 compares boards only, None compares everything.
+	:return: {level: {'added': [...], 'removed': [...], 'renamed': [(old, new)], 'closed': [...], 'reopened': [...],
+	         'moved': [...], 'changed': [...]}} where 'added' and 'removed' hold (record, parent_id) pairs and 'moved'
+	         holds (record, old_parent_id, new_parent_id) triples. 'changed' holds the new records whose content, or
+	         anything under them, differs; it is only filled in when both snapshots were hashed at the same depth.
+	         Three more kinds only keep the stored snapshot right, and mean nothing to triggers: 'reordered' holds
+	         (parent_id, [child ids]) with the new order of every parent's children that changed order or membership
+	         (parent_id is None for the boards), 'rehashed' holds new full-depth records whose stored copy has no
+	         hash to compare with, and 'unhashed' the IDs of records whose stored hash the other changes leave stale.
+	"""
+	unchanged = _unchanged(old, new, depth)
+	old_index = indexState(old, depth, unchanged)
+	new_index = indexState(new, depth, unchanged)
+	changes = {}
+	for level in _levels(depth):
+		before = old_index[level]
+		after = new_index[level]
+		level_changes = {
+			'added': [after[id] for id in after if id not in before],
+			'removed': [before[id] for id in before if id not in after],
+			'renamed': [],
+			'closed': [],
+			'reopened': [],
+			'moved': [],
+			'changed': [],
+			'reordered': _reordered(level, old, new, old_index, new_index),
+			'rehashed': [],
+			'unhashed': []
+		}
+		for id in after.keys() & before.keys():
+			old_rec, new_rec = before[id][0], after[id][0]
+			if old_rec['name'] != new_rec['name']:
+				level_changes['renamed'].append((old_rec, new_rec))
+			if 'closed' in new_rec and old_rec.get('closed') != new_rec['closed']:
+				level_changes['closed' if new_rec['closed'] else 'reopened'].append(new_rec)
+			if before[id][1] != after[id][1]:
+				level_changes['moved'].append((new_rec, before[id][1], after[id][1]))
+			if _comparable(old_rec, new_rec):
+				if old_rec['hash'] != new_rec['hash']:
+					level_changes['changed'].append(new_rec)
+			elif new_rec.get('hash', '').startswith('4:'):
+				level_changes['rehashed'].append(new_rec)
+		changes[level] = level_changes
+	_unhash(changes, old_index, new_index)
+	return changes
+
+def _reordered(level, old, new, old_index, new_index):
+	# (parent_id, [child ids]) for every parent compared on both sides whose children differ in order or membership
+	def ids(records):
+		return [x['id'] for x in records if 'id' in x]
+	if level == 'boards':
+		return [(None, ids(new))] if ids(old) != ids(new) else []
+	parent_level = LEVELS[LEVELS.index(level) - 1]
+	reordered = []
+	for id, (new_rec, grandparent) in new_index[parent_level].items():
+		if id in old_index[parent_level]:
+			after = ids(new_rec.get(level, []))
+			if ids(old_index[parent_level][id][0].get(level, [])) != after:
+				reordered.append((id, after))
+	return reordered
+
+def _unhash(changes, old_index, new_index):
+	# Records patched without a new hash, and everything above them, no longer match their stored hashes
+	hashed = set(record['id'] for level in changes.values() for record in level['changed'] + level['rehashed'])
+	stale = []
+	for level, level_changes in changes.items():
+		touched = [(record['id'], parent) for record, parent in level_changes['added'] + level_changes['removed']]
+		touched.extend((new_rec['id'], None) for old_rec, new_rec in level_changes['renamed'])
+		touched.extend((record['id'], None) for record in level_changes['closed'] + level_changes['reopened'])
+		# A moved record's own content is unchanged, only the parents it left and joined differ
+		for record, old_parent, new_parent in level_changes['moved']:
+			touched.extend([(None, old_parent), (None, new_parent)])
+		# A parent's hash covers the order of its children
+		touched.extend((None, parent) for parent, ids in level_changes.get('reordered', []))
+		for id, parent in touched:
+			if id not in new_index[level] or id not in old_index[level]:
+				# Added and removed records only affect their ancestors
+				id = None
+			stale.append((level, id))
+			at = LEVELS.index(level)
+			while parent is not None and at > 0:
+				at -= 1
+				stale.append((LEVELS[at], parent))
+				entry = new_index[LEVELS[at]].get(parent) or old_index[LEVELS[at]].get(parent)
+				parent = entry[1] if entry is not None else None
+	for level, id in stale:
+		if id is not None and id not in hashed and id not in changes[level]['unhashed']:
+			changes[level]['unhashed'].append(id)
+
+def hasChanges(changes):
+	return any(len(kind) > 0 for level in changes.values() for kind in level.values())
+
+def applyDiff(state, changes):
+	"""
+	Patches a stored snapshot in place with the changes from diffState, leaving everything else untouched.
+	:return: The patched snapshot
+	"""
+	index = indexState(state, len(changes) - 1)
+	for level in LEVELS:
+		if level not in changes:
+			continue
+		level_changes = changes[level]
+		removed = set(record['id'] for record, parent in level_changes['removed'])
+		if level == 'boards':
+			state[:] = [x for x in state if x['id'] not in removed]
+		else:
+			parents = index[LEVELS[LEVELS.index(level) - 1]]
+			for record, parent in level_changes['removed']:
+				if parent in parents:
+					siblings = parents[parent][0][level]
+					siblings[:] = [x for x in siblings if x['id'] not in removed]
+		for record, old_parent, new_parent in level_changes['moved']:
+			parents = index[LEVELS[LEVELS.index(level) - 1]]
+			moving = index[level][record['id']][0]
+			if old_parent in parents:
+				parents[old_parent][0][level].remove(moving)
+			if new_parent in parents:
+				parents[new_parent][0][level].append(moving)
+			index[level][record['id']] = (moving, new_parent)
+		for old_rec, new_rec in level_changes['renamed']:
+			index[level][new_rec['id']][0]['name'] = new_rec['name']
+		for record in level_changes['closed'] + level_changes['reopened']:
+			if record['id'] in index[level]:
+				index[level][record['id']][0]['closed'] = record['closed']
+		for record in level_changes.get('changed', []) + level_changes.get('rehashed', []):
+			# Takes the new fields and hash; children are patched by their own level
+			if record['id'] in index[level]:
+				index[level][record['id']][0].update((k, v) for k, v in record.items() if k != CHILDREN.get(level))
+		for id in level_changes.get('unhashed', []):
+			if id in index[level]:
+				index[level][id][0]['hash'] = None
+		for record, parent in level_changes['added']:
+			# Children arrive as their own 'added' entries if their level was compared
+			added = dict(record)
+			if level in CHILDREN:
+				added[CHILDREN[level]] = []
+			if level == 'boards':
+				state.append(added)
+			elif parent in index[LEVELS[LEVELS.index(level) - 1]]:
+				index[LEVELS[LEVELS.index(level) - 1]][parent][0][level].append(added)
+			index[level][added['id']] = (added, parent)
+		for parent, ids in level_changes.get('reordered', []):
+			# Added and moved records went to the end, so put the siblings in their new order
+			if parent is None:
+				siblings = state
+			elif parent in index[LEVELS[LEVELS.index(level) - 1]]:
+				siblings = index[LEVELS[LEVELS.index(level) - 1]][parent][0][level]
+			else:
+				continue
+			rank = dict((id, i) for i, id in enumerate(ids))
+			siblings.sort(key=lambda x: rank.get(x['id'], len(rank)))
+	return state
@@ -0,0 +1,593 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+# The label colours every generated board has, one label each
+LABEL_COLORS = ['green', 'yellow', 'orange', 'red', 'purple', 'blue']
+# Generated IDs start with this creation timestamp, like real Trello IDs
+ID_EPOCH = 0x5e000000
+DATE = '2020-01-01T00:00:00.000Z'
+
+# Generated IDs are 24 hex digits: an 8 digit timestamp, then the kind and the indexes that locate the
+# entity, so nothing has to be stored until it is changed.
+KINDS = {'board': 1, 'list': 2, 'card': 3, 'label': 4, 'checklist': 5, 'item': 6, 'action': 7}
+KIND_NAMES = dict((v, k) for k, v in KINDS.items())
+
+def makeId(kind, board=0, list=0, card=0, sub=0):
+	return '%08x%02x%04x%04x%04x%02x' % (ID_EPOCH + board, KINDS[kind], board, list, card, sub)
+
+def parseId(id):
+	# (kind, board, list, card, sub), or None for an ID we did not generate
+	try:
+		return (KIND_NAMES[int(id[8:10], 16)], int(id[10:14], 16), int(id[14:18], 16), int(id[18:22], 16),
+				int(id[22:24], 16))
+	except (ValueError, KeyError, IndexError):
+		return None
+
+def _pick(obj, fields):
+	# Trello returns only the requested fields, plus the ID
+	if fields is None or fields == 'all':
+		return dict(obj)
+	wanted = set(fields.split(','))
+	wanted.add('id')
+	return dict((k, v) for k, v in obj.items() if k in wanted)
+
+# A synthetic workspace of boards × lists × cards. Everything is generated from its ID on request; entities
+# are only stored once a request changes them, so even 500 × 50 × 200 costs little memory.
+class FakeWorkspace():
+	def __init__(self, boards=10, lists=5, cards=20, checklists=1, items=3, comments=1):
+		self.boards = boards
+		self.lists = lists
+		self.cards = cards
+		self.checklists = min(checklists, 15)
+		self.items = min(items, 16)
+		self.comments = comments
+		self.extra_boards = []
+		self.extra_labels = {}
+		self.changed_boards = {}
+		self.changed_lists = {}
+		self.changed_cards = {}
+		# IDs of deleted boards, lists and cards
+		self.removed = set()
+		self.checklist_cards = {}
+		self.actions = {}
+		# Every board's actions, oldest first
+		self.feed = []
+		self.ids = 0
+		self.lock = threading.RLock()
+
+	def newId(self, kind):
+		# IDs for created entities count down from the top of the index range, clear of the generated ones
+		self.ids += 1
+		return makeId(kind, 0xffff, 0xffff, 0xffff - self.ids // 256, self.ids % 256)
+
+	def boardIds(self):
+		ids = [makeId('board', b) for b in range(self.boards)] + [b['id'] for b in self.extra_boards]
+		return [id for id in ids if id not in self.removed]
+
+	def board(self, id):
+		if id in self.removed:
+			return None
+		if id in self.changed_boards:
+			return self.changed_boards[id]
+		for board in self.extra_boards:
+			if board['id'] == id:
+				return board
+		parsed = parseId(id)
+		if parsed is None or parsed[0] != 'board' or parsed[1] >= self.boards:
+			return None
+		return {'id': id, 'name': 'Board %d' % parsed[1], 'closed': False, 'desc': '', 'url': 'https://trello.com/b/' + id}
+
+	def changeBoard(self, id):
+		# Stores the board so it can be changed, and returns it; the same goes for changeList() and changeCard()
+		board = self.board(id)
+		if board is not None and board not in self.extra_boards:
+			self.changed_boards[id] = board
+		return board
+
+	def list(self, id):
+		if id in self.removed:
+			return None
+		if id in self.changed_lists:
+			return self.changed_lists[id]
+		parsed = parseId(id)
+		if parsed is None or parsed[0] != 'list' or parsed[1] >= self.boards or parsed[2] >= self.lists:
+			return None
+		return {'id': id, 'name': 'List %d' % parsed[2], 'closed': False, 'idBoard': makeId('board', parsed[1]),
+				'pos': parsed[2] + 1}
+
+	def changeList(self, id):
+		list = self.list(id)
+		if list is not None:
+			self.changed_lists[id] = list
+		return list
+
+	def listsOf(self, board_id):
+		parsed = parseId(board_id)
+		lists = []
+		if parsed is not None and parsed[0] == 'board' and parsed[1] < self.boards:
+			lists = [self.list(makeId('list', parsed[1], l)) for l in range(self.lists)]
+		ids = set(l['id'] for l in lists if l is not None)
+		# Lists created on or moved to this board since
+		lists.extend(l for l in self.changed_lists.values() if l['id'] not in ids)
+		return sorted((l for l in lists if l is not None and l['idBoard'] == board_id and l['id'] not in self.removed),
+					  key=lambda l: l['pos'])
+
+	def labels(self, board_id):
+		parsed = parseId(board_id)
+		generated = []
+		if parsed is not None and parsed[0] == 'board' and parsed[1] < self.boards:
+			generated = [{'id': makeId('label', parsed[1], sub=k), 'name': 'Label %d' % k, 'color': color,
+						  'idBoard': board_id} for k, color in enumerate(LABEL_COLORS)]
+		return generated + self.extra_labels.get(board_id, [])
+
+	def label(self, id):
+		parsed = parseId(id)
+		if parsed is not None and parsed[0] == 'label' and parsed[1] < self.boards and parsed[4] < len(LABEL_COLORS):
+			return self.labels(makeId('board', parsed[1]))[parsed[4]]
+		for labels in self.extra_labels.values():
+			for label in labels:
+				if label['id'] == id:
+					return label
+		return None
+
+	def _generateCard(self, b, l, c):
+		board_id = makeId('board', b)
+		card_id = makeId('card', b, l, c)
+		label = self.labels(board_id)[c % len(LABEL_COLORS)]
+		checklists = [{'id': makeId('checklist', b, l, c, k), 'name': 'Checklist %d' % k, 'idCard': card_id,
+					   'idBoard': board_id, 'pos': k + 1,
+					   'checkItems': [{'id': makeId('item', b, l, c, k * 16 + i), 'name': 'Item %d' % i,
+									   'state': 'complete' if i % 2 else 'incomplete', 'pos': i + 1,
+									   'idChecklist': makeId('checklist', b, l, c, k)}
+									  for i in range(self.items)]}
+					  for k in range(self.checklists)]
+		comments = [{'id': makeId('action', b, l, c, k), 'type': 'commentCard', 'date': DATE,
+					 'data': {'text': 'Comment %d' % k, 'card': {'id': card_id, 'name': 'Card %d' % c}},
+					 'memberCreator': {'id': 'member', 'username': 'bench'}}
+					for k in range(self.comments)]
+		return {
+			'id': card_id, 'name': 'Card %d' % c, 'desc': 'Description of card %d' % c, 'closed': False,
+			'idBoard': board_id, 'idList': makeId('list', b, l), 'idShort': c + 1, 'pos': c + 1,
+			'url': 'https://trello.com/c/' + card_id, 'shortUrl': 'https://trello.com/c/' + card_id,
+			'idMembers': [], 'idLabels': [label['id']], 'labels': [label], 'dateLastActivity': DATE,
+			'due': None, 'dueComplete': False, 'attachments': [], 'checklists': checklists, 'comments': comments
+		}
+
+	def card(self, id):
+		if id in self.removed:
+			return None
+		if id in self.changed_cards:
+			return self.changed_cards[id]
+		parsed = parseId(id)
+		if parsed is None or parsed[0] != 'card' or parsed[1] >= self.boards or parsed[2] >= self.lists or \
+				parsed[3] >= self.cards:
+			return None
+		return self._generateCard(parsed[1], parsed[2], parsed[3])
+
+	def changeCard(self, id):
+		# Stores the card so it can be changed, and returns it
+		card = self.card(id)
+		if card is not None:
+			self.changed_cards[id] = card
+		return card
+
+	def newCard(self, list, name):
+		card_id = self.newId('card')
+		card = {
+			'id': card_id, 'name': name, 'desc': '', 'closed': False, 'idBoard': list['idBoard'], 'idList': list['id'],
+			'idShort': 0, 'pos': 0x10000 + self.ids, 'url': 'https://trello.com/c/' + card_id,
+			'shortUrl': 'https://trello.com/c/' + card_id, 'idMembers': [], 'idLabels': [], 'labels': [],
+			'dateLastActivity': DATE, 'due': None, 'dueComplete': False, 'attachments': [], 'checklists': [],
+			'comments': []
+		}
+		self.changed_cards[card_id] = card
+		return card
+
+	def cardsOfList(self, list_id):
+		parsed = parseId(list_id)
+		cards = []
+		if parsed is not None and parsed[0] == 'list':
+			cards = [self.card(makeId('card', parsed[1], parsed[2], c)) for c in range(self.cards)]
+		cards = [c for c in cards if c is not None]
+		if self.changed_cards:
+			# Cards created in or moved to this list since
+			ids = set(c['id'] for c in cards)
+			cards.extend(c for c in self.changed_cards.values() if c['id'] not in ids and c['id'] not in self.removed)
+			cards = sorted((c for c in cards if c['idList'] == list_id), key=lambda c: c['pos'])
+		return cards
+
+	def cardsOfBoard(self, board_id):
+		return [card for l in self.listsOf(board_id) for card in self.cardsOfList(l['id'])]
+
+	def checklist(self, id):
+		# (card, checklist) for a checklist ID; either may be None
+		card_id = self.checklist_cards.get(id)
+		parsed = parseId(id)
+		if card_id is None and parsed is not None and parsed[0] == 'checklist':
+			card_id = makeId('card', parsed[1], parsed[2], parsed[3])
+		card = self.card(card_id) if card_id else None
+		if card is None:
+			return None, None
+		for checklist in card['checklists']:
+			if checklist['id'] == id:
+				return card, checklist
+		return card, None
+
+	def cardJson(self, card, fields=None):
+		obj = dict(card)
+		del obj['checklists']
+		del obj['comments']
+		obj['idChecklists'] = [cl['id'] for cl in card['checklists']]
+		obj['badges'] = {'comments': len(card['comments']), 'attachments': len(card['attachments']),
+						 'checkItems': sum(len(cl['checkItems']) for cl in card['checklists']),
+						 'checkItemsChecked': sum(1 for cl in card['checklists'] for i in cl['checkItems']
+												  if i['state'] == 'complete')}
+		return _pick(obj, fields)
+
+	def log(self, board_id, kind, data):
+		now = time.time()
+		# Milliseconds, as Trello has them, so an action is after a cursor set earlier in the same second
+		date = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + '.%03dZ' % (now * 1000 % 1000)
+		action = {'id': self.newId('action'), 'type': kind, 'date': date, 'data': data,
+				  'memberCreator': {'id': 'member', 'username': 'bench'}}
+		self.actions.setdefault(board_id, []).append(action)
+		self.feed.append(action)
+		return action
+
+class FakeTrelloHandler(BaseHTTPRequestHandler):
+	# Set by FakeTrelloServer
+	workspace = None
+	latency = 0.0
+	jitter = 0.0
+	stats = None
+
+	def log_message(self, format, *args):
+		pass
+
+	def _reply(self, status, obj):
+		body = json.dumps(obj).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def _handle(self, method):
+		url = urlsplit(self.path)
+		query = dict(parse_qsl(url.query))
+		length = int(self.headers.get('Content-Length', 0) or 0)
+		if length > 0:
+			try:
+				query.update(json.loads(self.rfile.read(length).decode('utf-8')))
+			except ValueError:
+				pass
+		parts = [p for p in url.path.split('/') if p]
+		if len(parts) > 0 and parts[0] == '1':
+			parts = parts[1:]
+		if parts == ['_stats']:
+			return self._reply(200, self.stats.snapshot())
+		if self.latency > 0:
+			time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+		if method == 'GET' and self.failure_rate > 0 and random.random() < self.failure_rate:
+			# A flaky network: the call fails as Trello's front end does when overloaded
+			self.stats.count('failed')
+			return self._reply(503, 'Service Unavailable')
+		with self.workspace.lock:
+			name, status, obj = route(self.workspace, method, parts, query)
+		self.stats.count(method + ' ' + name)
+		self._reply(status, obj)
+
+	def do_GET(self):
+		self._handle('GET')
+
+	def do_POST(self):
+		self._handle('POST')
+
+	def do_PUT(self):
+		self._handle('PUT')
+
+	def do_DELETE(self):
+		self._handle('DELETE')
+
+def _boardTree(ws, board, query):
+	tree = _pick(board, query.get('fields'))
+	if query.get('lists', 'none') != 'none':
+		tree['lists'] = [_pick(l, query.get('list_fields')) for l in ws.listsOf(board['id'])]
+	if query.get('labels', 'none') != 'none':
+		tree['labels'] = [_pick(l, query.get('label_fields')) for l in ws.labels(board['id'])]
+	cards = None
+	if query.get('cards', 'none') != 'none':
+		cards = ws.cardsOfBoard(board['id'])
+		if query['cards'] == 'open':
+			cards = [card for card in cards if not card['closed']]
+		tree['cards'] = []
+		for card in cards:
+			obj = ws.cardJson(card, query.get('card_fields'))
+			if query.get('card_attachments') == 'true':
+				obj['attachments'] = card['attachments']
+			tree['cards'].append(obj)
+	if query.get('checklists', 'none') != 'none':
+		cards = cards if cards is not None else ws.cardsOfBoard(board['id'])
+		tree['checklists'] = [_pick(cl, query.get('checklist_fields') and query['checklist_fields'] + ',checkItems')
+							  for card in cards for cl in card['checklists']]
+	if 'actions' in query:
+		cards = cards if cards is not None else ws.cardsOfBoard(board['id'])
+		actions = [comment for card in cards for comment in card['comments']]
+		tree['actions'] = actions[:int(query.get('actions_limit', 50))]
+	return tree
+
+def _ref(obj):
+	# How actions refer to a board or list
+	return {'id': obj['id'], 'name': obj['name']}
+
+def _actionsPage(actions, query):
+	# Trello's paging over an action log (oldest first): 'since' and 'before' take an action ID or a date, and the
+	# newest 'limit' actions between them come back, newest first
+	def position(bound, default):
+		for i, action in enumerate(actions):
+			if action['id'] == bound:
+				return i
+		return default(bound)
+
+	start, end = 0, len(actions)
+	if query.get('since'):
+		start = position(query['since'], lambda date: len([a for a in actions if a['date'] <= date]) - 1) + 1
+	if query.get('before'):
+		end = position(query['before'], lambda date: len([a for a in actions if a['date'] < date]))
+	kinds = [kind.partition(':') for kind in query['filter'].split(',')] if query.get('filter') else None
+	# 'updateCard:idList' picks the updateCards that changed idList
+	page = [a for a in actions[start:end] if kinds is None or any(
+		a['type'] == kind and (not field or field in a['data'].get('old', {})) for kind, colon, field in kinds)]
+	return list(reversed(page[-int(query.get('limit', 50)):]))
+
+def _update(obj, query, fields):
+	# Applies the fields a PUT sets; query values arrive as strings
+	for field in fields:
+		if field in query:
+			value = query[field]
+			if field == 'closed':
+				value = value in (True, 'true')
+			elif field == 'pos':
+				value = float(value)
+			obj[field] = value
+
+def _withParents(ws, obj, entity, query):
+	# Nests the board and list an entity sits on, for list=true and board=true
+	for parent, lookup in (('list', ws.list), ('board', ws.board)):
+		key = 'id' + parent.capitalize()
+		if query.get(parent) == 'true' and key in entity:
+			found = lookup(entity[key])
+			obj[parent] = _pick(found, query.get(parent + '_fields')) if found is not None else None
+	return obj
+
+def route(ws, method, parts, query):
+	"""
+	Serves one API call against the workspace.
+	:return: (route name for the stats, HTTP status, JSON reply)
+	"""
+	notfound = (404, 'The requested resource was not found.')
+	n = len(parts)
+	if method == 'GET' and parts[:3] == ['members', 'me', 'boards']:
+		boards = [ws.board(id) for id in ws.boardIds()]
+		return ('members/me/boards', 200, [_pick(b, query.get('fields')) for b in boards])
+	if method == 'GET' and parts == ['members', 'me', 'actions']:
+		return ('members/me/actions', 200, _actionsPage(ws.feed, query))
+	if parts[:1] == ['boards']:
+		if method == 'POST' and n == 1:
+			board = {'id': ws.newId('board'), 'name': query.get('name', ''), 'closed': False, 'desc': ''}
+			board['url'] = 'https://trello.com/b/' + board['id']
+			ws.extra_boards.append(board)
+			ws.log(board['id'], 'createBoard', {'board': {'id': board['id'], 'name': board['name']}})
+			return ('boards', 200, board)
+		board = ws.board(parts[1]) if n > 1 else None
+		if board is None:
+			return ('boards/{id}', ) + notfound
+		if n == 2 and method == 'PUT':
+			board = ws.changeBoard(board['id'])
+			_update(board, query, ('name', 'desc', 'closed'))
+			return ('boards/{id}', 200, board)
+		if n == 2 and method == 'DELETE':
+			ws.removed.add(board['id'])
+			return ('boards/{id}', 200, {})
+		if n == 2:
+			return ('boards/{id}', 200, _boardTree(ws, board, query))
+		if parts[2] == 'lists':
+			return ('boards/{id}/lists', 200, [_pick(l, query.get('fields')) for l in ws.listsOf(board['id'])])
+		if parts[2] == 'labels':
+			return ('boards/{id}/labels', 200, [_pick(l, query.get('fields')) for l in ws.labels(board['id'])])
+		if parts[2] == 'actions':
+			return ('boards/{id}/actions', 200, _actionsPage(ws.actions.get(board['id'], []), query))
+	if method == 'GET' and parts[:1] == ['lists'] and n == 3 and parts[2] == 'cards':
+		return ('lists/{id}/cards', 200, [ws.cardJson(c, query.get('fields')) for c in ws.cardsOfList(parts[1])])
+	if method == 'GET' and parts[:1] == ['lists'] and n == 2:
+		list_obj = ws.list(parts[1])
+		if list_obj is None:
+			return ('lists/{id}', ) + notfound
+		return ('lists/{id}', 200, _withParents(ws, _pick(list_obj, query.get('fields')), list_obj, query))
+	if method == 'POST' and parts == ['lists']:
+		if ws.board(query.get('idBoard', '')) is None:
+			return ('lists', ) + notfound
+		list_obj = {'id': ws.newId('list'), 'name': query.get('name', ''), 'closed': False,
+					'idBoard': query['idBoard'], 'pos': 0x10000 + ws.ids}
+		ws.changed_lists[list_obj['id']] = list_obj
+		return ('lists', 200, list_obj)
+	if method == 'PUT' and parts[:1] == ['lists'] and n == 2:
+		list_obj = ws.changeList(parts[1])
+		if list_obj is None:
+			return ('lists/{id}', ) + notfound
+		_update(list_obj, query, ('name', 'closed', 'idBoard', 'pos'))
+		return ('lists/{id}', 200, list_obj)
+	if method == 'POST' and parts == ['cards']:
+		list_obj = ws.list(query.get('idList', ''))
+		if list_obj is None:
+			return ('cards', ) + notfound
+		card = ws.newCard(list_obj, query.get('name', ''))
+		ws.log(card['idBoard'], 'createCard', {'card': {'id': card['id'], 'name': card['name']},
+			'list': _ref(list_obj), 'board': _ref(ws.board(card['idBoard']))})
+		return ('cards', 200, ws.cardJson(card))
+	if method == 'POST' and parts == ['labels']:
+		label = {'id': ws.newId('label'), 'name': query.get('name', ''), 'color': query.get('color'),
+				 'idBoard': query.get('idBoard')}
+		ws.extra_labels.setdefault(query.get('idBoard'), []).append(label)
+		return ('labels', 200, label)
+	if parts[:1] == ['cards'] and n > 1:
+		card = ws.card(parts[1])
+		if card is None:
+			return ('cards/{id}', ) + notfound
+		if n == 2 and method == 'GET':
+			return ('cards/{id}', 200, _withParents(ws, ws.cardJson(card, query.get('fields')), card, query))
+		if n == 2 and method == 'PUT':
+			card = ws.changeCard(card['id'])
+			before = ws.list(card['idList'])
+			if 'idList' in query:
+				list_obj = ws.list(query['idList'])
+				if list_obj is None:
+					return ('cards/{id}', ) + notfound
+				card['idBoard'] = list_obj['idBoard']
+			_update(card, query, ('name', 'desc', 'closed', 'idList', 'pos'))
+			if before is not None and card['idList'] != before['id']:
+				ws.log(card['idBoard'], 'updateCard', {'card': {'id': card['id'], 'name': card['name'],
+					'idList': card['idList']}, 'old': {'idList': before['id']}, 'listBefore': _ref(before),
+					'listAfter': _ref(ws.list(card['idList'])), 'board': _ref(ws.board(card['idBoard']))})
+			return ('cards/{id}', 200, ws.cardJson(card))
+		if n == 2 and method == 'DELETE':
+			ws.removed.add(card['id'])
+			return ('cards/{id}', 200, {})
+		what = parts[2] if n > 2 else None
+		if method == 'GET':
+			if what == 'checklists':
+				return ('cards/{id}/checklists', 200, card['checklists'])
+			if what == 'actions':
+				return ('cards/{id}/actions', 200, list(reversed(card['comments'])))
+			if what == 'attachments':
+				return ('cards/{id}/attachments', 200, card['attachments'])
+			if what == 'pluginData':
+				return ('cards/{id}/pluginData', 200, [])
+		if method == 'POST' and what == 'actions' and parts[3:] == ['comments']:
+			card = ws.changeCard(card['id'])
+			comment = ws.log(card['idBoard'], 'commentCard', {'text': query.get('text', ''),
+				'card': {'id': card['id'], 'name': card['name']}})
+			card['comments'].append(comment)
+			return ('cards/{id}/actions/comments', 200, comment)
+		if method == 'POST' and what == 'idLabels':
+			label = ws.label(query.get('value', ''))
+			if label is None:
+				return ('cards/{id}/idLabels', ) + notfound
+			card = ws.changeCard(card['id'])
+			if label['id'] not in card['idLabels']:
+				card['idLabels'].append(label['id'])
+				card['labels'].append(label)
+				ws.log(card['idBoard'], 'addLabelToCard', {'label': label, 'card': {'id': card['id'], 'name': card['name']}})
+			return ('cards/{id}/idLabels', 200, card['idLabels'])
+		if method == 'POST' and what == 'checklists':
+			card = ws.changeCard(card['id'])
+			checklist = {'id': ws.newId('checklist'), 'name': query.get('name', ''), 'idCard': card['id'],
+						 'idBoard': card['idBoard'], 'pos': len(card['checklists']) + 1, 'checkItems': []}
+			card['checklists'].append(checklist)
+			ws.checklist_cards[checklist['id']] = card['id']
+			return ('cards/{id}/checklists', 200, checklist)
+		if method == 'PUT' and what == 'checklist' and n == 6 and parts[4] == 'checkItem':
+			card, checklist = ws.checklist(parts[3])
+			if checklist is None:
+				return ('cards/{id}/checklist/{id}/checkItem/{id}', ) + notfound
+			card = ws.changeCard(card['id'])
+			card, checklist = ws.checklist(parts[3])
+			for item in checklist['checkItems']:
+				if item['id'] == parts[5]:
+					item['state'] = query.get('state', item['state'])
+					if item['state'] == 'complete':
+						ws.log(card['idBoard'], 'updateCheckItemStateOnCard', {'checkItem': dict(item),
+							'card': {'id': card['id'], 'name': card['name']}})
+					return ('cards/{id}/checklist/{id}/checkItem/{id}', 200, item)
+			return ('cards/{id}/checklist/{id}/checkItem/{id}', ) + notfound
+	if method == 'GET' and parts[:1] == ['checklists'] and n == 2:
+		card, checklist = ws.checklist(parts[1])
+		if checklist is None:
+			return ('checklists/{id}', ) + notfound
+		return ('checklists/{id}', 200, checklist)
+	if parts[:1] == ['checklists'] and n >= 3 and parts[2] == 'checkItems':
+		card, checklist = ws.checklist(parts[1])
+		if checklist is None:
+			return ('checklists/{id}/checkItems', ) + notfound
+		card = ws.changeCard(card['id'])
+		card, checklist = ws.checklist(parts[1])
+		if method == 'POST' and n == 3:
+			checked = query.get('checked') in (True, 'true')
+			item = {'id': ws.newId('item'), 'name': query.get('name', ''), 'idChecklist': checklist['id'],
+					'state': 'complete' if checked else 'incomplete', 'pos': len(checklist['checkItems']) + 1}
+			checklist['checkItems'].append(item)
+			return ('checklists/{id}/checkItems', 200, item)
+		if method == 'DELETE' and n == 4:
+			checklist['checkItems'] = [i for i in checklist['checkItems'] if i['id'] != parts[3]]
+			return ('checklists/{id}/checkItems/{id}', 200, {})
+	return ('unsupported', 400, 'unsupported call: %s /%s' % (method, '/'.join(parts)))
+
+# How many calls each route has served
+class RouteStats():
+	def __init__(self):
+		self.counts = {}
+		self.lock = threading.Lock()
+
+	def count(self, route):
+		with self.lock:
+			self.counts[route] = self.counts.get(route, 0) + 1
+
+	def snapshot(self):
+		with self.lock:
+			return {'requests': sum(self.counts.values()), 'routes': dict(self.counts)}
+
+# Serves a FakeWorkspace on a local port, with an optional delay on every call to stand in for network latency,
+# and optionally failing a share of the GETs with a 503.
+# Point the shared client at it with base.configureClient(api_root=server.url).
+class FakeTrelloServer():
+	def __init__(self, workspace=None, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0):
+		handler = type('Handler', (FakeTrelloHandler,), {
+			'workspace': workspace or FakeWorkspace(), 'latency': latency, 'jitter': jitter,
+			'failure_rate': failure_rate, 'stats': RouteStats()})
+		self.handler = handler
+		self.server = ThreadingHTTPServer((host, port), handler)
+		self.server.daemon_threads = True
+		self.url = 'http://%s:%d' % self.server.server_address[:2]
+		self.thread = None
+
+	@property
+	def stats(self):
+		return self.handler.stats
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve a synthetic Trello workspace for benchmarks.')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+	parser.add_argument('--boards', type=int, default=10)
+	parser.add_argument('--lists', type=int, default=5)
+	parser.add_argument('--cards', type=int, default=20, help='Cards per list')
+	parser.add_argument('--checklists', type=int, default=1, help='Checklists per card')
+	parser.add_argument('--items', type=int, default=3, help='Items per checklist')
+	parser.add_argument('--comments', type=int, default=1, help='Comments per card')
+	parser.add_argument('--latency', type=float, default=0.0, help='Delay per call, in milliseconds')
+	parser.add_argument('--jitter', type=float, default=0.0, help='Random extra or less delay, in milliseconds')
+	parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of GETs answered with a 503')
+	args = parser.parse_args()
+
+	workspace = FakeWorkspace(args.boards, args.lists, args.cards, args.checklists, args.items, args.comments)
+	server = FakeTrelloServer(workspace, args.host, args.port, args.latency / 1000.0, args.jitter / 1000.0,
+							  args.failure_rate)
+	# The first line tells whoever started us where to connect
+	print(server.url)
+	sys.stdout.flush()
+	server.server.serve_forever()
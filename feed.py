@@ -0,0 +1,116 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+# The action types our feed triggers react to. updateCard:idList only reports moves between lists.
+FEED_FILTER = 'createCard,copyCard,updateCard:idList,addLabelToCard,updateCheckItemStateOnCard'
+# Triggers polled within this many seconds of the last fetch share it instead of fetching again
+POLL_INTERVAL = 30
+# How many fetched actions are kept around for triggers that have not read them yet
+FEED_BUFFER = 1000
+# Actions per request; when a poll gets a full page, it pages back for the rest
+FEED_PAGE = 1000
+# Held while a cursor file is read, changed and written back, so triggers running at once do not overwrite each
+# other's changes. A poll holds it throughout, so a second trigger waits for it rather than fetching again.
+_cursor_lock = threading.RLock()
+
+def cursorPath(state_path):
+	# The cursor lives next to the state file, e.g. state.json -> state.cursor.json
+	return os.path.splitext(state_path)[0] + '.cursor.json'
+
+def _now():
+	return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def loadCursor(state_path):
+	try:
+		with open(cursorPath(state_path), 'r') as f:
+			return json.loads(f.read())
+	except (IOError, ValueError):
+		# Start from now: a fresh cursor should not replay history
+		return {'origin': _now(), 'since': None, 'fetched_at': 0, 'seq': 0, 'events': [], 'consumers': {}}
+
+def saveCursor(state_path, cursor):
+	path = cursorPath(state_path)
+	with open(path + '.tmp', 'w') as f:
+		f.write(json.dumps(cursor))
+	os.replace(path + '.tmp', path)
+
+def _fetchActions(client, since):
+	"""
+	Fetches the actions after 'since' (an action ID, or a date) across all our boards, newest first.
+	A full page means there may be more, so it pages back from the oldest action it got until the pages run out.
+	"""
+	actions = []
+	query = {'filter': FEED_FILTER, 'since': since, 'limit': FEED_PAGE}
+	while True:
+		page = client.fetch_json('/members/me/actions', query_params=query)
+		actions.extend(page)
+		if len(page) < FEED_PAGE:
+			return actions
+		query['before'] = page[-1]['id']
+
+def pollFeed(client, state_path, max_age=None):
+	"""
+	Fetches actions that happened since the last poll, unless a poll within max_age seconds (POLL_INTERVAL by
+	default) already did. The new actions are buffered in the cursor file for readFeed.
+	:return: The cursor
+	"""
+	with _cursor_lock:
+		return _poll(client, state_path, POLL_INTERVAL if max_age is None else max_age)
+
+def _poll(client, state_path, max_age):
+	cursor = loadCursor(state_path)
+	if time.time() - cursor['fetched_at'] < max_age:
+		return cursor
+
+	# One request for all boards, picking up after the newest action seen so far
+	actions = _fetchActions(client, cursor['since'] or cursor['origin'])
+	if len(actions) > 0:
+		# Actions come newest first
+		cursor['since'] = actions[0]['id']
+	# Skip anything already buffered, in case 'since' hands back the action it points at
+	seen = set(e['action']['id'] for e in cursor['events'])
+	for action in reversed([a for a in actions if a['id'] not in seen]):
+		cursor['seq'] += 1
+		cursor['events'].append({'seq': cursor['seq'], 'action': action})
+	cursor['events'] = cursor['events'][-FEED_BUFFER:]
+	cursor['fetched_at'] = time.time()
+	saveCursor(state_path, cursor)
+	return cursor
+
+def readFeed(client, state_path, consumer, match):
+	"""
+	Returns the actions this consumer has not seen yet that match, polling the feed first if it is stale.
+	:param consumer: A key unique to the trigger and its arguments
+	:param match: A function taking an action and returning whether the consumer cares about it
+	"""
+	with _cursor_lock:
+		return _read(client, state_path, consumer, match)
+
+def _read(client, state_path, consumer, match):
+	cursor = pollFeed(client, state_path)
+	if consumer not in cursor['consumers']:
+		# New consumers start at the head, like a fresh cursor
+		cursor['consumers'][consumer] = cursor['seq']
+		saveCursor(state_path, cursor)
+		return []
+	last = cursor['consumers'][consumer]
+	events = [e['action'] for e in cursor['events'] if e['seq'] > last and match(e['action'])]
+	if cursor['seq'] != last:
+		cursor['consumers'][consumer] = cursor['seq']
+		saveCursor(state_path, cursor)
+	return events
+
+def isCardCreated(action):
+	return action['type'] in ('createCard', 'copyCard')
+
+def isCardMoved(action):
+	return action['type'] == 'updateCard' and 'listAfter' in action['data']
+
+def isLabelAdded(action):
+	return action['type'] == 'addLabelToCard'
+
+def isItemChecked(action):
+	return action['type'] == 'updateCheckItemStateOnCard' and action['data']['checkItem']['state'] == 'complete'
@@ -0,0 +1,180 @@
+import argparse
+import importlib
+import io
+import json
+import socketserver
+import sys
+import threading
+import traceback
+import statestore
+from metrics import metrics
+from scheduler import TriggerScheduler
+
+# Plugin functions report by printing JSON, so while a call runs we point stdout at a buffer for its thread only.
+# Anything else (including the stdio protocol itself) still reaches the real stdout.
+class ThreadStdout(io.TextIOBase):
+	def __init__(self, real):
+		self.real = real
+		self.local = threading.local()
+
+	def write(self, text):
+		buffer = getattr(self.local, 'buffer', None)
+		if buffer is None:
+			return self.real.write(text)
+		return buffer.write(text)
+
+	def flush(self):
+		if getattr(self.local, 'buffer', None) is None:
+			self.real.flush()
+
+	def capture(self, fn, *args, **kwargs):
+		self.local.buffer = io.StringIO()
+		try:
+			fn(*args, **kwargs)
+			return self.local.buffer.getvalue()
+		finally:
+			self.local.buffer = None
+
+# Loads a plugin module once and keeps it resident: the shared client, resolver caches and the recorded
+# state all stay warm between calls. Calls and replies are single lines of JSON:
+#   {"id": 1, "call": "does_board_exist_action", "args": {"board_name": "Work"}}
+#   {"id": 1, "result": {"exists": true}}
+# "args" may also be a list of positional arguments. The call "list" describes the available triggers and actions.
+# The call "schedule" ({"trigger": <name>, "args": ..., "interval": <seconds>}) polls a trigger in the background and
+# replies with a schedule ID; whenever it fires (or fails) the host sends {"event": "fire", "schedule": <id>, ...}
+# on the same channel. "unschedule" ({"schedule": <id>}) stops it. "metrics" returns the per-function totals of metrics.py.
+class PluginHost():
+	def __init__(self, module_name='plugin'):
+		self.module = importlib.import_module(module_name)
+		self.functions = {}
+		self.prelaunch = []
+		for name in dir(self.module):
+			f = getattr(self.module, name)
+			if getattr(f, 'trigger', False) or getattr(f, 'action', False):
+				self.functions[name] = f
+			elif getattr(f, 'prelaunch', False):
+				self.prelaunch.append(f)
+		if not isinstance(sys.stdout, ThreadStdout):
+			sys.stdout = ThreadStdout(sys.stdout)
+		self.stdout = sys.stdout
+		self.scheduler = TriggerScheduler(runner=self.invoke)
+
+	def start(self):
+		# The host is the only reader and writer of the state files, so their parsed contents can be kept
+		statestore.CACHE_READS = True
+		for f in self.prelaunch:
+			self.stdout.capture(f)
+		self.scheduler.start()
+
+	def describe(self):
+		described = {}
+		for name, f in self.functions.items():
+			if getattr(f, 'trigger', False):
+				described[name] = {'kind': 'trigger', 'name': f.tname, 'description': f.tdesc,
+								   'required': f.treqs, 'generated': f.tgen}
+			else:
+				described[name] = {'kind': 'action', 'name': f.aname, 'description': f.adesc,
+								   'required': f.areqs, 'generated': f.agen}
+		return described
+
+	def call(self, name, args=None):
+		"""
+		Runs a trigger or action and returns what it printed, parsed as JSON.
+		"""
+		if name == 'list':
+			return self.describe()
+		if name == 'metrics':
+			return metrics.snapshot()
+		return self.invoke(self.functions[name], args)
+
+	def invoke(self, f, args=None):
+		if isinstance(args, list):
+			output = self.stdout.capture(f, *args)
+		else:
+			output = self.stdout.capture(f, **(args or {}))
+		lines = [line for line in output.splitlines() if line.strip()]
+		return json.loads(lines[-1]) if lines else None
+
+	def schedule(self, args, emit):
+		name = args['trigger']
+		if not getattr(self.functions.get(name), 'trigger', False):
+			raise ValueError('not a trigger: ' + str(name))
+
+		def report(entry, result, error):
+			if error is not None or (result is not None and result.get('fire') == 'true'):
+				emit({'event': 'fire', 'schedule': entry.id, 'trigger': name, 'result': result, 'error': error})
+
+		kwargs = dict((k, args[k]) for k in ('interval', 'jitter') if k in args)
+		return self.scheduler.register(self.functions[name], args.get('args'), callback=report, **kwargs)
+
+	def handle(self, line, emit=None):
+		try:
+			request = json.loads(line)
+		except ValueError as e:
+			return {'error': 'bad request: ' + str(e)}
+		reply = {'id': request.get('id')}
+		name = request.get('call')
+		try:
+			if name == 'schedule':
+				reply['result'] = {'schedule': self.schedule(request.get('args') or {}, emit)}
+				return reply
+			if name == 'unschedule':
+				reply['result'] = {'removed': self.scheduler.unregister((request.get('args') or {}).get('schedule'))}
+				return reply
+		except Exception as e:
+			reply['error'] = str(e)
+			return reply
+		if name not in ('list', 'metrics') and name not in self.functions:
+			reply['error'] = 'unknown call: ' + str(name)
+			return reply
+		try:
+			reply['result'] = self.call(name, request.get('args'))
+		except Exception as e:
+			reply['error'] = str(e)
+			reply['traceback'] = traceback.format_exc()
+		return reply
+
+	def serveStdio(self):
+		lock = threading.Lock()
+
+		def emit(message):
+			with lock:
+				self.stdout.real.write(json.dumps(message) + '\n')
+				self.stdout.real.flush()
+
+		for line in sys.stdin:
+			if line.strip():
+				emit(self.handle(line, emit))
+
+	def serveSocket(self, host='127.0.0.1', port=8766):
+		plugin_host = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				lock = threading.Lock()
+
+				def emit(message):
+					with lock:
+						self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+
+				for line in self.rfile:
+					if line.strip():
+						emit(plugin_host.handle(line.decode('utf-8'), emit))
+
+		server = socketserver.ThreadingTCPServer((host, port), Handler)
+		server.daemon_threads = True
+		server.serve_forever()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Keep a plugin resident and serve its triggers and actions.')
+	parser.add_argument('--module', default='plugin', help='The plugin module to load')
+	parser.add_argument('--socket', metavar='HOST:PORT', help='Serve on a local TCP socket instead of stdin/stdout')
+	args = parser.parse_args()
+
+	plugin_host = PluginHost(args.module)
+	plugin_host.start()
+	if args.socket:
+		host, port = args.socket.rsplit(':', 1)
+		plugin_host.serveSocket(host, int(port))
+	else:
+		plugin_host.serveStdio()
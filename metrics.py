@@ -0,0 +1,174 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Where metrics go after every trigger or action call: '*.prom' is rewritten as Prometheus text, anything else
+# gets one JSON line per call appended. None keeps them in memory only.
+METRICS_FILE = None
+METRICS_PREFIX = 'trello_plugin'
+# Calls finishing together take turns writing METRICS_FILE
+_export_lock = threading.Lock()
+
+COUNTERS = ('calls', 'errors', 'seconds', 'http_requests', 'http_bytes', 'cache_hits', 'cache_misses')
+
+# The measurement of the trigger or action running in this context, if any
+_current = contextvars.ContextVar('measurement', default=None)
+
+# What one call of a trigger or action did. Pool workers started through ratelimit.carryPriority add to
+# the same measurement as the call that started them.
+class Measurement():
+	def __init__(self, name, kind):
+		self.name = name
+		self.kind = kind
+		self.counts = dict((counter, 0) for counter in COUNTERS if counter not in ('calls', 'errors', 'seconds'))
+		self.caches = {}
+		self.sections = {}
+		self.lock = threading.Lock()
+
+	def add(self, counter, amount=1):
+		with self.lock:
+			self.counts[counter] += amount
+
+	def addCache(self, cache, hit):
+		with self.lock:
+			hits, misses = self.caches.get(cache, (0, 0))
+			self.caches[cache] = (hits + 1, misses) if hit else (hits, misses + 1)
+			self.counts['cache_hits' if hit else 'cache_misses'] += 1
+
+	def addSection(self, section, seconds):
+		with self.lock:
+			self.sections[section] = self.sections.get(section, 0.0) + seconds
+
+# Totals per trigger and action since the process started
+class Metrics():
+	def __init__(self):
+		self.functions = {}
+		self.lock = threading.Lock()
+
+	def record(self, measurement, seconds, error):
+		with self.lock:
+			totals = self.functions.setdefault(measurement.name, {
+				'kind': measurement.kind, 'counts': dict((counter, 0) for counter in COUNTERS), 'caches': {},
+				'sections': {}, 'max_seconds': 0.0})
+			counts = totals['counts']
+			counts['calls'] += 1
+			counts['errors'] += 1 if error else 0
+			counts['seconds'] += seconds
+			for counter, value in measurement.counts.items():
+				counts[counter] += value
+			for cache, (hits, misses) in measurement.caches.items():
+				before = totals['caches'].get(cache, (0, 0))
+				totals['caches'][cache] = (before[0] + hits, before[1] + misses)
+			for section, value in measurement.sections.items():
+				totals['sections'][section] = totals['sections'].get(section, 0.0) + value
+			totals['max_seconds'] = max(totals['max_seconds'], seconds)
+
+	def snapshot(self):
+		with self.lock:
+			return json.loads(json.dumps(self.functions))
+
+	def reset(self):
+		with self.lock:
+			self.functions = {}
+
+	def toPrometheus(self, prefix=METRICS_PREFIX):
+		lines = []
+		functions = self.snapshot()
+		for counter in COUNTERS:
+			metric = prefix + '_' + counter + '_total'
+			lines.append('# TYPE %s counter' % metric)
+			for name, totals in sorted(functions.items()):
+				lines.append('%s{function="%s",kind="%s"} %s' % (metric, name, totals['kind'], totals['counts'][counter]))
+		metric = prefix + '_max_seconds'
+		lines.append('# TYPE %s gauge' % metric)
+		for name, totals in sorted(functions.items()):
+			lines.append('%s{function="%s",kind="%s"} %s' % (metric, name, totals['kind'], totals['max_seconds']))
+		for outcome, position in (('hits', 0), ('misses', 1)):
+			metric = prefix + '_cache_' + outcome + '_by_cache_total'
+			lines.append('# TYPE %s counter' % metric)
+			for name, totals in sorted(functions.items()):
+				for cache, counts in sorted(totals['caches'].items()):
+					lines.append('%s{function="%s",cache="%s"} %s' % (metric, name, cache, counts[position]))
+		metric = prefix + '_section_seconds_total'
+		lines.append('# TYPE %s counter' % metric)
+		for name, totals in sorted(functions.items()):
+			for section, seconds in sorted(totals['sections'].items()):
+				lines.append('%s{function="%s",section="%s"} %s' % (metric, name, section, seconds))
+		return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def configureMetrics(filepath):
+	global METRICS_FILE
+	METRICS_FILE = filepath or None
+
+def _export(measurement, started, seconds, error):
+	if METRICS_FILE is None:
+		return
+	if METRICS_FILE.endswith('.prom'):
+		# Scrapers may read the file at any moment, so replace it whole. The temporary name is per process, and
+		# threads take turns, so concurrent calls never rename each other's file away.
+		tmp_path = '%s.%d.tmp' % (METRICS_FILE, os.getpid())
+		with _export_lock:
+			with open(tmp_path, 'w') as f:
+				f.write(metrics.toPrometheus())
+			os.replace(tmp_path, METRICS_FILE)
+		return
+	line = {'time': started, 'function': measurement.name, 'kind': measurement.kind, 'seconds': seconds,
+			'error': error}
+	line.update(measurement.counts)
+	line['caches'] = measurement.caches
+	line['sections'] = measurement.sections
+	with _export_lock, open(METRICS_FILE, 'a') as f:
+		f.write(json.dumps(line) + '\n')
+
+@contextmanager
+def measure(name, kind):
+	"""
+	Measures a trigger or action call. Calls nested inside another one count towards the outer call only.
+	"""
+	if _current.get() is not None:
+		yield _current.get()
+		return
+	measurement = Measurement(name, kind)
+	token = _current.set(measurement)
+	started = time.time()
+	start = time.perf_counter()
+	error = None
+	try:
+		yield measurement
+	except BaseException as e:
+		error = type(e).__name__
+		raise
+	finally:
+		_current.reset(token)
+		seconds = time.perf_counter() - start
+		metrics.record(measurement, seconds, error)
+		_export(measurement, started, seconds, error)
+
+@contextmanager
+def section(name):
+	# Times a stretch of work inside the current call, e.g. 'snapshot.fetch'
+	measurement = _current.get()
+	if measurement is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		measurement.addSection(name, time.perf_counter() - start)
+
+def countRequest(nbytes):
+	measurement = _current.get()
+	if measurement is not None:
+		measurement.add('http_requests')
+		measurement.add('http_bytes', nbytes)
+
+def countCache(cache, hit):
+	measurement = _current.get()
+	if measurement is not None:
+		measurement.addCache(cache, hit)
@@ -1,6 +1,8 @@
 from plugin_base import *
 from base import *
 
+# Where the recorded Trello state lives, in the line-per-entity format of statestore.py
+STATE_FILE = 'state.jsonl'
 
 @Prelaunch()
 def record_starting_state():
@@ -8,11 +10,38 @@ def record_starting_state():
     This method looks at the trello board and records its state in a local file.
     This allows us to react to changes in it with triggers.
     """
-    recordStateToFile('state.json')
+    recordStateToFile(STATE_FILE)
+
+
+@Prelaunch()
+def start_metrics():
+    """
+    If 'metrics_file' is set in keys.txt, the timings and counts of every trigger and action call are written there:
+    as Prometheus text if it ends in '.prom', otherwise as one line of JSON per call.
+    """
+    metrics_file = getKey('metrics_file')
+    if metrics_file:
+        configureMetrics(metrics_file)
+
+
+@Prelaunch()
+def start_webhook_receiver():
+    """
+    If 'webhook_url' is set in keys.txt, this starts a local receiver for Trello webhooks and registers it with Trello.
+    While it runs, triggers answer from the received events instead of polling the API.
+    """
+    callback_url = getKey('webhook_url')
+    if not callback_url:
+        return
+    host = getKey('webhook_host')
+    port = getKey('webhook_port')
+    startReceiver(host=host if host else '127.0.0.1', port=int(port) if port else 8765,
+                  callback_url=callback_url, secret=getKey('api_secret'))
+    registerWebhook(getClient(), callback_url)
 
 
 @Trigger(name="Trello: Any board created", description="Fires when a new board is created",
-         generated_arg_types=['board:str|[str]|none'])
+         generated_arg_types=['board:str|[str]|none'], datasets=['snapshot:0'])
 def board_created_trigger():
     """
     This will fire when a new trello board is detected.
@@ -20,31 +49,29 @@ def board_created_trigger():
              If there is more than one board difference, the 'board_name' will be an array of board_names.
     """
 
-    # Check the current state and how it compares to the last saved one
-    now_json = getJsonState(depth=0)
-    loaded_json = loadJsonFromFile('state.json')
-
-    names = [y['name'] for y in loaded_json]
-    extra = [x for x in now_json if x['name'] not in names]
+    if eventMode():
+        # Webhook deliveries already tell us which boards were created
+        extra = [e['data']['board'] for e in webhookEvents.consume('board_created_trigger', 'createBoard')]
+    else:
+        # Check the current state and how it compares to the last saved one, updating the saved state as we go
+        changes = updateStateFile(STATE_FILE, getJsonState(depth=0), depth=0)
+        extra = [board for board, parent in changes['boards']['added']]
 
     if len(extra) > 0:
         # We do have a board, so we want to fire
         board_names = [x['name'] for x in extra]
-        recordStateToFile('state.json')  # We want to update the file so we only fire once
         if len(board_names) > 1:
             print(json.dumps({'fire': 'true', 'board': board_names}))
         else:
             print(json.dumps({'fire': 'true', 'board': board_names[0]}))
     else:
-        if len(now_json) != len(loaded_json):
-            # Even though we have no new boards, let's update our state now.
-            recordStateToFile('state.json')
         print(json.dumps({'fire': 'false'}))
 
 
 @Trigger(name="Trello: Specific board(s) created",
          description="Fires when a specific board (or multiple boards) is/are created",
-         required_arg_types=['board_name:str|[str]'], generated_arg_types=['board:str|[str]|none'])
+         required_arg_types=['board_name:str|[str]'], generated_arg_types=['board:str|[str]|none'],
+         datasets=['snapshot:0'])
 def spec_board_created_trigger(board_name):
     """
     This will fire when a new trello board is detected that matches our specified parameters
@@ -57,36 +84,119 @@ def spec_board_created_trigger(board_name):
         # Presume it is a string
         matching = [board_name]
 
-    # Check the current state and how it compares to the last saved one
-    now_json = getJsonState(depth=0)
-    loaded_json = loadJsonFromFile('state.json')
-
-    names = [y['name'] for y in loaded_json]
-    extra = [x for x in now_json if x['name'] not in names and x['name'] in matching]
+    if eventMode():
+        # Webhook deliveries already tell us which boards were created
+        created = webhookEvents.consume('spec_board_created_trigger:' + json.dumps(matching), 'createBoard')
+        extra = [e['data']['board'] for e in created if e['data']['board']['name'] in matching]
+    else:
+        # Check the current state and how it compares to the last saved one, updating the saved state as we go
+        changes = updateStateFile(STATE_FILE, getJsonState(depth=0), depth=0)
+        extra = [board for board, parent in changes['boards']['added'] if board['name'] in matching]
 
     if len(extra) > 0:
         # We do have a board, so we want to fire
         board_names = [x['name'] for x in extra]
-        recordStateToFile('state.json')  # We want to update the file so we only fire once
         if len(board_names) > 1:
             print(json.dumps({'fire': 'true', 'board': board_names}))
         else:
             print(json.dumps({'fire': 'true', 'board': board_names[0]}))
     else:
-        if len(now_json) != len(loaded_json):
-            # Even though we have no new boards, let's update our state now.
-            recordStateToFile('state.json')
         print(json.dumps({'fire': 'false'}))
 
 
+@Trigger(name="Trello: Card edited",
+         description="Fires when a card's name, description, labels, checklists or comments change",
+         generated_arg_types=['card:str|[str]|none', 'list:str|[str]|none'], datasets=['snapshot:all'])
+def card_edited_trigger():
+    """
+    This will fire when the content hash of a card differs from the one in the saved state. Boards and lists whose
+    hashes match are not looked into, so an unchanged workspace costs one comparison per board.
+    New boards are left for the board triggers to record; their cards are followed from then on.
+    :return: The json {'fire': 'true', 'card': <cardName>, 'list': <listName>} or {'fire': 'false'}
+    """
+    state = getJsonState()
+    changes = updateStateFile(STATE_FILE, state, depth=None, add_boards=False)
+    edited = set(card['id'] for card in changes['cards']['changed'])
+    found = [(card, list) for board in state for list in board['lists'] for card in list['cards']
+             if card['id'] in edited] if edited else []
+    _print_fired(found, card=lambda e: e[0]['name'], list=lambda e: e[1]['name'])
+
+
+def _print_fired(events, **fields):
+    """
+    Prints the trigger result for feed events. Each keyword maps a generated arg to a function of an event.
+    A single event gives plain values, several give arrays.
+    """
+    if len(events) == 0:
+        print(json.dumps({'fire': 'false'}))
+        return
+    result = {'fire': 'true'}
+    for key, value in fields.items():
+        values = [value(e) for e in events]
+        result[key] = values[0] if len(values) == 1 else values
+    print(json.dumps(result))
+
+
+@Trigger(name="Trello: Card created", description="Fires when a card is created on any board",
+         generated_arg_types=['card:str|[str]|none', 'list:str|[str]|none'],
+         datasets=['feed'])
+def card_created_trigger():
+    """
+    This will fire when a card has been created (or copied) since the last check, read from the actions feed.
+    :return: The json {'fire': 'true', 'card': <cardName>, 'list': <listName>} or {'fire': 'false'}
+    """
+    events = readFeed(getClient(), STATE_FILE, 'card_created_trigger', isCardCreated)
+    _print_fired(events, card=lambda e: e['data']['card']['name'], list=lambda e: e['data']['list']['name'])
+
+
+@Trigger(name="Trello: Card moved", description="Fires when a card is moved from one list to another",
+         generated_arg_types=['card:str|[str]|none', 'from_list:str|[str]|none', 'to_list:str|[str]|none'],
+         datasets=['feed'])
+def card_moved_trigger():
+    """
+    This will fire when a card has been moved between lists since the last check, read from the actions feed.
+    :return: The json {'fire': 'true', 'card': <cardName>, 'from_list': <listName>, 'to_list': <listName>}
+             or {'fire': 'false'}
+    """
+    events = readFeed(getClient(), STATE_FILE, 'card_moved_trigger', isCardMoved)
+    _print_fired(events, card=lambda e: e['data']['card']['name'],
+                 from_list=lambda e: e['data']['listBefore']['name'], to_list=lambda e: e['data']['listAfter']['name'])
+
+
+@Trigger(name="Trello: Label added", description="Fires when a label is added to a card",
+         generated_arg_types=['card:str|[str]|none', 'label:str|[str]|none'],
+         datasets=['feed'])
+def label_added_trigger():
+    """
+    This will fire when a label has been added to a card since the last check, read from the actions feed.
+    :return: The json {'fire': 'true', 'card': <cardName>, 'label': <labelName>} or {'fire': 'false'}
+    """
+    events = readFeed(getClient(), STATE_FILE, 'label_added_trigger', isLabelAdded)
+    _print_fired(events, card=lambda e: e['data']['card']['name'], label=lambda e: e['data']['label']['name'])
+
+
+@Trigger(name="Trello: Checklist item checked", description="Fires when an item on a card checklist is checked",
+         generated_arg_types=['card:str|[str]|none', 'item:str|[str]|none'],
+         datasets=['feed'])
+def checklist_item_checked_trigger():
+    """
+    This will fire when a checklist item has been checked since the last check, read from the actions feed.
+    :return: The json {'fire': 'true', 'card': <cardName>, 'item': <itemName>} or {'fire': 'false'}
+    """
+    events = readFeed(getClient(), STATE_FILE, 'checklist_item_checked_trigger', isItemChecked)
+    _print_fired(events, card=lambda e: e['data']['card']['name'], item=lambda e: e['data']['checkItem']['name'])
+
+
 @Action(name="Trello: Create board(s)", description="Create a board on Trello",
-        required_arg_types=['board_names:str|[str]', 'permissions:str|[str]|none'])
+        required_arg_types=['board_names:str|[str]', 'permissions:str|[str]|none'],
+        generated_arg_types=['board_id:str|[str]'])
 def create_board_action(board_names, permissions=None):
     """
     Fire this action to create one or more boards on trello
     :param board_names: One or more string indicating the titles of the boards to create
     :param permissions: One or more string indicating permission level. Defaults to private if not supplied. Must be of
                         the same length as board_names.
+    :return: {'board_id': <id>}, or an array of IDs in the order of board_names if there are several
     """
 
     perm = None
@@ -99,17 +209,19 @@ def create_board_action(board_names, permissions=None):
         if permissions:
             perm = [perm]
 
-    client = createClient()
+    client = getClient()
+    created = []
     if perm:
         for name, p in zip(names, perm):
-            client.add_board(name, permission_level=p)
-        recordStateToFile('state.json')
-        print(json.dumps({}))
+            created.append(client.add_board(name, permission_level=p).id)
+            invalidatePath(name)
+        recordStateToFile(STATE_FILE)
     else:
         for name in names:
-            client.add_board(name)
-        recordStateToFile('state.json')
-        print(json.dumps({}))
+            created.append(client.add_board(name).id)
+            invalidatePath(name)
+        recordStateToFile(STATE_FILE)
+    print(json.dumps({'board_id': created[0] if len(created) == 1 else created}))
 
 
 @Action(name="Trello: Does board exist?", description="Return whether or not a board exists",
@@ -120,14 +232,12 @@ def does_board_exist_action(board_name):
     :param board_name: The board's name as a string
     :return: {'exists': True} if it does and {'exists': False} if not
     """
-    client = createClient()
-
-    for b in client.list_boards():
-        if b.name == board_name:
-            print(json.dumps({"exists": True}))
-            return
+    client = getClient()
 
-    print(json.dumps({"exists": False}))
+    index, ids = lookupRecorded(STATE_FILE, board_name)
+    if index is None:
+        ids = resolveIds(client, board_name, verify=True)
+    print(json.dumps({"exists": ids is not None}))
 
 @Action(name="Trello: Does list exist?", description="Return whether or not a particular list exists",
         required_arg_types=['board_name:str', 'listname:str'], generated_arg_types=['exists:bool'])
@@ -138,16 +248,12 @@ def does_list_exist_action(board_name, listname):
     :param listname: The list's name as a string
     :return: {'exists': True} if it does and {'exists': False} if not
     """
-    client = createClient()
-
-    for b in client.list_boards():
-        if b.name == board_name:
-            for list in b.list_lists():
-                if list.name == listname:
-                    print(json.dumps({"exists": True}))
-                    return
+    client = getClient()
 
-    print(json.dumps({"exists": False}))
+    index, ids = lookupRecorded(STATE_FILE, board_name, listname)
+    if index is None:
+        ids = resolveIds(client, board_name, listname, verify=True)
+    print(json.dumps({"exists": ids is not None}))
 
 @Action(name="Trello: Does card exist?", description="Return whether or not a particular card exists",
         required_arg_types=['board_name:str', 'listname:str', 'cardname:str'], generated_arg_types=['exists:bool'])
@@ -159,18 +265,12 @@ def does_card_exist_action(board_name, listname, cardname):
     :param cardname: The card's name as a string
     :return: {'exists': True} if it does and {'exists': False} if not
     """
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            for list in b.list_lists():
-                if list.name == listname:
-                    for card in list.list_cards():
-                        if card.name == cardname:
-                            print(json.dumps({"exists": True}))
-                            return
-
-    print(json.dumps({"exists": False}))
+    index, ids = lookupRecorded(STATE_FILE, board_name, listname, cardname)
+    if index is None:
+        ids = resolveIds(client, board_name, listname, cardname, verify=True)
+    print(json.dumps({"exists": ids is not None}))
 
 @Action(name="Trello: Get link to board", description="Get a url for a given trello board",
         required_arg_types=['board_name:str'], generated_arg_types=['link:str'])
@@ -180,12 +280,14 @@ def get_link_for_board_action(board_name):
     :param board_name: The board's name as a string
     :return: {'link': <url>} or {'link': 'notfound'} if the board does not exist.
     """
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            print(json.dumps({'link': 'https://trello.com/b/' + b.id}))
-            return
+    index, ids = lookupRecorded(STATE_FILE, board_name)
+    if index is None:
+        ids = resolveIds(client, board_name, verify=True)
+    if ids is not None:
+        print(json.dumps({'link': 'https://trello.com/b/' + ids[0]}))
+        return
 
     print(json.dumps({'link': 'notfound'}))
 
@@ -200,72 +302,74 @@ def get_link_for_card_action(board_name, listname, cardname):
     :param cardname: The name of the card
     :return: {'link': <url>} or {'link': 'notfound'} if the board does not exist.
     """
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            print(json.dumps({'link': 'https://trello.com/c/' + c.id}))
-                            return
+    index, ids = lookupRecorded(STATE_FILE, board_name, listname, cardname)
+    if index is None:
+        ids = resolveIds(client, board_name, listname, cardname, verify=True)
+    if ids is not None:
+        print(json.dumps({'link': 'https://trello.com/c/' + ids[2]}))
+        return
     print(json.dumps({'link': 'notfound'}))
 
 
 @Action(name="Trello: Create comment on card", description="Given the path to a card, make a comment there.",
-        required_arg_types=['board_name:str', 'listname:str', 'cardname:str', 'comment_string:str'])
-def make_comment_on_card_action(board_name, listname, cardname, comment_string):
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'comment_string:str',
+                            'board_id:str|none', 'list_id:str|none', 'card_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none'])
+def make_comment_on_card_action(board_name, listname, cardname, comment_string, board_id=None, list_id=None,
+                                card_id=None):
     """
-    Obtains a link to the specified card
+    Makes a comment on the specified card
     :param board_name: The name of the board the card is in
     :param listname: The name of the list the card is under
     :param cardname: The name of the card
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step. The names down to the deepest ID
+                                       given are not needed, and the card ID alone needs no lookups at all.
+    :return: {'board_id': <id>, 'list_id': <id>, 'card_id': <id>} if the card is found (IDs that were neither
+             given nor looked up are null), otherwise {}
     """
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            c.comment(comment_string)
-                            print(json.dumps({}))
-                            return
+    def comment(c):
+        c.comment(comment_string)
+        return cardIds(c)
 
-    print(json.dumps({}))
+    ids = withCard(client, board_name, listname, cardname, comment, board_id, list_id, card_id)
+    print(json.dumps(ids if ids is not None else {}))
 
 
 @Action(name="Trello: Add label to card", description="Given the path to a card, add a label to it.",
-        required_arg_types=['board_name:str', 'listname:str', 'cardname:str', 'label_string:str'])
-def add_label_on_card_action(board_name, listname, cardname, label_string):
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'label_string:str',
+                            'board_id:str|none', 'list_id:str|none', 'card_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none', 'label_id:str|none'])
+def add_label_on_card_action(board_name, listname, cardname, label_string, board_id=None, list_id=None,
+                             card_id=None):
     """
     Adds a label to a specified card
     :param board_name: The name of the board the card is in
     :param listname: The name of the list the card is under
     :param cardname: The name of the card
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step, see make_comment_on_card_action
+    :return: {'board_id': <id>, 'list_id': <id>, 'card_id': <id>, 'label_id': <id>} if the card and label are found,
+             otherwise {}
     """
-    client = createClient()
-
-    for b in client.list_boards():
-        if b.name == board_name:
-            chosen_label = None
-            for lab in b.get_labels():
-                if lab.name == label_string:
-                    chosen_label = lab
-                    break
-            if chosen_label is None:
-                continue
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            c.add_label(chosen_label)
-                            print(json.dumps({}))
-                            return
+    client = getClient()
 
-    print(json.dumps({}))
+    def add_label(c):
+        if c.board.id is None:
+            # The labels belong to the board, so a card given by ID alone has to tell us which one it is on
+            c.board.id = client.fetch_json('/cards/' + c.id, query_params={'fields': 'idBoard'})['idBoard']
+        chosen_label = getBoardLabel(c.board, label_string)
+        if chosen_label is None:
+            return None
+        c.add_label(chosen_label)
+        ids = cardIds(c)
+        ids['label_id'] = chosen_label.id
+        return ids
+
+    ids = withCard(client, board_name, listname, cardname, add_label, board_id, list_id, card_id)
+    print(json.dumps(ids if ids is not None else {}))
 
 
 @Action(name="Trello: Get labels on card", description="Given the path to a card, get the labels on it.",
@@ -279,30 +383,33 @@ def get_label_on_card_action(board_name, listname, cardname):
     :param cardname: Name of the card
     :return: {'labels': <label>} if the card is found, otherwise {'labels': none}
     """
-    client = createClient()
-
-    for b in client.list_boards():
-        if b.name == board_name:
-            board_labels = b.get_labels()
-            if board_labels is None:
-                continue
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            labels = [x.name for x in (c.labels if c.labels else [])]
-                            if len(labels) == 1:
-                                labels = labels[0]
-                            print(json.dumps({'labels': labels}))
-                            return
+    client = getClient()
+
+    # Depth 3, as a card's labels are stored with its details
+    index, ids = lookupRecorded(STATE_FILE, board_name, listname, cardname, depth=3)
+    if index is None:
+        card_json = withResolved(client, (board_name, listname, cardname), None,
+                                 lambda ids: client.fetch_json('/cards/' + ids[2], query_params={'fields': 'labels'}))
+    else:
+        card_json = index.get(ids[2]) if ids is not None else None
+    if card_json is not None:
+        labels = [x['name'] for x in (card_json['labels'] if card_json['labels'] else [])]
+        if len(labels) == 1:
+            labels = labels[0]
+        print(json.dumps({'labels': labels}))
+        return
 
     print(json.dumps({}))
 
 
 @Action(name="Trello: Set item on card checklist", description="Mark a given item on a checklist on or off.",
-        required_arg_types=['board_name:str', 'listname:str', 'cardname:str', 'checklist:str', 'item:str',
-                            'onoff:bool|none'])
-def check_item_card_checklist_action(board_name, listname, cardname, checklist, item, onoff=None):
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'checklist:str',
+                            'item:str', 'onoff:bool|none', 'board_id:str|none', 'list_id:str|none', 'card_id:str|none',
+                            'checklist_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none',
+                             'checklist_id:str|[str]|none'])
+def check_item_card_checklist_action(board_name, listname, cardname, checklist, item, onoff=None, board_id=None,
+                                     list_id=None, card_id=None, checklist_id=None):
     """
     Sets a checklist item to a given value on a card
     :param board_name: The board the card is in
@@ -311,35 +418,73 @@ def check_item_card_checklist_action(board_name, listname, cardname, checklist,
     :param checklist: The name of the checklist
     :param item: The item we're targeting
     :param onoff: Whether it should be turned on or off. Defaults to on if not supplied
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step, see make_comment_on_card_action
+    :param checklist_id: Optionally, the checklist's ID, which makes the card and checklist names unnecessary
+    :return: The IDs of the card and checklist if the checklist and item are found, otherwise {}
     """
 
-    client = createClient()
+    client = getClient()
 
     check_on = True
     if onoff is not None:
         check_on = onoff
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            board_labels = b.get_labels()
-            if board_labels is None:
-                continue
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            for check in c.checklists:
-                                if check.name == checklist:
-                                    check.set_checklist_item(item, check_on)
-                            print(json.dumps({}))
-                            return
+    c, done = withChecklistCard(client, (board_name, listname, cardname), (board_id, list_id, card_id),
+                                lambda card_id: setItems(client, card_id, checklist, {item: check_on}, checklist_id),
+                                resolve=checklist_id is None)
+    targets, results = done if done is not None else ([], {})
 
-    print(json.dumps({}))
+    print(json.dumps(checklistIds(c, targets) if results.get(item) == 'ok' else {}))
+
+
+@Action(name="Trello: Set items on card checklist", description="Mark several items on a checklist on or off at once.",
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'checklist:str',
+                            'items:str|[str]', 'onoff:bool|[bool]|none', 'board_id:str|none', 'list_id:str|none',
+                            'card_id:str|none', 'checklist_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none',
+                             'checklist_id:str|[str]|none', 'results:{str:str}'])
+def check_items_card_checklist_action(board_name, listname, cardname, checklist, items, onoff=None, board_id=None,
+                                      list_id=None, card_id=None, checklist_id=None):
+    """
+    Sets several checklist items on a card in one pass: the checklist is looked up once, then every item is updated
+    :param board_name: The board the card is in
+    :param listname: The list the card is in
+    :param cardname: The card
+    :param checklist: The name of the checklist
+    :param items: The names of the items
+    :param onoff: One value for every item, or one per item. Defaults to on if not supplied
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step, see make_comment_on_card_action
+    :param checklist_id: Optionally, the checklist's ID, which makes the card and checklist names unnecessary
+    :return: The IDs of the card and checklist plus {'results': {<item>: 'ok' | 'notfound' | 'error: <message>'}}
+             if the checklist is found, otherwise {'results': {<item>: 'notfound'}}
+    """
+
+    client = getClient()
+
+    items = asList(items)
+    check_on = asList(onoff) if onoff is not None else [True]
+    if len(check_on) == 1:
+        check_on = check_on * len(items)
+
+    c, done = withChecklistCard(client, (board_name, listname, cardname), (board_id, list_id, card_id),
+                                lambda card_id: setItems(client, card_id, checklist, dict(zip(items, check_on)),
+                                                         checklist_id),
+                                resolve=checklist_id is None)
+    targets, results = done if done is not None else ([], dict((item, 'notfound') for item in items))
+
+    ids = checklistIds(c, targets) if len(targets) > 0 else {}
+    ids['results'] = results
+    print(json.dumps(ids))
 
 
 @Action(name="Trello: Remove item on card checklist", description="Remove a given item from a checklist",
-        required_arg_types=['board_name:str', 'listname:str', 'cardname:str', 'checklist:str', 'item:str'])
-def remove_item_card_checklist_action(board_name, listname, cardname, checklist, item):
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'checklist:str',
+                            'item:str', 'board_id:str|none', 'list_id:str|none', 'card_id:str|none',
+                            'checklist_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none',
+                             'checklist_id:str|[str]|none'])
+def remove_item_card_checklist_action(board_name, listname, cardname, checklist, item, board_id=None, list_id=None,
+                                      card_id=None, checklist_id=None):
     """
     Remove a checklist item from a card
     :param board_name: The board the card is in
@@ -347,32 +492,29 @@ def remove_item_card_checklist_action(board_name, listname, cardname, checklist,
     :param cardname: The card
     :param checklist: The name of the checklist
     :param item: The item we're targeting
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step, see make_comment_on_card_action
+    :param checklist_id: Optionally, the checklist's ID, which makes the card and checklist names unnecessary
+    :return: The IDs of the card and checklist if the checklist and item are found, otherwise {}
     """
 
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            board_labels = b.get_labels()
-            if board_labels is None:
-                continue
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            for check in c.checklists:
-                                if check.name == checklist:
-                                    check.delete_checklist_item(item)
-                            print(json.dumps({}))
-                            return
+    c, done = withChecklistCard(client, (board_name, listname, cardname), (board_id, list_id, card_id),
+                                lambda card_id: removeItem(client, card_id, checklist, item, checklist_id),
+                                resolve=checklist_id is None)
+    targets, found = done if done is not None else ([], False)
 
-    print(json.dumps({}))
+    print(json.dumps(checklistIds(c, targets) if found else {}))
 
 
 @Action(name="Trello: Add item on card checklist", description="Add an item to a given checklist",
-        required_arg_types=['board_name:str', 'listname:str', 'cardname:str', 'checklist:str', 'item:str',
-                            'checked:bool|none'])
-def add_item_card_checklist_action(board_name, listname, cardname, checklist, item, checked=False):
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'checklist:str',
+                            'item:str', 'checked:bool|none', 'board_id:str|none', 'list_id:str|none',
+                            'card_id:str|none', 'checklist_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none',
+                             'checklist_id:str|[str]|none'])
+def add_item_card_checklist_action(board_name, listname, cardname, checklist, item, checked=False, board_id=None,
+                                   list_id=None, card_id=None, checklist_id=None):
     """
     Add a checklist item to a card
     :param board_name: The board the card is in
@@ -381,82 +523,179 @@ def add_item_card_checklist_action(board_name, listname, cardname, checklist, it
     :param checklist: The name of the checklist
     :param item: The item we're targeting
     :param checked: Whether it should be turned on or off. Defaults to off if not supplied.
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step, see make_comment_on_card_action
+    :param checklist_id: Optionally, the checklist's ID. Adding to it then takes a single request.
+    :return: The IDs of the card and checklist if the checklist is found, otherwise {}
     """
 
-    client = createClient()
+    client = getClient()
 
     check_on = False
     if checked is not None:
         check_on = checked
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            board_labels = b.get_labels()
-            if board_labels is None:
-                continue
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            for check in c.checklists:
-                                if check.name == checklist:
-                                    check.add_checklist_item(item, checked)
-                            print(json.dumps({}))
-                            return
+    c, targets = withChecklistCard(client, (board_name, listname, cardname), (board_id, list_id, card_id),
+                                   lambda card_id: addItem(client, card_id, checklist, item, check_on, checklist_id),
+                                   resolve=checklist_id is None or card_id is not None)
+    targets = targets if targets is not None else []
 
-    print(json.dumps({}))
+    print(json.dumps(checklistIds(c, targets) if len(targets) > 0 else {}))
 
 
 @Action(name="Trello: Add checklist to card", description="Add a new checklist to a card",
-        required_arg_types=['board_name:str', 'listname:str', 'cardname:str', 'checklist:str'])
-def add_checklist_to_card_action(board_name, listname, cardname, checklist):
+        required_arg_types=['board_name:str|none', 'listname:str|none', 'cardname:str|none', 'checklist:str',
+                            'board_id:str|none', 'list_id:str|none', 'card_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'list_id:str|none', 'card_id:str|none', 'checklist_id:str|none'])
+def add_checklist_to_card_action(board_name, listname, cardname, checklist, board_id=None, list_id=None,
+                                 card_id=None):
     """
     Add a checklist to a given card
     :param board_name: The board the card is in
     :param listname: The list the card is in
     :param cardname: The card
     :param checklist: The name of the checklist
+    :param board_id, list_id, card_id: Optionally, IDs from an earlier step, see make_comment_on_card_action
+    :return: The IDs of the card and the new checklist if the card is found, otherwise {}
     """
 
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            board_labels = b.get_labels()
-            if board_labels is None:
-                continue
-            for l in b.list_lists():
-                if l.name == listname:
-                    for c in l.list_cards():
-                        if c.name == cardname:
-                            c.add_checklist(checklist, [])
-                            print(json.dumps({}))
-                            return
+    def add_checklist(c):
+        # Card.add_checklist refetches the whole card afterwards, which a card built from its ID cannot do
+        json_obj = client.fetch_json('/cards/' + c.id + '/checklists', http_method='POST',
+                                     post_args={'name': checklist})
+        forgetChecklists(c.id)
+        ids = cardIds(c)
+        ids['checklist_id'] = json_obj['id']
+        return ids
 
-    print(json.dumps({}))
+    ids = withCard(client, board_name, listname, cardname, add_checklist, board_id, list_id, card_id)
+    print(json.dumps(ids if ids is not None else {}))
 
 
 @Action(name="Trello: Create label", description="Creates a new label for a given board",
-        required_arg_types=['board_name:str', 'color:str', 'name:str'])
-def create_label_action(board_name, color, name):
+        required_arg_types=['board_name:str|none', 'color:str', 'name:str', 'board_id:str|none'],
+        generated_arg_types=['board_id:str|none', 'label_id:str|none'])
+def create_label_action(board_name, color, name, board_id=None):
     """
     Creates a new label with the given parameters
     :param board_name: The board the card is in
     :param color: the color, either green, yellow, orange
             red, purple, blue, sky, lime, pink, or black
     :param name: The name of the label
+    :param board_id: Optionally, the board's ID from an earlier step, in place of its name
+    :return: {'board_id': <id>, 'label_id': <id>} if the board is found, otherwise {}
     """
 
-    client = createClient()
+    client = getClient()
 
-    for b in client.list_boards():
-        if b.name == board_name:
-            b.add_label(name, color)
-            print(json.dumps({}))
-            return
+    b = resolveBoard(client, board_name, board_id)
+    if b is not None:
+        label = b.add_label(name, color)
+        print(json.dumps({'board_id': b.id, 'label_id': label.id}))
+        return
 
     print(json.dumps({}))
 
+@Action(name="Trello: Export workspace", description="Write every board, list and card to a file, a board at a time.",
+        required_arg_types=['filepath:str', 'exclude:str|[str]|none'], generated_arg_types=['boards:int'])
+def export_workspace_action(filepath, exclude=None):
+    """
+    Exports the whole workspace without holding all of it in memory
+    :param filepath: Where to write. '.json' gives one JSON array, '.jsonl' the line-per-entity format of the state
+                     file, and a further '.gz' or '.zst' compresses it (zstd needs the zstandard package)
+    :param exclude: Card fields to leave out, such as 'attachments' or 'comments'. They are not fetched either.
+    :return: {'boards': <number of boards written>}
+    """
+    print(json.dumps({'boards': exportState(filepath, exclude=asList(exclude))}))
+
+
+@Action(name="Trello: Create comment on cards", description="Make the same comment on several cards of a board.",
+        required_arg_types=['board_name:str|none', 'listnames:str|[str]', 'cardnames:str|[str]', 'comment_string:str',
+                            'card_ids:str|[str]|none', 'board_id:str|none'],
+        generated_arg_types=['results:{str:str}'])
+def make_comment_on_cards_action(board_name, listnames, cardnames, comment_string, card_ids=None, board_id=None):
+    """
+    Comments on a batch of cards, resolving them all with a single board fetch
+    :param board_name: The name of the board the cards are in
+    :param listnames: The list all the cards are under, or one list per card name
+    :param cardnames: The names of the cards
+    :param comment_string: The comment to make
+    :param card_ids: Optionally, IDs of further cards, which must be on the board if one is given
+    :param board_id: Optionally, the board's ID from an earlier step, in place of its name
+    :return: {'results': {<listname/cardname or card id>: 'ok' | 'notfound' | 'error: <message>'}}
+    """
+    client = getClient()
+
+    targets = batchTargets(client, board_name, listnames, cardnames, card_ids, board_id)
+    print(json.dumps({'results': runBatch(targets, lambda c: c.comment(comment_string))}))
+
+
+@Action(name="Trello: Add label to cards", description="Add a label to several cards of a board.",
+        required_arg_types=['board_name:str|none', 'listnames:str|[str]', 'cardnames:str|[str]', 'label_string:str',
+                            'card_ids:str|[str]|none', 'board_id:str|none'],
+        generated_arg_types=['results:{str:str}'])
+def add_label_on_cards_action(board_name, listnames, cardnames, label_string, card_ids=None, board_id=None):
+    """
+    Adds a label to a batch of cards, resolving them all with a single board fetch
+    :param board_name: The name of the board the cards are in
+    :param listnames: The list all the cards are under, or one list per card name
+    :param cardnames: The names of the cards
+    :param label_string: The name of the label
+    :param card_ids: Optionally, IDs of further cards, which must be on the board if one is given
+    :param board_id: Optionally, the board's ID from an earlier step, in place of its name
+    :return: {'results': {<listname/cardname or card id>: 'ok' | 'notfound' | 'error: <message>'}}
+    """
+    client = getClient()
+
+    targets = batchTargets(client, board_name, listnames, cardnames, card_ids, board_id)
+    # The label on each board the cards are on, looked up once per board
+    labels = {}
+
+    def add_label(c):
+        if c.board.id is None:
+            # The labels belong to the board, so a card given by ID alone has to tell us which one it is on
+            c.board.id = client.fetch_json('/cards/' + c.id, query_params={'fields': 'idBoard'})['idBoard']
+        if c.board.id not in labels:
+            labels[c.board.id] = getBoardLabel(c.board, label_string)
+        if labels[c.board.id] is None:
+            return 'notfound'
+        c.add_label(labels[c.board.id])
+
+    print(json.dumps({'results': runBatch(targets, add_label)}))
+
+
+@Action(name="Trello: Set item on cards checklist", description="Mark an item on a checklist on or off on several cards.",
+        required_arg_types=['board_name:str|none', 'listnames:str|[str]', 'cardnames:str|[str]', 'checklist:str',
+                            'item:str', 'onoff:bool|none', 'card_ids:str|[str]|none', 'board_id:str|none'],
+        generated_arg_types=['results:{str:str}'])
+def check_item_cards_checklist_action(board_name, listnames, cardnames, checklist, item, onoff=None, card_ids=None,
+                                      board_id=None):
+    """
+    Sets a checklist item to a given value on a batch of cards, resolving them all with a single board fetch
+    :param board_name: The name of the board the cards are in
+    :param listnames: The list all the cards are under, or one list per card name
+    :param cardnames: The names of the cards
+    :param checklist: The name of the checklist
+    :param item: The item we're targeting
+    :param onoff: Whether it should be turned on or off. Defaults to on if not supplied
+    :param card_ids: Optionally, IDs of further cards, which must be on the board if one is given
+    :param board_id: Optionally, the board's ID from an earlier step, in place of its name
+    :return: {'results': {<listname/cardname or card id>: 'ok' | 'notfound' | 'error: <message>'}}
+    """
+    client = getClient()
+
+    check_on = True
+    if onoff is not None:
+        check_on = onoff
+
+    def set_item(c):
+        # 'notfound' when the card lacks the checklist or the item, 'error: ...' when the update failed
+        return setItems(client, c.id, checklist, {item: check_on})[1][item]
+
+    targets = batchTargets(client, board_name, listnames, cardnames, card_ids, board_id)
+    print(json.dumps({'results': runBatch(targets, set_item)}))
+
 #does_card_exist_action('Suave - Flow Code', 'Plugins', 'TrelloPlugin TODO')
 #does_card_exist_action('Suave - Flow Code', 'Plugins', 'TrelloPlugin TODdafO')
 # add_checklist_to_card_action('Suave - Flow Code', 'Plugins', 'TrelloPlugin TODO', 'Automation checklist')
\ No newline at end of file
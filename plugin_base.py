@@ -1,23 +1,37 @@
+import functools
+from ratelimit import requestPriority, PRIORITY_ACTION, PRIORITY_TRIGGER
+from metrics import measure
+
 # Decorator for triggers
 # A trigger is an event that we can watch.
 # We expect it to return True if the event has happened and False if not.
 # If it has 'required_arg_types', then the trigger will request those arguments in the console
 # and will be passed them at runtime.
+# 'datasets' optionally names the data the trigger polls (e.g. 'snapshot:0' for getJsonState(depth=0)), so a
+# scheduler can check triggers that need the same data together and fetch it once for all of them.
 class Trigger():
-	def __init__(self, name, description, required_arg_types=[], generated_arg_types=[]):
+	def __init__(self, name, description, required_arg_types=[], generated_arg_types=[], datasets=[]):
 		self.trigger = True
 		self.tname = name
 		self.tdesc = description
 		self.treqs = required_arg_types
 		self.tgen = generated_arg_types
+		self.tdata = datasets
 
 	def __call__(self, f):
-		f.trigger = self.trigger
-		f.tname = self.tname
-		f.tdesc = self.tdesc
-		f.treqs = self.treqs
-		f.tgen = self.tgen
-		return f
+		# Trigger polls run in the background, so their requests yield to actions when we are rate limited.
+		# Every call is measured, see metrics.py.
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			with requestPriority(PRIORITY_TRIGGER), measure(f.__name__, 'trigger'):
+				return f(*args, **kwargs)
+		wrapper.trigger = self.trigger
+		wrapper.tname = self.tname
+		wrapper.tdesc = self.tdesc
+		wrapper.treqs = self.treqs
+		wrapper.tgen = self.tgen
+		wrapper.tdata = self.tdata
+		return wrapper
 
 # Decorator for actions
 # An action is a method that we should be able to call to perform some arbitrary thing.
@@ -36,12 +50,16 @@ class Action():
 		self.agen = generated_arg_types
 
 	def __call__(self, f):
-		f.action = self.action
-		f.aname = self.aname
-		f.adesc = self.adesc
-		f.areqs = self.areqs
-		f.agen = self.agen
-		return f
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			with requestPriority(PRIORITY_ACTION), measure(f.__name__, 'action'):
+				return f(*args, **kwargs)
+		wrapper.action = self.action
+		wrapper.aname = self.aname
+		wrapper.adesc = self.adesc
+		wrapper.areqs = self.areqs
+		wrapper.agen = self.agen
+		return wrapper
 
 # Decorator for any actions that must be run before Suave is opened. This can be where background services
 # are started, models are loaded, or files are created.
@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Requests per second allowed to each host, and how many may be sent back to back.
+HOST_RATE = 10.0
+HOST_BURST = 10
+# Trello allows 100 requests per 10 seconds for each token, and 300 for each API key.
+TOKEN_RATE = 10.0
+TOKEN_BURST = 100
+KEY_RATE = 30.0
+KEY_BURST = 300
+# How often a 429 is retried, and the backoff (in seconds) when Trello does not send Retry-After
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Request priorities. User-invoked actions go ahead of background trigger polls when we are throttled.
+PRIORITY_ACTION = 0
+PRIORITY_TRIGGER = 1
+
+_priority = contextvars.ContextVar('request_priority', default=PRIORITY_ACTION)
+
+def currentPriority():
+	return _priority.get()
+
+@contextmanager
+def requestPriority(priority):
+	token = _priority.set(priority)
+	try:
+		yield
+	finally:
+		_priority.reset(token)
+
+def carryPriority(fn):
+	# Thread pool workers do not inherit our context, so hand them a copy of the caller's: its priority,
+	# and the measurement (see metrics.py) that their requests count towards
+	context = contextvars.copy_context()
+
+	def run(*args, **kwargs):
+		return context.copy().run(fn, *args, **kwargs)
+	return run
+
+# A token bucket: 'rate' tokens are added every second, up to 'burst', and each request takes one.
+# While higher priority requests are waiting for a token, lower priority ones keep waiting behind them.
+class TokenBucket():
+	def __init__(self, rate, burst):
+		self.rate = float(rate)
+		self.burst = burst
+		self.tokens = float(burst)
+		self.updated = time.monotonic()
+		self.waiting = [0, 0]
+		self.cond = threading.Condition()
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self, priority=PRIORITY_ACTION):
+		# Blocks until a token is available, and returns how long we waited
+		start = time.monotonic()
+		with self.cond:
+			self.waiting[priority] += 1
+			try:
+				while True:
+					self._refill()
+					if self.tokens >= 1 and sum(self.waiting[:priority]) == 0:
+						self.tokens -= 1
+						return time.monotonic() - start
+					self.cond.wait(max((1 - self.tokens) / self.rate, 0.001))
+			finally:
+				self.waiting[priority] -= 1
+				self.cond.notify_all()
+
+	def take(self, priority=PRIORITY_ACTION):
+		# Takes a token without blocking. Returns 0 if it got one, otherwise how long to wait before trying again.
+		with self.cond:
+			self._refill()
+			if self.tokens >= 1 and sum(self.waiting[:priority + 1]) == 0:
+				self.tokens -= 1
+				return 0
+			return max((1 - self.tokens) / self.rate, 0.001)
+
+# Keeps one token bucket per host, so concurrent snapshot workers cannot flood any single API.
+class HostRateLimiter():
+	def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+		self.rate = rate
+		self.burst = burst
+		self.buckets = {}
+		self.lock = threading.Lock()
+
+	def bucket(self, url):
+		host = urlsplit(url).netloc
+		with self.lock:
+			if host not in self.buckets:
+				self.buckets[host] = TokenBucket(self.rate, self.burst)
+			return self.buckets[host]
+
+	def acquire(self, url, priority=PRIORITY_ACTION):
+		return self.bucket(url).acquire(priority)
+
+def _credentials(kwargs):
+	# The API key and token a request is made with, whether sent as query params or through OAuth1
+	params = kwargs.get('params') or {}
+	auth = kwargs.get('auth')
+	if auth is not None and hasattr(auth, 'client'):
+		return auth.client.client_key, auth.client.resource_owner_key
+	return params.get('key'), params.get('token')
+
+# Sits between the shared session and the network. Every request takes a token from its host's bucket,
+# its API key's bucket and its token's bucket, in priority order, and 429 responses are retried after
+# Retry-After (or an exponential backoff with jitter).
+class RequestScheduler():
+	def __init__(self, host_rate=HOST_RATE, key_rate=KEY_RATE, token_rate=TOKEN_RATE, max_retries=MAX_RETRIES):
+		self.hosts = HostRateLimiter(rate=host_rate)
+		self.key_rate = key_rate
+		self.token_rate = token_rate
+		self.max_retries = max_retries
+		self.buckets = {}
+		self.lock = threading.Lock()
+		self.stats = {'requests': 0, 'throttled': 0, 'rate_limited': 0, 'retried': 0}
+
+	def _bucket(self, kind, name, rate, burst):
+		with self.lock:
+			if (kind, name) not in self.buckets:
+				self.buckets[(kind, name)] = TokenBucket(rate, burst)
+			return self.buckets[(kind, name)]
+
+	def _count(self, stat):
+		with self.lock:
+			self.stats[stat] += 1
+
+	def retryDelay(self, response, attempt):
+		retry_after = response.headers.get('Retry-After')
+		if retry_after is not None:
+			try:
+				return float(retry_after) + random.uniform(0, BACKOFF_BASE)
+			except ValueError:
+				pass
+		return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+	def _buckets(self, url, kwargs):
+		key, token = _credentials(kwargs)
+		buckets = [self.hosts.bucket(url)]
+		if key:
+			buckets.append(self._bucket('key', key, self.key_rate, KEY_BURST))
+		if token:
+			buckets.append(self._bucket('token', token, self.token_rate, TOKEN_BURST))
+		return buckets
+
+	def send(self, url, kwargs, send):
+		"""
+		Sends a request once the rate limits allow it.
+		:param kwargs: The keyword arguments of the request, used to find its API key and token
+		:param send: A function performing the request and returning its response
+		"""
+		priority = currentPriority()
+		buckets = self._buckets(url, kwargs)
+
+		attempt = 0
+		while True:
+			self._count('requests')
+			waited = sum(bucket.acquire(priority) for bucket in buckets)
+			if waited > 0.001:
+				self._count('throttled')
+			response = send()
+			if response.status_code != 429:
+				return response
+			self._count('rate_limited')
+			if attempt >= self.max_retries:
+				return response
+			self._count('retried')
+			time.sleep(self.retryDelay(response, attempt))
+			attempt += 1
+
+	async def sendAsync(self, url, kwargs, send):
+		"""
+		Like send, for asyncio: waits for the rate limits without blocking the event loop.
+		:param send: A function returning an awaitable for the response, which needs a 'status' and 'headers'
+		"""
+		priority = currentPriority()
+		buckets = self._buckets(url, kwargs)
+
+		attempt = 0
+		while True:
+			self._count('requests')
+			throttled = False
+			for bucket in buckets:
+				wait = bucket.take(priority)
+				while wait > 0:
+					throttled = True
+					await asyncio.sleep(wait)
+					wait = bucket.take(priority)
+			if throttled:
+				self._count('throttled')
+			response = await send()
+			if response.status != 429:
+				return response
+			self._count('rate_limited')
+			if attempt >= self.max_retries:
+				return response
+			self._count('retried')
+			await asyncio.sleep(self.retryDelay(response, attempt))
+			attempt += 1
+
+	def getStats(self):
+		with self.lock:
+			return dict(self.stats)
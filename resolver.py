@@ -0,0 +1,215 @@
+import time
+import threading
+from collections import OrderedDict
+from trello import Board, List, Card
+from trello.exceptions import ResourceUnavailable
+from metrics import countCache, section
+
+# How many name paths we remember, and for how long (in seconds) an answer is trusted.
+CACHE_SIZE = 1024
+CACHE_TTL = 300
+
+# A bounded LRU cache of name paths to Trello IDs.
+# Keys are tuples of names: (board_name,), (board_name, listname) or (board_name, listname, cardname).
+# Entries expire after 'ttl' seconds, and the least recently used entry is dropped once 'maxsize' is reached.
+# Hits and misses are counted in the metrics under 'name'.
+class PathCache():
+	def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, name='path'):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.name = name
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and entry[1] < time.time():
+				del self.entries[key]
+				entry = None
+			countCache(self.name, entry is not None)
+			if entry is None:
+				return None
+			self.entries.move_to_end(key)
+			return entry[0]
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries[key] = (value, time.time() + self.ttl)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+
+	def invalidate(self, key):
+		# Dropping a path also drops everything underneath it
+		with self.lock:
+			for k in [k for k in self.entries if k[:len(key)] == key]:
+				del self.entries[k]
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+pathCache = PathCache()
+
+def _childrenRequest(ids):
+	# The (uri, query) listing the children of the last resolved id (or the boards if none are resolved yet)
+	if len(ids) == 0:
+		return '/members/me/boards', {'filter': 'all', 'fields': 'name'}
+	elif len(ids) == 1:
+		return '/boards/' + ids[0] + '/lists', {'filter': 'all', 'fields': 'name'}
+	return '/lists/' + ids[1] + '/cards', {'fields': 'name'}
+
+def walkSteps(names, known=None, fresh=False):
+	"""
+	The resolution walk, written as a generator so the same steps can be driven with blocking or async requests.
+	It yields (uri, query) for every listing it needs, is sent the JSON back, and finally returns (ids, used_cache).
+	:param known: IDs already known along the path, or None for each one that is not. The walk starts below the
+	              deepest known ID, so the names down to it are not needed, and unknown IDs above it stay None.
+	:param fresh: Ask the API for every step, though what it answers is still cached
+	"""
+	known = list(known or [])[:len(names)]
+	start = max([depth for depth, id in enumerate(known) if id is not None] or [-1]) + 1
+	ids = (known + [None] * start)[:start]
+	used_cache = False
+	for depth in range(start, len(names)):
+		key = tuple(names[:depth + 1])
+		# Names below a given ID are only cached when the whole path came by name, as the two may disagree
+		cached = start == 0
+		found = pathCache.get(key) if cached and not fresh else None
+		if found is None:
+			try:
+				listing = yield _childrenRequest(ids)
+			except ResourceUnavailable:
+				return None, used_cache
+			# Remember every sibling we just paid for, keeping the first one when names repeat
+			seen = set()
+			for name, id in ((x['name'], x['id']) for x in listing):
+				if name not in seen:
+					seen.add(name)
+					if cached:
+						pathCache.put(key[:-1] + (name,), id)
+					if name == names[depth]:
+						found = id
+			if found is None:
+				return None, used_cache
+		else:
+			used_cache = True
+		ids.append(found)
+	return ids, used_cache
+
+def _walk(client, names, known=None, fresh=False):
+	steps = walkSteps(names, known, fresh)
+	try:
+		request = next(steps)
+		while True:
+			try:
+				response = client.fetch_json(request[0], query_params=request[1])
+			except ResourceUnavailable as e:
+				request = steps.throw(e)
+			else:
+				request = steps.send(response)
+	except StopIteration as done:
+		return done.value
+
+def _verified(client, names, ids):
+	# Whether cached IDs still sit at the named path, checked with one request for the deepest of them
+	try:
+		if len(ids) == 1:
+			return client.fetch_json('/boards/' + ids[0], query_params={'fields': 'name'})['name'] == names[0]
+		parents = {'board': 'true', 'board_fields': 'name'}
+		if len(ids) == 2:
+			list_obj = client.fetch_json('/lists/' + ids[1], query_params=dict(parents, fields='name,idBoard'))
+			return [list_obj['board']['name'], list_obj['name']] == names and list_obj['idBoard'] == ids[0]
+		card = client.fetch_json('/cards/' + ids[2], query_params=dict(parents, fields='name,closed,idBoard,idList',
+																	   list='true', list_fields='name'))
+		# Card listings only hold open cards, so an archived one is as good as gone
+		return [card['board']['name'], card['list']['name'], card['name']] == names and not card['closed'] and \
+			[card['idBoard'], card['idList']] == ids[:2]
+	except ResourceUnavailable:
+		return False
+
+def resolveIds(client, *names, known=None, fresh=False, verify=False):
+	"""
+	Resolves a (board_name[, listname[, cardname]]) path to the matching list of Trello IDs.
+	:param known: IDs the caller already has for the path, see walkSteps
+	:param fresh: Ask the API rather than the cache
+	:param verify: Check an answer that came from the cache with one request, as existence checks must not trust it
+	:return: The IDs along the path, or None if any part of it does not exist.
+	"""
+	with section('resolve'):
+		ids, used_cache = _walk(client, names, known, fresh)
+		stale = used_cache and (ids is None or (verify and not _verified(client, list(names), ids)))
+		if stale:
+			# A cached ID may have gone stale (deleted, renamed or moved), so retry once against the live tree
+			pathCache.invalidate(tuple(names[:1]))
+			ids, used_cache = _walk(client, names, known, fresh=True)
+	return ids
+
+def invalidatePath(*names):
+	pathCache.invalidate(tuple(names))
+
+def _notFound(error):
+	return getattr(error, '_status', None) == 404
+
+def withResolved(client, names, known, use):
+	"""
+	Calls use(ids) with the IDs of a (board_name[, listname[, cardname]]) path, see resolveIds. A 404 from use()
+	means an ID went stale (deleted, renamed or moved since it was cached), so the path is dropped, resolved again
+	against the live tree and use() retried once.
+	:return: What use() returned, or None if the path cannot be found, then or on the retry
+	"""
+	ids = resolveIds(client, *names, known=known)
+	if ids is None:
+		return None
+	try:
+		return use(ids)
+	except ResourceUnavailable as e:
+		if not _notFound(e):
+			raise
+	invalidatePath(*names)
+	if known is not None and len(known) >= len(names) and known[len(names) - 1] is not None:
+		# The caller gave the ID itself, so there is nothing to look up again
+		return None
+	ids = resolveIds(client, *names, known=known, fresh=True)
+	if ids is None:
+		return None
+	try:
+		return use(ids)
+	except ResourceUnavailable as e:
+		if not _notFound(e):
+			raise
+		return None
+
+# The resolve* functions take the IDs a caller may already have after the names; those are used as they are.
+# Objects built from a given ID keep None for the IDs above it that were not given.
+def resolveBoard(client, board_name, board_id=None):
+	ids = resolveIds(client, board_name, known=[board_id])
+	if ids is None:
+		return None
+	return Board(client, board_id=ids[0], name=board_name)
+
+def resolveList(client, board_name, listname, board_id=None, list_id=None):
+	ids = resolveIds(client, board_name, listname, known=[board_id, list_id])
+	if ids is None:
+		return None
+	return List(Board(client, board_id=ids[0], name=board_name), ids[1], name=listname)
+
+def _card(client, ids, board_name, listname, cardname):
+	board = Board(client, board_id=ids[0], name=board_name)
+	return Card(List(board, ids[1], name=listname), ids[2], name=cardname)
+
+def resolveCard(client, board_name, listname, cardname, board_id=None, list_id=None, card_id=None):
+	ids = resolveIds(client, board_name, listname, cardname, known=[board_id, list_id, card_id])
+	if ids is None:
+		return None
+	return _card(client, ids, board_name, listname, cardname)
+
+def withCard(client, board_name, listname, cardname, use, board_id=None, list_id=None, card_id=None):
+	# withResolved() for a card: calls use(card), resolving the card afresh and retrying once after a 404
+	return withResolved(client, (board_name, listname, cardname), [board_id, list_id, card_id],
+						lambda ids: use(_card(client, ids, board_name, listname, cardname)))
+
+def cardIds(card):
+	# The IDs behind a resolved card, as actions report them
+	return {'board_id': card.board.id, 'list_id': card.trello_list.id, 'card_id': card.id}
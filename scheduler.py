@@ -0,0 +1,121 @@
+import contextlib
+import io
+import itertools
+import json
+import random
+import threading
+import time
+from base import sharedSnapshots
+
+# Defaults, in seconds. Triggers are checked in ticks: everything due by a tick runs in it and shares its data.
+TICK_INTERVAL = 5
+POLL_INTERVAL = 30
+# Fraction of an interval by which each run is randomly moved earlier or later
+JITTER = 0.1
+
+def runCaptured(fn, args):
+	# Calls a trigger and parses the JSON it prints
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		if isinstance(args, list):
+			fn(*args)
+		else:
+			fn(**(args or {}))
+	lines = [line for line in output.getvalue().splitlines() if line.strip()]
+	return json.loads(lines[-1]) if lines else None
+
+class ScheduledTrigger():
+	def __init__(self, id, fn, args, interval, jitter, callback):
+		self.id = id
+		self.fn = fn
+		self.args = args
+		self.interval = interval
+		self.jitter = jitter
+		self.callback = callback
+		self.datasets = tuple(sorted(getattr(fn, 'tdata', [])))
+		self.next_run = time.time()
+		self.last_result = None
+
+	def reschedule(self, now):
+		self.next_run = now + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+# Checks registered triggers on their own intervals, but in shared ticks: every trigger due in a tick runs
+# inside one sharedSnapshots() block, grouped by the datasets it declares, so each dataset is fetched once
+# per tick however many triggers (or argument variations of one trigger) are registered.
+class TriggerScheduler():
+	def __init__(self, runner=runCaptured, tick_interval=TICK_INTERVAL):
+		self.runner = runner
+		self.tick_interval = tick_interval
+		self.entries = {}
+		self.ids = itertools.count(1)
+		self.lock = threading.Lock()
+		self.stopping = threading.Event()
+		# Changed and read under the lock, as ticks run on their own thread
+		self.stats = {'ticks': 0, 'checks': 0, 'errors': 0}
+
+	def _count(self, stat, n=1):
+		with self.lock:
+			self.stats[stat] += n
+
+	def getStats(self):
+		with self.lock:
+			return dict(self.stats)
+
+	def register(self, fn, args=None, interval=POLL_INTERVAL, jitter=JITTER, callback=None):
+		"""
+		Schedules a trigger.
+		:param args: Its arguments, as a dict of keywords or a list of positionals
+		:param callback: Called as callback(entry, result, error) after every check
+		:return: An ID for unregister
+		"""
+		with self.lock:
+			entry = ScheduledTrigger(next(self.ids), fn, args, interval, jitter, callback)
+			self.entries[entry.id] = entry
+			return entry.id
+
+	def unregister(self, id):
+		with self.lock:
+			return self.entries.pop(id, None) is not None
+
+	def tick(self, now=None):
+		"""
+		Checks every trigger that is due.
+		:return: How many triggers were checked
+		"""
+		now = time.time() if now is None else now
+		with self.lock:
+			due = [e for e in self.entries.values() if e.next_run <= now]
+		due.sort(key=lambda e: e.datasets)
+
+		with sharedSnapshots():
+			for entry in due:
+				result, error = None, None
+				try:
+					result = self.runner(entry.fn, entry.args)
+				except Exception as e:
+					error = str(e)
+					self._count('errors')
+				entry.last_result = result
+				entry.reschedule(now)
+				if entry.callback is not None:
+					try:
+						entry.callback(entry, result, error)
+					except Exception:
+						# Whoever was listening has gone away
+						self.unregister(entry.id)
+		self._count('ticks')
+		self._count('checks', len(due))
+		return len(due)
+
+	def run(self):
+		while not self.stopping.is_set():
+			self.tick()
+			self.stopping.wait(self.tick_interval * (1 + random.uniform(-JITTER, JITTER)))
+
+	def start(self):
+		thread = threading.Thread(target=self.run, daemon=True)
+		thread.start()
+		return thread
+
+	def stop(self):
+		self.stopping.set()
@@ -0,0 +1,48 @@
+import requests
+from requests.adapters import HTTPAdapter
+from ratelimit import RequestScheduler, HOST_RATE
+from metrics import countRequest
+from singleflight import SingleFlight, CACHE_TTL, apiPath
+
+# Defaults for the shared connection pool. Timeouts are in seconds.
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+# py-trello always calls the real API. Sessions given another api_root (such as a local fake) send there instead.
+TRELLO_API_ROOT = 'https://api.trello.com'
+
+# A requests session with a keep-alive connection pool that applies our timeouts to every call and sends it
+# through a RequestScheduler for rate limiting. py-trello accepts it in place of the 'requests' module as its http_service.
+# Identical GETs in flight at the same time are sent once (see singleflight.py), and any other method
+# invalidates the GET responses it may have changed.
+class PooledSession(requests.Session):
+	def __init__(self, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+				 host_rate=HOST_RATE, api_root=None, cache_ttl=CACHE_TTL):
+		super().__init__()
+		self.timeout = (connect_timeout, read_timeout)
+		self.api_root = api_root.rstrip('/') if api_root else None
+		self.scheduler = RequestScheduler(host_rate=host_rate)
+		self.flights = SingleFlight(ttl=cache_ttl)
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+		self.mount('https://', adapter)
+		self.mount('http://', adapter)
+
+	def request(self, method, url, **kwargs):
+		if kwargs.get('timeout') is None:
+			kwargs['timeout'] = self.timeout
+		if self.api_root is not None and url.startswith(TRELLO_API_ROOT):
+			url = self.api_root + url[len(TRELLO_API_ROOT):]
+
+		def send():
+			response = self.scheduler.send(url, kwargs, lambda: super(PooledSession, self).request(method, url, **kwargs))
+			countRequest(len(response.content))
+			return response
+
+		if method.upper() != 'GET':
+			try:
+				return send()
+			finally:
+				self.flights.invalidate(apiPath(url))
+		params = kwargs.get('params') or {}
+		key = (url, tuple(sorted((k, str(v)) for k, v in params.items() if v is not None)), id(kwargs.get('auth')))
+		return self.flights.fetch(key, apiPath(url), send)
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from metrics import countCache
+
+# How long (in seconds) a GET response may be reused by later identical GETs. 0 only shares requests in flight.
+CACHE_TTL = 0.0
+CACHE_SIZE = 256
+
+def apiPath(url):
+	# '/cards/<id>/checklists' for 'https://api.trello.com/1/cards/<id>/checklists'
+	path = urlsplit(url).path
+	return path[2:] if path.startswith('/1/') else path
+
+def affectedBy(path):
+	"""
+	Returns a test for the GET paths whose responses a mutation of 'path' may have changed.
+	"""
+	parts = path.strip('/').split('/')
+	kind = parts[0]
+	id = parts[1] if len(parts) > 1 else None
+	if kind in ('cards', 'checklists', 'actions'):
+		# Cards show up in card, list and board responses; only board listings, lists and labels are safe
+		return lambda p: not (p.startswith('/members/') or p.endswith('/lists') or p.endswith('/labels'))
+	if kind == 'labels':
+		return lambda p: not (p.startswith('/members/') or p.endswith('/lists'))
+	if kind == 'boards' and id is not None:
+		return lambda p: p.startswith('/members/') or p.startswith('/boards/' + id)
+	if kind == 'boards':
+		return lambda p: p.startswith('/members/')
+	return lambda p: True
+
+class Flight():
+	__slots__ = ('path', 'event', 'response', 'error', 'valid')
+
+	def __init__(self, path):
+		self.path = path
+		self.event = threading.Event()
+		self.response = None
+		self.error = None
+		self.valid = True
+
+# Collapses identical concurrent GETs into one request: the first caller sends it, and everyone asking for the
+# same thing meanwhile waits for and shares its response. With a ttl, responses are also reused for that long.
+# Mutations call invalidate(), which drops cached responses they may have changed and stops new callers from
+# joining requests already in flight for them.
+class SingleFlight():
+	def __init__(self, ttl=CACHE_TTL, maxsize=CACHE_SIZE):
+		self.ttl = ttl
+		self.maxsize = maxsize
+		self.flights = {}
+		self.cache = OrderedDict()
+		self.lock = threading.Lock()
+
+	def fetch(self, key, path, send):
+		"""
+		:param key: Identifies the request; equal keys share a response
+		:param path: The API path, for invalidate()
+		:param send: Performs the request and returns its response
+		"""
+		with self.lock:
+			cached = self.cache.get(key)
+			if cached is not None and cached[1] > time.monotonic():
+				countCache('http', True)
+				return cached[0]
+			flight = self.flights.get(key)
+			leader = flight is None
+			if leader:
+				flight = self.flights[key] = Flight(path)
+
+		countCache('http', not leader)
+		if not leader:
+			flight.event.wait()
+			if flight.error is not None:
+				raise flight.error
+			return flight.response
+
+		try:
+			flight.response = send()
+			# Read the body now, so the followers only share a finished response
+			flight.response.content
+			return flight.response
+		except BaseException as e:
+			flight.error = e
+			raise
+		finally:
+			with self.lock:
+				if self.flights.get(key) is flight:
+					del self.flights[key]
+				if self.ttl > 0 and flight.valid and flight.error is None and flight.response.status_code == 200:
+					self.cache[key] = (flight.response, time.monotonic() + self.ttl, path)
+					self.cache.move_to_end(key)
+					while len(self.cache) > self.maxsize:
+						self.cache.popitem(last=False)
+			flight.event.set()
+
+	def invalidate(self, path):
+		affected = affectedBy(path)
+		with self.lock:
+			for key in [k for k, entry in self.cache.items() if affected(entry[2])]:
+				del self.cache[key]
+			for key in [k for k, flight in self.flights.items() if affected(flight.path)]:
+				# Its callers still get the response, but it may predate the mutation, so nobody new joins it
+				self.flights[key].valid = False
+				del self.flights[key]
+
+	def clear(self):
+		with self.lock:
+			self.cache.clear()
@@ -0,0 +1,403 @@
+import datetime
+import hashlib
+import json
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from dateutil import parser as dateparser
+from trello.exceptions import ResourceUnavailable
+from ratelimit import carryPriority
+from stateindex import StateIndex
+from metrics import section
+
+# Trello caps nested actions at 1000 per board; cards with more comments than that are topped up one by one.
+COMMENT_LIMIT = 1000
+COMMENT_FILTER = 'commentCard,copyCommentCard'
+# The card fields every record carries. Descriptions, attachments, checklists and comments are loaded on demand.
+CARD_FIELDS = 'name,badges,closed,dateLastActivity,idMembers,idList,labels,pos'
+# Card fields that cost extra data or requests; excluding one of them also leaves it out of the fetch
+EXCLUDABLE = ('description', 'attachments', 'checklists', 'comments')
+# How often a board or list fetch that failed in passing (a 5xx, a timeout, a dropped connection) is tried again,
+# and the backoff in seconds. Rate limiting (429) is retried by the request scheduler already.
+FETCH_RETRIES = 3
+RETRY_BASE = 0.5
+RETRY_MAX = 10.0
+
+# Marks a heavy field that has not been fetched yet
+_UNLOADED = object()
+
+def _deeper(depth, level):
+	return depth is None or depth >= level
+
+def isTransient(error):
+	if isinstance(error, ResourceUnavailable):
+		return getattr(error, '_status', 0) >= 500
+	return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+def retried(fetch, retries=None):
+	"""
+	Calls fetch(), trying again after a transient failure with exponential backoff and jitter.
+	:param retries: How often to try again, FETCH_RETRIES by default
+	:return: (what fetch() returned, how many attempts it took)
+	"""
+	retries = FETCH_RETRIES if retries is None else retries
+	attempt = 1
+	while True:
+		try:
+			return fetch(), attempt
+		except Exception as e:
+			if attempt > retries or not isTransient(e):
+				raise
+		time.sleep(random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt)))
+		attempt += 1
+
+def contentHash(obj, depth=None):
+	"""
+	A short hash of a record's JSON, children included, prefixed with the depth it was built at. Records only
+	hold the same content when their hashes match, and hashes of records built to different depths never match.
+	"""
+	digest = hashlib.blake2b(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8'), digest_size=8)
+	return '%s:%s' % (4 if depth is None else min(depth, 4), digest.hexdigest())
+
+def boardQuery(depth=None, exclude=()):
+	"""
+	Builds the query for a single nested /boards/<id> request that returns everything needed at the given depth.
+	:param depth: Same meaning as in getJsonState; None fetches everything
+	:param exclude: Card fields that are not wanted, see EXCLUDABLE
+	"""
+	query = {'fields': 'name,closed', 'lists': 'all', 'list_fields': 'name,closed', 'labels': 'all',
+			 'label_fields': 'name,color'}
+	if _deeper(depth, 2):
+		query['cards'] = 'open'
+		query['card_fields'] = CARD_FIELDS + (',desc' if 'description' not in exclude else '')
+		if 'attachments' not in exclude:
+			query['card_attachments'] = 'true'
+	if _deeper(depth, 3) and 'checklists' not in exclude:
+		query['checklists'] = 'all'
+		query['checklist_fields'] = 'name,idCard,pos'
+	if _deeper(depth, 3) and 'comments' not in exclude:
+		query['actions'] = COMMENT_FILTER
+		query['actions_limit'] = COMMENT_LIMIT
+	return query
+
+def fetchBoardTree(client, board_id, depth=None, exclude=()):
+	return client.fetch_json('/boards/' + board_id, query_params=boardQuery(depth, exclude))
+
+def listBoards(client):
+	return client.fetch_json('/members/me/boards', query_params={'filter': 'all', 'fields': 'name,closed'})
+
+class ChecklistRecord():
+	__slots__ = ('id', 'name', 'pos', 'items')
+
+	def __init__(self, checklist):
+		self.id = checklist['id']
+		self.name = checklist['name']
+		self.pos = checklist['pos']
+		self.items = [{'name': item['name'], 'checked': item['state'] == 'complete'}
+					  for item in sorted(checklist.get('checkItems', []), key=lambda i: i.get('pos'))]
+
+	def toJson(self, depth=None):
+		return {
+			'name': self.name,
+			'id': self.id,
+			'items': list(self.items) if _deeper(depth, 4) else []
+		}
+
+# Raised by Snapshot.stream() once it has yielded every board it could. 'failed' maps the other boards' IDs to
+# their errors.
+class IncompleteSnapshotError(Exception):
+	def __init__(self, failed):
+		Exception.__init__(self, '%d board(s) could not be fetched: %s' % (len(failed), '; '.join(
+			'%s: %s' % (id, error) for id, error in failed.items())))
+		self.failed = failed
+
+class CardRecord():
+	__slots__ = ('client', 'id', 'name', 'closed', 'badges', 'idMembers', 'dateLastActivity', 'labels',
+				 '_description', '_attachments', '_checklists', '_comments')
+
+	def __init__(self, client, card):
+		self.client = client
+		self.id = card['id']
+		self.name = card['name']
+		self.closed = card['closed']
+		self.badges = card['badges']
+		self.idMembers = card['idMembers']
+		self.dateLastActivity = card['dateLastActivity']
+		self.labels = [{'name': label['name'], 'color': label['color'], 'id': label['id']}
+					   for label in card.get('labels', [])]
+		self._description = card.get('desc', _UNLOADED)
+		self._attachments = card.get('attachments', _UNLOADED)
+		self._checklists = _UNLOADED
+		self._comments = _UNLOADED
+
+	@property
+	def description(self):
+		if self._description is _UNLOADED:
+			self._description = self.client.fetch_json('/cards/' + self.id, query_params={'fields': 'desc'})['desc']
+		return self._description
+
+	@property
+	def attachments(self):
+		if self._attachments is _UNLOADED:
+			self._attachments = self.client.fetch_json('/cards/' + self.id + '/attachments')
+		return self._attachments
+
+	@property
+	def checklists(self):
+		if self._checklists is _UNLOADED:
+			self._setChecklists(self.client.fetch_json('/cards/' + self.id + '/checklists'))
+		return self._checklists
+
+	@property
+	def comments(self):
+		if self._comments is _UNLOADED:
+			self._setComments(self.client.fetch_json('/cards/' + self.id + '/actions',
+				query_params={'filter': COMMENT_FILTER}), complete=True)
+		return self._comments
+
+	def _setChecklists(self, checklists):
+		self._checklists = [ChecklistRecord(cl) for cl in sorted(checklists, key=lambda cl: cl['pos'])]
+
+	def _setComments(self, comments, complete=False):
+		# A board-level feed truncated for this card is left unloaded, so the full list is fetched on access
+		if complete or len(comments) >= self.badges.get('comments', 0):
+			self._comments = sorted(comments, key=lambda comment: comment['date'])
+
+	def commentsLoaded(self):
+		return self._comments is not _UNLOADED
+
+	def fillComments(self, comments):
+		# For callers that fetched the card's full comment list themselves
+		self._setComments(comments, complete=True)
+
+	def toJson(self, depth=None, exclude=()):
+		card_obj = {
+			'name': self.name,
+			'id': self.id,
+			# Excluded fields are never touched, so they are not fetched either
+			'description': self.description if 'description' not in exclude else None,
+			'attachments': self.attachments if 'attachments' not in exclude else None,
+			'badges': self.badges,
+			'closed': self.closed,
+			# The first 8 hex digits of a Trello id are its creation timestamp
+			'creation_date': datetime.datetime.fromtimestamp(int(self.id[:8], 16)).strftime('%c'),
+			'last_activity': dateparser.parse(self.dateLastActivity).strftime('%c'),
+			'idmembers': self.idMembers,
+			'labels': [],
+			'checklists': [],
+			'comments': []
+		}
+		if _deeper(depth, 3):
+			card_obj['labels'] = list(self.labels)
+			if 'checklists' not in exclude:
+				card_obj['checklists'] = [cl.toJson(depth) for cl in self.checklists]
+			if 'comments' not in exclude:
+				card_obj['comments'] = self.comments
+		for key in exclude:
+			card_obj.pop(key, None)
+		card_obj['hash'] = contentHash(card_obj, depth)
+		return card_obj
+
+class ListRecord():
+	__slots__ = ('client', 'id', 'name', 'closed', '_cards')
+
+	def __init__(self, client, list, cards=None):
+		self.client = client
+		self.id = list['id']
+		self.name = list['name']
+		self.closed = list['closed']
+		self._cards = cards
+
+	@property
+	def cards(self):
+		if self._cards is None:
+			cards, attempts = retried(lambda: self.client.fetch_json('/lists/' + self.id + '/cards',
+																	 query_params={'fields': CARD_FIELDS}))
+			self._cards = [CardRecord(self.client, c) for c in sorted(cards, key=lambda c: c['pos'])]
+		return self._cards
+
+	def toJson(self, depth=None, exclude=()):
+		list_obj = {
+			'name': self.name,
+			'closed': self.closed,
+			'id': self.id,
+			'cards': [c.toJson(depth, exclude) for c in self.cards] if _deeper(depth, 2) else []
+		}
+		# Children are folded in by their hashes, so a list's hash changes exactly when something under it does
+		list_obj['hash'] = contentHash(dict(list_obj, cards=[c['hash'] for c in list_obj['cards']]), depth)
+		return list_obj
+
+class BoardRecord():
+	__slots__ = ('client', 'id', 'name', 'closed', 'labels', 'seconds', 'attempts', '_lists', '_loaded')
+
+	def __init__(self, client, board):
+		self.client = client
+		self.id = board['id']
+		self.name = board['name']
+		self.closed = board['closed']
+		self.labels = []
+		# How long the last load() took, retries included, and in how many attempts
+		self.seconds = None
+		self.attempts = 0
+		self._lists = None
+		self._loaded = 0
+
+	def load(self, depth=None, exclude=()):
+		"""
+		Fetches everything under this board down to depth in one nested request, unless that is already loaded.
+		:param exclude: Card fields to leave out of the request, see EXCLUDABLE
+		"""
+		if self.loaded(depth):
+			return self
+		started = time.perf_counter()
+		with section('snapshot.board'):
+			tree, self.attempts = retried(lambda: fetchBoardTree(self.client, self.id, depth, exclude))
+		self.seconds = time.perf_counter() - started
+		return self.assemble(tree, depth)
+
+	def unload(self):
+		# Lets go of everything under the board; it is fetched again if asked for
+		self._lists = None
+		self._loaded = 0
+
+	def loaded(self, depth=None):
+		return (99 if depth is None else depth) <= self._loaded
+
+	def assemble(self, tree, depth=None):
+		"""
+		Builds the records under this board from a /boards/<id> response for boardQuery(depth).
+		"""
+		cards_by_list = {}
+		for card in sorted(tree.get('cards', []), key=lambda c: c['pos']):
+			cards_by_list.setdefault(card['idList'], []).append(CardRecord(self.client, card))
+		if _deeper(depth, 3):
+			cards = dict((c.id, c) for cs in cards_by_list.values() for c in cs)
+			checklists = dict((id, []) for id in cards)
+			comments = dict((id, []) for id in cards)
+			for checklist in tree.get('checklists', []):
+				if checklist['idCard'] in checklists:
+					checklists[checklist['idCard']].append(checklist)
+			for action in tree.get('actions', []):
+				card = action.get('data', {}).get('card')
+				if card is not None and card['id'] in comments:
+					comments[card['id']].append(action)
+			# Whatever the request left out stays unloaded
+			for id, card in cards.items():
+				if 'checklists' in tree:
+					card._setChecklists(checklists[id])
+				if 'actions' in tree:
+					card._setComments(comments[id])
+
+		self.labels = [{'name': label['name'], 'color': label['color'], 'id': label['id']}
+					   for label in tree.get('labels', [])]
+		self._lists = [ListRecord(self.client, l, cards_by_list.get(l['id'], []) if _deeper(depth, 2) else None)
+					   for l in tree.get('lists', [])]
+		self._loaded = 99 if depth is None else depth
+		return self
+
+	@property
+	def lists(self):
+		if self._lists is None:
+			self.load(1)
+		return self._lists
+
+	def toJson(self, depth=None, exclude=()):
+		board_obj = {
+			'name': self.name,
+			'id': self.id,
+			'lists': [l.toJson(depth, exclude) for l in self.load(depth, exclude).lists] if _deeper(depth, 1) else [],
+			'labels': list(self.labels) if _deeper(depth, 1) else [],
+			'closed': self.closed
+		}
+		board_obj['hash'] = contentHash(dict(board_obj, lists=[l['hash'] for l in board_obj['lists']]), depth)
+		return board_obj
+
+# A lazy view of the whole workspace. Nothing is fetched until it is asked for, and anything fetched is kept.
+# load() prefetches every board to a depth on a thread pool, one nested request per board. stream() does the
+# same for a window of boards at a time, for callers that write each board out and need not keep it.
+class Snapshot():
+	__slots__ = ('client', 'timings', 'started', '_boards')
+
+	def __init__(self, client):
+		self.client = client
+		# {board id: {'name', 'seconds', 'attempts'}} for every board streamed so far
+		self.timings = {}
+		# When stream() was called, or the run whose checkpoint it resumed began; None until then
+		self.started = None
+		self._boards = None
+
+	@property
+	def boards(self):
+		if self._boards is None:
+			self._boards = [BoardRecord(self.client, b) for b in retried(lambda: listBoards(self.client))[0]]
+		return self._boards
+
+	def load(self, depth=None, workers=8):
+		boards = self.boards
+		if _deeper(depth, 1):
+			with ThreadPoolExecutor(max_workers=workers) as pool:
+				list(pool.map(carryPriority(lambda b: b.load(depth)), boards))
+		return self
+
+	def toJson(self, depth=None, exclude=()):
+		return [b.toJson(depth, exclude) for b in self.boards]
+
+	def stream(self, depth=None, workers=8, exclude=(), checkpoint=None):
+		"""
+		Yields each board's JSON in order, fetching at most 'workers' boards ahead of the one being yielded.
+		Every board is unloaded once yielded, so memory is bounded by the window rather than the workspace.
+		A board that still fails after its retries is skipped, and IncompleteSnapshotError is raised once the
+		others have all been yielded, so that nothing partial gets saved.
+		:param checkpoint: A SnapshotCheckpoint. Boards it already holds are yielded from it instead of fetched,
+		and each board fetched is added to it.
+		"""
+		# Not a generator itself, so the checkpoint is opened and 'started' set as soon as this is called
+		done = checkpoint.done() if checkpoint is not None else set()
+		self.started = checkpoint.started if checkpoint is not None else time.time()
+		return self._stream(depth, workers, exclude, checkpoint, done)
+
+	def _stream(self, depth, workers, exclude, checkpoint, done):
+		load = carryPriority(lambda b: b.load(depth, exclude))
+		failed = {}
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			window = deque()
+			for board in self.boards:
+				fetch = board.id not in done and _deeper(depth, 1)
+				window.append((board, pool.submit(load, board) if fetch else None))
+				if len(window) < workers:
+					continue
+				json_obj = self._release(*window.popleft(), depth, exclude, checkpoint, failed)
+				if json_obj is not None:
+					yield json_obj
+			while len(window) > 0:
+				json_obj = self._release(*window.popleft(), depth, exclude, checkpoint, failed)
+				if json_obj is not None:
+					yield json_obj
+		if failed:
+			raise IncompleteSnapshotError(failed)
+
+	def _release(self, board, loading, depth, exclude, checkpoint, failed):
+		if checkpoint is not None and checkpoint.has(board.id):
+			self.timings[board.id] = checkpoint.timings[board.id]
+			return checkpoint.get(board.id)
+		try:
+			if loading is not None:
+				loading.result()
+			json_obj = board.toJson(depth, exclude)
+		except Exception as e:
+			if not isTransient(e):
+				raise
+			failed[board.id] = e
+			return None
+		finally:
+			board.unload()
+		self.timings[board.id] = {'name': board.name, 'seconds': board.seconds, 'attempts': board.attempts}
+		if checkpoint is not None:
+			checkpoint.add(json_obj, self.timings[board.id])
+		return json_obj
+
+	def index(self, depth=None):
+		# Name and ID indexes over everything down to depth, loading it first if need be
+		return StateIndex(self.toJson(depth), depth)
@@ -0,0 +1,86 @@
+from diff import indexState
+
+# Raised by strict lookups when a name matches more than one entity
+class AmbiguousNameError(LookupError):
+	def __init__(self, path, ids):
+		super().__init__('%s matches %d entities' % ('/'.join(path), len(ids)))
+		self.path = path
+		self.ids = ids
+
+# Hash indexes over a snapshot shaped like getJsonState's, built in one pass:
+#   board name -> board IDs, (board ID, list name) -> list IDs, (list ID, card name) -> card IDs
+#   and (board ID, label name) -> labels, plus every record by ID.
+# Trello allows repeated names, so every name maps to all of its IDs in snapshot order. Plain lookups take the
+# first, as the resolver does, while strict ones raise AmbiguousNameError instead of guessing.
+class StateIndex():
+	def __init__(self, state, depth=None):
+		self.depth = depth
+		self.records = indexState(state, depth)
+		self.boards = {}
+		self.lists = {}
+		self.cards = {}
+		self.labels = {}
+		for board in state:
+			self.boards.setdefault(board['name'], []).append(board['id'])
+			for label in board.get('labels', []):
+				self.labels.setdefault((board['id'], label['name']), []).append(label)
+			for list in board.get('lists', []):
+				self.lists.setdefault((board['id'], list['name']), []).append(list['id'])
+				for card in list.get('cards', []):
+					if 'id' in card:
+						self.cards.setdefault((list['id'], card['name']), []).append(card['id'])
+
+	def boardIds(self, name):
+		return self.boards.get(name, [])
+
+	def listIds(self, board_id, name):
+		return self.lists.get((board_id, name), [])
+
+	def cardIds(self, list_id, name):
+		return self.cards.get((list_id, name), [])
+
+	def labelsNamed(self, board_id, name):
+		return self.labels.get((board_id, name), [])
+
+	def get(self, id):
+		# The record with this ID at any level, or None
+		for level in self.records.values():
+			if id in level:
+				return level[id][0]
+		return None
+
+	def resolve(self, *names, strict=False):
+		"""
+		Resolves a (board_name[, listname[, cardname]]) path like resolver.resolveIds, without any requests.
+		:param strict: Raise AmbiguousNameError rather than take the first of several matches
+		:return: The IDs along the path, or None if any part of it is not in the snapshot.
+		"""
+		lookups = [lambda ids, name: self.boardIds(name),
+				   lambda ids, name: self.listIds(ids[0], name),
+				   lambda ids, name: self.cardIds(ids[1], name)]
+		ids = []
+		for depth, name in enumerate(names):
+			found = lookups[depth](ids, name)
+			if len(found) == 0:
+				return None
+			if strict and len(found) > 1:
+				raise AmbiguousNameError(names[:depth + 1], found)
+			ids.append(found[0])
+		return ids
+
+	def label(self, board_id, name, strict=False):
+		found = self.labelsNamed(board_id, name)
+		if len(found) == 0:
+			return None
+		if strict and len(found) > 1:
+			raise AmbiguousNameError((board_id, name), [l['id'] for l in found])
+		return found[0]
+
+def labelsByName(labels):
+	"""
+	Indexes py-trello Label objects by name, keeping the first when names repeat.
+	"""
+	index = {}
+	for label in labels:
+		index.setdefault(label.name, label)
+	return index
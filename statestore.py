@@ -0,0 +1,401 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from diff import applyDiff
+from stateindex import StateIndex
+from metrics import countCache, section
+
+try:
+	import zstandard
+except ImportError:
+	# Only needed for '.zst' files
+	zstandard = None
+
+# Card fields that only getJsonState depth 3 and up fills in
+CARD_DETAILS = ('labels', 'checklists', 'comments')
+
+# Long-running hosts turn this on to keep parsed reads until the file changes on disk.
+# Cached snapshots are shared between callers, so they must not be modified.
+CACHE_READS = False
+_read_cache = {}
+_read_cache_lock = threading.Lock()
+
+# Files ending in one of these are compressed, e.g. 'state.jsonl.gz'. The rest of the name picks the format.
+COMPRESSION = ('.gz', '.zst')
+
+def uncompressedPath(filepath):
+	base, extension = os.path.splitext(filepath)
+	return base if extension in COMPRESSION else filepath
+
+def _compressor(filepath, raw):
+	extension = os.path.splitext(filepath)[1]
+	if extension == '.gz':
+		return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6)
+	if extension == '.zst':
+		if zstandard is None:
+			raise ImportError('.zst files need zstandard (pip install zstandard)')
+		return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+	return None
+
+def openText(filepath):
+	# Opens a state file for reading, decompressing it if its name says so
+	extension = os.path.splitext(filepath)[1]
+	if extension == '.gz':
+		return gzip.open(filepath, 'rt', encoding='utf-8')
+	if extension == '.zst':
+		if zstandard is None:
+			raise ImportError('.zst files need zstandard (pip install zstandard)')
+		return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), closefd=True),
+								encoding='utf-8')
+	return open(filepath, 'r')
+
+# Reading the umask means setting it, which other threads would see, so it is read once up front
+_umask = os.umask(0)
+os.umask(_umask)
+
+def _fileMode(filepath):
+	try:
+		return os.stat(filepath).st_mode & 0o777
+	except OSError:
+		return 0o666 & ~_umask
+
+@contextmanager
+def atomicWriter(filepath):
+	# Writes go to a temporary file in the same directory, which replaces filepath only once it is complete.
+	# Compressed file names get compressed contents.
+	directory = os.path.dirname(os.path.abspath(filepath))
+	fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filepath), suffix='.tmp')
+	try:
+		# mkstemp makes the file owner-only; keep the mode of the file being replaced, or what open() would give
+		os.chmod(tmp_path, _fileMode(filepath))
+		with os.fdopen(fd, 'wb') as raw:
+			compressor = _compressor(filepath, raw)
+			f = io.TextIOWrapper(compressor if compressor is not None else raw, encoding='utf-8')
+			yield f
+			f.flush()
+			# Leaves raw open for the fsync
+			f.detach()
+			if compressor is not None:
+				compressor.close()
+			raw.flush()
+			os.fsync(raw.fileno())
+		os.replace(tmp_path, filepath)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+def _trim(state, depth, board_ids):
+	if board_ids is not None:
+		state = [b for b in state if b['id'] in board_ids]
+	if depth is None:
+		return state
+	for board in state:
+		for list in board['lists'] if depth >= 1 else []:
+			for card in list['cards'] if depth >= 2 else []:
+				if depth < 3:
+					for key in CARD_DETAILS:
+						card[key] = []
+				else:
+					for checklist in card['checklists'] if depth < 4 else []:
+						checklist['items'] = []
+			if depth < 2:
+				list['cards'] = []
+		if depth < 1:
+			board['lists'] = []
+			board['labels'] = []
+	return state
+
+def stampPath(filepath):
+	# Sits next to the state file, e.g. state.jsonl -> state.recorded.json
+	return os.path.splitext(uncompressedPath(filepath))[0] + '.recorded.json'
+
+# Stores a snapshot the way getJsonState returns it. Subclasses implement write() and load().
+# write() and save() take any iterable of boards, such as snapshot.Snapshot.stream(), and write each as it comes.
+# read() takes the same 'depth' as getJsonState, plus an optional set of board IDs to restrict it to,
+# and index() returns a stateindex.StateIndex over the same. save() is write() for a complete snapshot.
+# patch() applies changes from diff.diffState to the stored snapshot.
+class StateStore():
+	def __init__(self, filepath):
+		self.filepath = filepath
+
+	def write(self, state):
+		raise NotImplementedError()
+
+	def save(self, state, timings=None, recorded=None):
+		# Writes a complete snapshot and notes when it was taken (recorded, or now by default). patch() leaves that
+		# time alone. timings, such as snapshot.Snapshot.timings, are noted alongside it once state has been written.
+		with section('state.write'):
+			self.write(state)
+		stamp = {'recorded': time.time() if recorded is None else recorded}
+		if timings is not None:
+			stamp['boards'] = timings
+		with atomicWriter(stampPath(self.filepath)) as f:
+			f.write(json.dumps(stamp))
+
+	def timings(self):
+		# Per board fetch times of the last complete snapshot, as save() was given them, or None
+		try:
+			with open(stampPath(self.filepath), 'r') as f:
+				return json.loads(f.read()).get('boards')
+		except (IOError, ValueError):
+			return None
+
+	def recordedAt(self):
+		# When the last complete snapshot was saved, or None if we cannot tell
+		try:
+			with open(stampPath(self.filepath), 'r') as f:
+				return json.loads(f.read())['recorded']
+		except (IOError, ValueError, KeyError):
+			return None
+
+	def age(self):
+		recorded = self.recordedAt()
+		return None if recorded is None else time.time() - recorded
+
+	def load(self, depth=None, board_ids=None):
+		raise NotImplementedError()
+
+	def _cached(self, kind, depth, board_ids, build):
+		if not CACHE_READS:
+			return build()
+		stat = os.stat(self.filepath)
+		# Writes replace the file, so a new inode, mtime or size means new contents
+		version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+		key = (kind, os.path.abspath(self.filepath), depth, frozenset(board_ids) if board_ids is not None else None)
+		with _read_cache_lock:
+			cached = _read_cache.get(key)
+		countCache(kind, cached is not None and cached[0] == version)
+		if cached is not None and cached[0] == version:
+			return cached[1]
+		value = build()
+		with _read_cache_lock:
+			_read_cache[key] = (version, value)
+		return value
+
+	def read(self, depth=None, board_ids=None):
+		def load():
+			with section('state.read'):
+				return self.load(depth, board_ids)
+		return self._cached('state', depth, board_ids, load)
+
+	def index(self, depth=None, board_ids=None):
+		return self._cached('index', depth, board_ids, lambda: StateIndex(self.read(depth, board_ids), depth))
+
+	def patch(self, changes):
+		self.write(applyDiff(self.load(), changes))
+
+# The original format: the whole snapshot as one line of JSON.
+class JsonStateStore(StateStore):
+	def write(self, state):
+		with atomicWriter(self.filepath) as f:
+			# One board at a time, so a streamed snapshot never has to be held whole
+			f.write('[')
+			for i, board in enumerate(state):
+				f.write((', ' if i > 0 else '') + json.dumps(board))
+			f.write(']')
+
+	def load(self, depth=None, board_ids=None):
+		with openText(self.filepath) as f:
+			return _trim(json.loads(f.readline()), depth, board_ids)
+
+# One line per entity, each prefixed with '<depth>\t<board id>\t<parent id>\t<id>\t' ahead of its JSON.
+# Depth 0 to 2 are boards, lists and cards without their children; depth 3 holds a card's labels, checklists
+# and comments, and depth 4 the items of one checklist. Lines deeper than a read needs, or on other boards,
+# are skipped without parsing their JSON.
+class LineStateStore(StateStore):
+	def _records(self, state):
+		for board in state:
+			yield 0, board['id'], '', board['id'], dict((k, v) for k, v in board.items() if k != 'lists')
+			for list in board.get('lists', []):
+				yield 1, board['id'], board['id'], list['id'], dict((k, v) for k, v in list.items() if k != 'cards')
+				for card in list.get('cards', []):
+					for record in self._cardRecords(board['id'], list['id'], card):
+						yield record
+
+	def _cardRecords(self, board_id, list_id, card):
+		yield 2, board_id, list_id, card['id'], dict((k, v) for k, v in card.items() if k not in CARD_DETAILS)
+		details = dict((k, card.get(k, [])) for k in CARD_DETAILS)
+		details['checklists'] = [dict((k, v) for k, v in c.items() if k != 'items') for c in details['checklists']]
+		yield 3, board_id, card['id'], card['id'], details
+		for checklist in card.get('checklists', []):
+			yield 4, board_id, card['id'], checklist['id'], {'items': checklist.get('items', [])}
+
+	def _line(self, record):
+		depth, board_id, parent_id, id, obj = record
+		return '%d\t%s\t%s\t%s\t%s\n' % (depth, board_id, parent_id, id, json.dumps(obj, separators=(',', ':')))
+
+	def _legacy(self):
+		with openText(self.filepath) as f:
+			return f.read(1) == '['
+
+	def write(self, state):
+		with atomicWriter(self.filepath) as f:
+			for record in self._records(state):
+				f.write(self._line(record))
+
+	def load(self, depth=None, board_ids=None):
+		if self._legacy():
+			return JsonStateStore(self.filepath).load(depth, board_ids)
+		boards = []
+		children = {}
+		details = {}
+		items = {}
+		with openText(self.filepath) as f:
+			for line in f:
+				level, board_id, parent_id, id, obj = line.split('\t', 4)
+				level = int(level)
+				if (depth is not None and level > depth) or (board_ids is not None and board_id not in board_ids):
+					continue
+				obj = json.loads(obj)
+				if level == 0:
+					obj['lists'] = []
+					if depth is not None and depth < 1 and 'labels' in obj:
+						obj['labels'] = []
+					boards.append(obj)
+				elif level <= 2:
+					children.setdefault(parent_id, []).append(obj)
+				elif level == 3:
+					details[id] = obj
+				else:
+					items[id] = obj['items']
+
+		# Records are attached by parent ID, so their order in the file only matters between siblings
+		for board in boards:
+			board['lists'] = children.get(board['id'], [])
+			for list in board['lists']:
+				list['cards'] = children.get(list['id'], [])
+				for card in list['cards']:
+					card.update(dict((k, []) for k in CARD_DETAILS))
+					card.update(details.get(card['id'], {}))
+					for checklist in card['checklists']:
+						checklist['items'] = items.get(checklist['id'], [])
+		return boards
+
+	def patch(self, changes):
+		"""
+		Streams the stored lines into a new file, touching only the entities named in changes.
+		"""
+		if self._legacy() or len(changes.get('lists', {}).get('moved', [])) > 0:
+			# Lists moving between boards would drag every card line with them, so rewrite the lot
+			return StateStore.patch(self, changes)
+		removed = set()
+		updated = {}
+		moved = {}
+		added = []
+		# Changed cards are written out afresh, details and all; boards and lists just take the new fields
+		changed_cards = {}
+		# Parents whose children change order, by their parent column ('' for boards), with the new order
+		reordered = {}
+		for level, level_changes in changes.items():
+			removed.update(record['id'] for record, parent in level_changes['removed'])
+			for parent, ids in level_changes.get('reordered', []):
+				reordered[parent if parent is not None else ''] = ids
+			for old_rec, new_rec in level_changes['renamed']:
+				updated.setdefault(new_rec['id'], {})['name'] = new_rec['name']
+			for record in level_changes['closed'] + level_changes['reopened']:
+				updated.setdefault(record['id'], {})['closed'] = record['closed']
+			for record, old_parent, new_parent in level_changes['moved']:
+				moved[record['id']] = new_parent
+			for record in level_changes.get('changed', []) + level_changes.get('rehashed', []):
+				if level == 'cards':
+					changed_cards[record['id']] = record
+				else:
+					updated.setdefault(record['id'], {}).update((k, v) for k, v in record.items() if k != 'lists'
+																and k != 'cards')
+			for id in level_changes.get('unhashed', []):
+				updated.setdefault(id, {})['hash'] = None
+			added.extend((level, record, parent) for record, parent in level_changes['added'])
+
+		# Cards moved to a list on another board need that board in their prefix
+		list_boards = {}
+		with openText(self.filepath) as f:
+			for line in f:
+				if line.startswith('1\t'):
+					level, board_id, parent_id, id, obj = line.split('\t', 4)
+					list_boards[id] = board_id
+		for level, record, parent in added:
+			if level == 'lists':
+				list_boards[record['id']] = parent
+
+		dropped = set()
+		rewritten = set()
+		moved_lines = []
+		# Board, list and card lines under a reordered parent, held back to be written in the new order at the end
+		held = {}
+
+		def hold(line):
+			level, board_id, parent_id, id, obj = line.split('\t', 4)
+			if level in ('0', '1', '2') and parent_id in reordered:
+				held[id] = line
+			else:
+				out.write(line)
+
+		with openText(self.filepath) as f, atomicWriter(self.filepath) as out:
+			write = hold if reordered else out.write
+			for line in f:
+				level, board_id, parent_id, id, obj = line.split('\t', 4)
+				card_moved = level == '2' and id in moved
+				if id in removed or (parent_id in dropped and not card_moved):
+					dropped.add(id)
+					continue
+				if level in ('3', '4') and parent_id in rewritten:
+					continue
+				if level == '2' and id in changed_cards:
+					rewritten.add(id)
+					parent_id = moved.get(id, parent_id)
+					lines = [self._line(record) for record in
+							 self._cardRecords(list_boards.get(parent_id, board_id), parent_id, changed_cards[id])]
+					if card_moved:
+						moved_lines.extend(lines)
+					else:
+						for line in lines:
+							write(line)
+					continue
+				if id in updated:
+					obj = json.loads(obj)
+					obj.update(updated[id])
+					line = self._line((int(level), board_id, parent_id, id, obj))
+				if card_moved:
+					# Moved cards go after their new siblings, as applyDiff would put them
+					parent_id = moved[id]
+					moved_lines.append('\t'.join([level, list_boards.get(parent_id, board_id), parent_id, id,
+						line.split('\t', 4)[4]]))
+					continue
+				if level in ('3', '4') and parent_id in moved:
+					# A card's details follow it to its new board
+					line = '\t'.join([level, list_boards.get(moved[parent_id], board_id), parent_id, id,
+						line.split('\t', 4)[4]])
+				write(line)
+			for line in moved_lines:
+				write(line)
+			for level, record, parent in added:
+				if level == 'boards':
+					record = dict((k, v) for k, v in record.items() if k != 'lists')
+					write(self._line((0, record['id'], '', record['id'], record)))
+				elif level == 'lists':
+					record = dict((k, v) for k, v in record.items() if k != 'cards')
+					write(self._line((1, parent, parent, record['id'], record)))
+				else:
+					for line in self._cardRecords(list_boards.get(parent, ''), parent, record):
+						write(self._line(line))
+			# Siblings are attached in file order, wherever in the file they are
+			for parent, ids in reordered.items():
+				for id in ids:
+					if id in held:
+						out.write(held.pop(id))
+			out.writelines(held.values())
+
+# Picks a store by file extension. Anything not registered gets the line store.
+STORES = {'.json': JsonStateStore, '.jsonl': LineStateStore}
+
+def registerStateStore(extension, store_class):
+	STORES[extension] = store_class
+
+def getStateStore(filepath):
+	return STORES.get(os.path.splitext(uncompressedPath(filepath))[1], LineStateStore)(filepath)
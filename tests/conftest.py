@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update({'TRELLO_API_KEY': 'test', 'TRELLO_API_SECRET': 'test', 'TRELLO_TOKEN': ''})
+
+import base
+from faketrello import FakeTrelloServer, FakeWorkspace
+
+@pytest.fixture
+def trello(tmp_path, monkeypatch):
+	# A client for a small, fresh fake workspace, with state files going to a scratch directory
+	monkeypatch.chdir(tmp_path)
+	server = FakeTrelloServer(FakeWorkspace(3, 3, 4, 1, 2, 1)).start()
+	# Every workspace hands out the same IDs, so paths cached by an earlier test would look valid
+	base.pathCache.clear()
+	base.configureClient(api_root=server.url, host_rate=1e6)
+	try:
+		yield base.getClient()
+	finally:
+		base.resetClient()
+		server.stop()
@@ -0,0 +1,25 @@
+import json
+import plugin
+from faketrello import makeId
+
+ON_BOARD = makeId('card', 0, 0, 1)
+OTHER_BOARD = makeId('card', 1, 1, 2)
+MISSING = makeId('card', 9, 0, 0)
+
+def results(capsys, action, *args, **kwargs):
+	capsys.readouterr()
+	action(*args, **kwargs)
+	return json.loads(capsys.readouterr().out)['results']
+
+def test_card_ids_without_board(trello, capsys):
+	found = results(capsys, plugin.add_label_on_cards_action, None, [], [], 'Label 1',
+					card_ids=[ON_BOARD, OTHER_BOARD, MISSING])
+	assert found == {ON_BOARD: 'ok', OTHER_BOARD: 'ok', MISSING: 'notfound'}
+	# Each card gets the label of its own board
+	assert makeId('label', 1, sub=1) in trello.fetch_json('/cards/' + OTHER_BOARD)['idLabels']
+
+def test_card_ids_off_the_board(trello, capsys):
+	comments = trello.fetch_json('/cards/' + OTHER_BOARD)['badges']['comments']
+	assert results(capsys, plugin.make_comment_on_cards_action, 'Board 0', 'List 0', ['Card 0'], 'A comment',
+				   card_ids=[ON_BOARD, OTHER_BOARD]) == {'List 0/Card 0': 'ok', ON_BOARD: 'ok', OTHER_BOARD: 'notfound'}
+	assert trello.fetch_json('/cards/' + OTHER_BOARD)['badges']['comments'] == comments
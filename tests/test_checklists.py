@@ -0,0 +1,18 @@
+import json
+import pytest
+import plugin
+
+CARD = ('Board 0', 'List 0', 'Card 0')
+
+def run(capsys, action, *args):
+	capsys.readouterr()
+	action(*args)
+	return json.loads(capsys.readouterr().out)
+
+@pytest.mark.parametrize('action, args', [
+	(plugin.check_item_card_checklist_action, (True, )),
+	(plugin.remove_item_card_checklist_action, ()),
+])
+def test_missing_item(trello, capsys, action, args):
+	assert run(capsys, action, *CARD + ('Checklist 0', 'No such item') + args) == {}
+	assert run(capsys, action, *CARD + ('Checklist 0', 'Item 0') + args)['checklist_id'] is not None
@@ -0,0 +1,26 @@
+import json
+import time
+from base import recordStateToFile, getJsonState, loadJsonFromFile
+from checkpoint import SnapshotCheckpoint, checkpointPath
+from statestore import getStateStore
+
+def test_resumed_snapshot_stamped_when_started(trello):
+	# A run ten minutes ago checkpointed the first board before it failed
+	path = checkpointPath('state.jsonl')
+	checkpoint = SnapshotCheckpoint(path)
+	checkpoint.add(getJsonState()[0], {'name': 'Board 0', 'seconds': 0.1, 'attempts': 1})
+	checkpoint.close()
+	with open(path, 'rb') as f:
+		header, rest = f.read().split(b'\n', 1)
+	started = time.time() - 600
+	with open(path, 'wb') as f:
+		f.write(json.dumps(dict(json.loads(header.decode('utf-8')), started=started)).encode('utf-8') + b'\n' + rest)
+
+	recordStateToFile('state.jsonl')
+	assert loadJsonFromFile('state.jsonl') == getJsonState()
+	assert getStateStore('state.jsonl').recordedAt() == started
+
+def test_fresh_snapshot_stamped_when_started(trello):
+	before = time.time()
+	recordStateToFile('state.jsonl')
+	assert before <= getStateStore('state.jsonl').recordedAt() <= time.time()
@@ -0,0 +1,35 @@
+import json
+import feed
+import plugin
+from faketrello import makeId
+
+def created(actions):
+	return [a['data']['card']['name'] for a in actions]
+
+def test_poll_pages_back_to_cursor(trello, monkeypatch):
+	monkeypatch.setattr(feed, 'FEED_PAGE', 4)
+	assert feed.readFeed(trello, 'state.json', 'consumer', feed.isCardCreated) == []
+	names = ['Card %d' % i for i in range(11)]
+	for i, name in enumerate(names):
+		trello.fetch_json('/cards', http_method='POST', post_args={'idList': makeId('list', i % 3, 0), 'name': name})
+	feed.pollFeed(trello, 'state.json', max_age=0)
+	assert created(feed.readFeed(trello, 'state.json', 'consumer', feed.isCardCreated)) == names
+	trello.fetch_json('/cards', http_method='POST', post_args={'idList': makeId('list', 1, 0), 'name': 'Late'})
+	feed.pollFeed(trello, 'state.json', max_age=0)
+	assert created(feed.readFeed(trello, 'state.json', 'consumer', feed.isCardCreated)) == ['Late']
+
+def fired(capsys, trigger):
+	capsys.readouterr()
+	trigger()
+	return json.loads(capsys.readouterr().out)
+
+def test_created_and_moved_cards(trello, capsys, monkeypatch):
+	monkeypatch.setattr(feed, 'POLL_INTERVAL', 0)
+	assert fired(capsys, plugin.card_created_trigger) == {'fire': 'false'}
+	assert fired(capsys, plugin.card_moved_trigger) == {'fire': 'false'}
+	card = trello.fetch_json('/cards', http_method='POST', post_args={'idList': makeId('list', 0, 0), 'name': 'New'})
+	trello.fetch_json('/cards/' + card['id'], http_method='PUT', query_params={'idList': makeId('list', 0, 1)})
+	trello.fetch_json('/cards/' + card['id'], http_method='PUT', query_params={'name': 'Renamed'})
+	assert fired(capsys, plugin.card_created_trigger) == {'fire': 'true', 'card': 'New', 'list': 'List 0'}
+	assert fired(capsys, plugin.card_moved_trigger) == {
+		'fire': 'true', 'card': 'New', 'from_list': 'List 0', 'to_list': 'List 1'}
@@ -0,0 +1,20 @@
+import base
+from scheduler import TriggerScheduler
+
+def test_nested_shared_snapshots(trello):
+	with base.sharedSnapshots():
+		outer = base.getJsonState(0)
+		with base.sharedSnapshots():
+			assert base.getJsonState(0) is outer
+		assert base.getJsonState(0) is outer
+	assert base.getJsonState(0) is not outer
+
+def test_stats(trello):
+	def broken():
+		raise ValueError('broken')
+
+	scheduler = TriggerScheduler(runner=lambda fn, args: fn())
+	scheduler.register(lambda: {'fire': 'false'})
+	scheduler.register(broken)
+	assert scheduler.tick() == 2
+	assert scheduler.getStats() == {'ticks': 1, 'checks': 2, 'errors': 1}
@@ -0,0 +1,39 @@
+import json
+import pytest
+import plugin
+from faketrello import makeId
+
+BOARD, LIST, CARD = 'Board 0', 'List 0', 'Card 0'
+CARD_ID = makeId('card', 0, 0, 0)
+
+def run(capsys, action, *args):
+	capsys.readouterr()
+	action(*args)
+	return json.loads(capsys.readouterr().out)
+
+@pytest.fixture
+def deleted(trello, capsys):
+	# The card's path is cached by a first action, then the card goes away behind the cache's back
+	assert run(capsys, plugin.does_card_exist_action, BOARD, LIST, CARD) == {'exists': True}
+	trello.fetch_json('/cards/' + CARD_ID, http_method='DELETE')
+	return trello
+
+@pytest.mark.parametrize('action, args', [
+	(plugin.make_comment_on_card_action, ('A comment', )),
+	(plugin.add_label_on_card_action, ('green', )),
+	(plugin.get_label_on_card_action, ()),
+	(plugin.check_item_card_checklist_action, ('Checklist 0', 'Item 0', True)),
+	(plugin.remove_item_card_checklist_action, ('Checklist 0', 'Item 0')),
+	(plugin.add_checklist_to_card_action, ('A checklist', )),
+])
+def test_deleted_card_not_found(deleted, capsys, action, args):
+	assert run(capsys, action, BOARD, LIST, CARD, *args) == {}
+
+def test_deleted_card_does_not_exist(deleted, capsys):
+	assert run(capsys, plugin.does_card_exist_action, BOARD, LIST, CARD) == {'exists': False}
+	assert run(capsys, plugin.get_link_for_card_action, BOARD, LIST, CARD) == {'link': 'notfound'}
+
+def test_replaced_card_found_again(deleted, capsys):
+	created = deleted.fetch_json('/cards', http_method='POST', post_args={'idList': makeId('list', 0, 0), 'name': CARD})
+	ids = run(capsys, plugin.make_comment_on_card_action, BOARD, LIST, CARD, 'A comment')
+	assert ids['card_id'] == created['id']
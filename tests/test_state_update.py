@@ -0,0 +1,148 @@
+import threading
+import pytest
+from base import getJsonState, writeJsonToFile, updateStateFile, loadJsonFromFile, recordStateToFile
+from diff import hasChanges
+from faketrello import makeId
+
+# Both store formats must end up holding exactly what a fresh snapshot holds
+STATE_FILES = ['state.json', 'state.jsonl']
+
+BOARD = makeId('board', 0)
+OTHER_BOARD = makeId('board', 1)
+LIST = makeId('list', 0, 0)
+OTHER_LIST = makeId('list', 0, 1)
+CARD = makeId('card', 0, 0, 0)
+
+def put(client, path, **fields):
+	return client.fetch_json(path, http_method='PUT', query_params=fields)
+
+def post(client, path, **fields):
+	return client.fetch_json(path, http_method='POST', post_args=fields)
+
+def delete(client, path):
+	return client.fetch_json(path, http_method='DELETE')
+
+def update(filepath, depth=None):
+	changes = updateStateFile(filepath, getJsonState(depth), depth)
+	if depth is None:
+		assert loadJsonFromFile(filepath) == getJsonState()
+	return changes
+
+@pytest.fixture(params=STATE_FILES)
+def state_file(request, trello):
+	writeJsonToFile(request.param, getJsonState())
+	return request.param
+
+def test_unchanged(trello, state_file):
+	assert not hasChanges(update(state_file))
+
+def test_card_added(trello, state_file):
+	card = post(trello, '/cards', idList=LIST, name='New card')
+	changes = update(state_file)
+	assert [(c['id'], parent) for c, parent in changes['cards']['added']] == [(card['id'], LIST)]
+
+def test_card_removed_and_archived(trello, state_file):
+	delete(trello, '/cards/' + CARD)
+	put(trello, '/cards/' + makeId('card', 0, 0, 1), closed='true')
+	changes = update(state_file)
+	assert len(changes['cards']['removed']) == 2
+
+def test_card_renamed_and_back(trello, state_file):
+	put(trello, '/cards/' + CARD, name='Renamed')
+	changes = update(state_file)
+	assert [new['name'] for old, new in changes['cards']['renamed']] == ['Renamed']
+	put(trello, '/cards/' + CARD, name='Card 0')
+	changes = update(state_file)
+	assert [new['name'] for old, new in changes['cards']['renamed']] == ['Card 0']
+
+def test_card_moved_between_lists(trello, state_file):
+	put(trello, '/cards/' + CARD, idList=OTHER_LIST)
+	changes = update(state_file)
+	assert [(c['id'], old, new) for c, old, new in changes['cards']['moved']] == [(CARD, LIST, OTHER_LIST)]
+
+def test_card_reordered(trello, state_file):
+	put(trello, '/cards/' + CARD, pos=10)
+	changes = update(state_file)
+	assert changes['cards']['reordered'] == [(LIST, [makeId('card', 0, 0, c) for c in (1, 2, 3, 0)])]
+
+def test_card_moved_between_boards(trello, state_file):
+	target = makeId('list', 1, 2)
+	put(trello, '/cards/' + CARD, idList=target)
+	changes = update(state_file)
+	assert [(c['id'], old, new) for c, old, new in changes['cards']['moved']] == [(CARD, LIST, target)]
+
+def test_card_edited(trello, state_file):
+	post(trello, '/cards/' + CARD + '/actions/comments', text='A comment')
+	post(trello, '/cards/' + makeId('card', 0, 1, 0) + '/idLabels', value=makeId('label', 0, sub=3))
+	checklist = makeId('checklist', 0, 2, 0, 0)
+	put(trello, '/cards/' + makeId('card', 0, 2, 0) + '/checklist/' + checklist + '/checkItem/' +
+		makeId('item', 0, 2, 0, 0), state='complete')
+	put(trello, '/cards/' + makeId('card', 1, 0, 3), desc='New description')
+	changes = update(state_file)
+	assert set(c['id'] for c in changes['cards']['changed']) == set([
+		CARD, makeId('card', 0, 1, 0), makeId('card', 0, 2, 0), makeId('card', 1, 0, 3)])
+	assert not hasChanges(update(state_file))
+
+def test_lists_changed(trello, state_file):
+	created = post(trello, '/lists', idBoard=BOARD, name='New list')
+	post(trello, '/cards', idList=created['id'], name='Card on a new list')
+	put(trello, '/lists/' + LIST, name='Renamed list')
+	put(trello, '/lists/' + OTHER_LIST, closed='true')
+	put(trello, '/lists/' + makeId('list', 0, 2), idBoard=OTHER_BOARD)
+	changes = update(state_file)
+	assert [l['id'] for l, parent in changes['lists']['added']] == [created['id']]
+	assert [new['name'] for old, new in changes['lists']['renamed']] == ['Renamed list']
+	assert [l['id'] for l in changes['lists']['closed']] == [OTHER_LIST]
+	assert [(l['id'], old, new) for l, old, new in changes['lists']['moved']] == [
+		(makeId('list', 0, 2), BOARD, OTHER_BOARD)]
+
+def test_boards_changed(trello, state_file):
+	created = post(trello, '/boards', name='New board')
+	put(trello, '/boards/' + BOARD, name='Renamed board')
+	delete(trello, '/boards/' + makeId('board', 2))
+	changes = update(state_file)
+	assert [b['id'] for b, parent in changes['boards']['added']] == [created['id']]
+	assert [new['name'] for old, new in changes['boards']['renamed']] == ['Renamed board']
+	assert [b['id'] for b, parent in changes['boards']['removed']] == [makeId('board', 2)]
+
+def test_shallow_updates_in_between(trello, state_file):
+	# Board triggers patch the same file at depth 0, which must not leave stale hashes behind for full diffs
+	put(trello, '/boards/' + BOARD, name='Renamed board')
+	put(trello, '/cards/' + CARD, name='Renamed card')
+	update(state_file, depth=0)
+	put(trello, '/boards/' + BOARD, name='Board 0')
+	update(state_file, depth=0)
+	changes = update(state_file)
+	assert [new['name'] for old, new in changes['cards']['renamed']] == ['Renamed card']
+	put(trello, '/cards/' + CARD, name='Card 0')
+	update(state_file, depth=1)
+	update(state_file)
+
+def test_new_boards_left_out(trello, state_file):
+	created = post(trello, '/boards', name='New board')
+	post(trello, '/cards/' + CARD + '/actions/comments', text='A comment')
+	changes = updateStateFile(state_file, getJsonState(), None, add_boards=False)
+	assert changes['boards']['added'] == []
+	assert [c['id'] for c in changes['cards']['changed']] == [CARD]
+	assert loadJsonFromFile(state_file) == [b for b in getJsonState() if b['id'] != created['id']]
+	assert [b['id'] for b, parent in update(state_file, depth=0)['boards']['added']] == [created['id']]
+
+def test_concurrent_writers(trello, state_file):
+	# The host runs triggers on several threads, all recording and patching the same file
+	put(trello, '/cards/' + CARD, name='Renamed card')
+	errors = []
+
+	def write(work):
+		try:
+			work()
+		except Exception as e:
+			errors.append(e)
+
+	threads = [threading.Thread(target=write, args=(work, )) for work in
+			   [lambda: recordStateToFile(state_file)] * 3 + [lambda: update(state_file, depth=0)] * 3]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert errors == []
+	assert loadJsonFromFile(state_file) == getJsonState()
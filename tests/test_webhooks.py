@@ -0,0 +1,15 @@
+from webhooks import EventQueue
+
+def board_created(name):
+	return {'type': 'createBoard', 'data': {'board': {'name': name}}}
+
+def test_new_consumer_starts_at_head():
+	queue = EventQueue()
+	queue.push(board_created('Old'))
+	assert queue.consume('first', 'createBoard') == []
+	queue.push(board_created('New'))
+	assert queue.consume('first', 'createBoard') == [board_created('New')]
+	assert queue.consume('second', 'createBoard') == []
+	assert queue.consume('first', 'createBoard') == []
+	queue.push(board_created('Newer'))
+	assert [a['data']['board']['name'] for a in queue.consume('second', 'createBoard')] == ['Newer']
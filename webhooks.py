@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# How many events of each type we hold on to before the oldest are dropped
+QUEUE_SIZE = 1000
+
+# An in-memory queue of Trello webhook actions, bucketed by action type.
+# Every consumer (usually a trigger plus its arguments) keeps its own cursor, so two triggers watching
+# the same type both see every event, and checking an idle type costs O(1).
+class EventQueue():
+	def __init__(self, maxsize=QUEUE_SIZE):
+		self.maxsize = maxsize
+		self.events = {}
+		self.cursors = {}
+		self.seq = 0
+		self.lock = threading.Lock()
+
+	def push(self, action):
+		with self.lock:
+			self.seq += 1
+			kind = action.get('type')
+			if kind not in self.events:
+				self.events[kind] = deque(maxlen=self.maxsize)
+			self.events[kind].append((self.seq, action))
+
+	def consume(self, consumer, kind):
+		"""
+		Returns the actions of the given type that arrived since this consumer last asked. A consumer's first call
+		only marks where it starts, so it is not handed everything buffered before it existed.
+		"""
+		with self.lock:
+			if consumer not in self.cursors:
+				self.cursors[consumer] = self.seq
+				return []
+			events = self.events.get(kind)
+			cursor = self.cursors[consumer]
+			if not events or events[-1][0] <= cursor:
+				return []
+			self.cursors[consumer] = events[-1][0]
+			return [action for seq, action in events if seq > cursor]
+
+	def clear(self):
+		with self.lock:
+			self.events.clear()
+			self.cursors.clear()
+
+webhookEvents = EventQueue()
+
+def verifySignature(body, callback_url, secret, signature):
+	# Trello signs base64(HMAC-SHA1(secret, body + callback URL)) into the X-Trello-Webhook header
+	digest = hmac.new(secret.encode('utf-8'), body + callback_url.encode('utf-8'), hashlib.sha1).digest()
+	return hmac.compare_digest(base64.b64encode(digest).decode('ascii'), signature or '')
+
+class WebhookHandler(BaseHTTPRequestHandler):
+	# Set by startReceiver; the secret is optional and skips signature checks when None
+	queue = webhookEvents
+	callback_url = None
+	secret = None
+
+	def do_HEAD(self):
+		# Trello sends a HEAD to the callback URL when the webhook is registered
+		self.send_response(200)
+		self.end_headers()
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		if self.secret and not verifySignature(body, self.callback_url, self.secret, self.headers.get('X-Trello-Webhook')):
+			self.send_response(401)
+			self.end_headers()
+			return
+		try:
+			action = json.loads(body.decode('utf-8'))['action']
+		except (ValueError, KeyError):
+			self.send_response(400)
+			self.end_headers()
+			return
+		self.queue.push(action)
+		self.send_response(200)
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		# Triggers talk JSON over stdout, so keep request logs out of it
+		pass
+
+_server = None
+
+def startReceiver(host='127.0.0.1', port=8765, callback_url=None, secret=None):
+	"""
+	Starts the webhook receiver on a background thread. Triggers answer from its queue while it runs.
+	:param callback_url: The public URL Trello posts to, needed to check signatures
+	:param secret: The Trello app secret. If given, unsigned or badly signed deliveries are rejected.
+	:return: The running server
+	"""
+	global _server
+	if _server is not None:
+		return _server
+	handler = type('ConfiguredWebhookHandler', (WebhookHandler,), {'callback_url': callback_url, 'secret': secret})
+	_server = ThreadingHTTPServer((host, port), handler)
+	thread = threading.Thread(target=_server.serve_forever, daemon=True)
+	thread.start()
+	return _server
+
+def stopReceiver():
+	global _server
+	if _server is not None:
+		_server.shutdown()
+		_server.server_close()
+		_server = None
+
+def eventMode():
+	return _server is not None
+
+def registerWebhook(client, callback_url, id_model=None):
+	# createBoard only reaches webhooks on the member, so watch 'me' unless told otherwise
+	if id_model is None:
+		id_model = client.fetch_json('/members/me', query_params={'fields': 'id'})['id']
+	# Trello refuses a second hook with the same callback and model, so reuse one left by an earlier launch
+	for hook in client.list_hooks():
+		if hook.callback_url == callback_url and hook.id_model == id_model:
+			return hook
+	return client.create_hook(callback_url, id_model, desc='SuaveTrello')
+
+def postEvent(url, action, callback_url=None, secret=None):
+	"""
+	Posts a webhook payload the way Trello would. Useful for driving event mode against a local receiver.
+	:param callback_url: With secret, signs the delivery as Trello would for that callback URL
+	"""
+	body = json.dumps({'action': action}).encode('utf-8')
+	headers = {'Content-Type': 'application/json'}
+	if secret:
+		digest = hmac.new(secret.encode('utf-8'), body + callback_url.encode('utf-8'), hashlib.sha1).digest()
+		headers['X-Trello-Webhook'] = base64.b64encode(digest).decode('ascii')
+	return requests.post(url, data=body, headers=headers)